@@ -4,10 +4,10 @@
 @Date  : 2023-11-16 10:36
 @Desc  : 通用枚举类 和 通用常量 定义
 """
-from configparser import ConfigParser
+from core.config import ReloadableConfig
 
-config = ConfigParser()
-config.read(r'./config.ini', encoding='utf-8')
+# 可热重载的配置对象，运行中需要读取最新配置时使用CONFIG的属性
+CONFIG = ReloadableConfig(r'./config.ini')
 
 # 测试使用的信息
 # HOSTNAME = config['sftp_server']['hostname']
@@ -21,15 +21,21 @@ config.read(r'./config.ini', encoding='utf-8')
 HOSTNAME = "140.143.136.179"
 USERNAME = "sftp_sencott"
 PASSWORD = "7i)m@NnCG1wDr7i"
+# 以下常量为启动时的配置值，不随配置文件重新加载而变化
 # 运行模式
-RUN_MODE = int(config['main']['run_mode'])
+RUN_MODE = CONFIG.run_mode
+# 日志配置信息
+LOG_JSON_FORMAT = CONFIG.log_json_format
 # 上传配置信息
-UPLOAD_LOCAL_PATH = config['upload']['local_path']
-UPLOAD_REMOTE_PATH = config['upload']['remote_path']
-UPLOAD_FILE_LAYOUT = config['upload']['file_layout']
-UPLOAD_TIME_INTERVAL = int(config['upload']['time_interval'])
+UPLOAD_LOCAL_PATH = CONFIG.upload_local_path
+UPLOAD_REMOTE_PATH = CONFIG.upload_remote_path
+UPLOAD_FILE_LAYOUT = CONFIG.upload_file_layout
+UPLOAD_TIME_INTERVAL = CONFIG.upload_time_interval
+UPLOAD_DELTA = CONFIG.upload_delta
+UPLOAD_DELTA_BLOCK_SIZE = CONFIG.upload_delta_block_size
+UPLOAD_SCAN_WORKERS = CONFIG.upload_scan_workers
 # 下载配置信息
-DOWNLOAD_LOCAL_PATH = config['download']['local_path']
-DOWNLOAD_REMOTE_PATH = config['download']['remote_path']
-DOWNLOAD_FILE_LAYOUT = config['download']['file_layout']
-DOWNLOAD_TIME_INTERVAL = int(config['download']['time_interval'])
+DOWNLOAD_LOCAL_PATH = CONFIG.download_local_path
+DOWNLOAD_REMOTE_PATH = CONFIG.download_remote_path
+DOWNLOAD_FILE_LAYOUT = CONFIG.download_file_layout
+DOWNLOAD_TIME_INTERVAL = CONFIG.download_time_interval
@@ -1,2 +1,14 @@
+from . import adaptive
+from . import config
+from . import dedup
+from . import disk_writer
+from . import filters
 from . import Enum
 from . import sftp_client
+from . import walker
+from . import file_tree
+from . import pipeline
+from . import profiling
+from . import process_pool
+from . import journal
+from . import planner
@@ -0,0 +1,133 @@
+# -*- coding:utf-8 -*
+"""
+@File  : adaptive.py
+@Author: DJW
+@Date  : 2023-11-24 16:10
+@Desc  : 根据实测吞吐量和往返时延自适应调整传输并发数、预读请求数的控制器
+"""
+import threading
+from logging import Logger
+
+from logging_config import sftp_client as default_logger
+
+
+class AdaptiveController:
+    """
+    AIMD自适应控制器
+    每次传输完成后上报传输字节数、用时和往返时延，控制器据此估算链路总吞吐量：
+    往返时延明显升高（服务器或链路拥塞）或总吞吐量明显下降时，预读请求数减半、并发数减半（乘性减）；
+    否则先逐步增加预读请求数，达到上限后再逐个增加并发数（加性增）。所有调整均限制在配置的范围内并输出日志。
+
+    :param min_workers:并发传输数下限
+    :param max_workers:并发传输数上限
+    :param min_requests:单个文件传输的预读请求数下限
+    :param max_requests:单个文件传输的预读请求数上限
+    :param logger:输出调整记录的日志对象
+    :param request_step:每次加性增加的预读请求数
+    :param rtt_tolerance:往返时延超过最小往返时延的倍数时视为拥塞
+    :param drop_ratio:估算总吞吐量低于历史平滑值的比例时视为拥塞
+    :param min_sample_size:参与调整的最小文件大小，单位（B），小文件的吞吐量主要受往返时延影响
+    """
+
+    def __init__(
+            self,
+            min_workers: int = 1,
+            max_workers: int = 4,
+            min_requests: int = 16,
+            max_requests: int = 256,
+            logger: Logger = default_logger,
+            request_step: int = 16,
+            rtt_tolerance: float = 2.0,
+            drop_ratio: float = 0.7,
+            min_sample_size: int = 1024 * 1024
+    ):
+        self.logger = logger
+        self.request_step = request_step
+        self.rtt_tolerance = rtt_tolerance
+        self.drop_ratio = drop_ratio
+        self.min_sample_size = min_sample_size
+        self.lock = threading.Lock()
+        self.min_workers = self.max_workers = self.min_requests = self.max_requests = 0
+        # 估算总吞吐量的指数平滑值，单位（B/s）
+        self.throughput = None
+        # 观测到的最小往返时延，单位（s）
+        self.min_rtt = None
+        self.samples_since_change = 0
+        self.workers = min_workers
+        self.requests = min_requests
+        self.set_limits(min_workers, max_workers, min_requests, max_requests)
+
+    def set_limits(self, min_workers: int, max_workers: int, min_requests: int, max_requests: int):
+        """
+        设置调整范围，当前值超出新范围时收敛到范围内
+
+        :param min_workers:并发传输数下限
+        :param max_workers:并发传输数上限
+        :param min_requests:单个文件传输的预读请求数下限
+        :param max_requests:单个文件传输的预读请求数上限
+        """
+        with self.lock:
+            self.min_workers = max(1, min_workers)
+            self.max_workers = max(self.min_workers, max_workers)
+            self.min_requests = max(1, min_requests)
+            self.max_requests = max(self.min_requests, max_requests)
+            self.__apply(min(max(self.workers, self.min_workers), self.max_workers),
+                         min(max(self.requests, self.min_requests), self.max_requests), "调整范围变化")
+
+    def record(self, size: int, duration: float, rtt: float):
+        """
+        上报一次传输的结果并据此调整
+
+        :param size:传输字节数
+        :param duration:传输用时，单位（s）
+        :param rtt:本次传输前测得的往返时延，单位（s）
+        """
+        if duration <= 0:
+            return
+        with self.lock:
+            if rtt > 0:
+                # 最小往返时延每次缓慢上浮，避免线路切换等原因导致基准时延永久升高后一直判定为拥塞
+                self.min_rtt = rtt if self.min_rtt is None else min(self.min_rtt * 1.01, rtt)
+            if size < self.min_sample_size:
+                return
+            estimate = size / duration * self.workers
+            previous = self.throughput
+            self.throughput = estimate if previous is None else 0.3 * estimate + 0.7 * previous
+            self.samples_since_change += 1
+            # 调整后等待每个并发传输都完成一次，让调整的效果体现在测量结果中
+            if self.samples_since_change < self.workers:
+                return
+            if self.min_rtt and rtt > self.min_rtt * self.rtt_tolerance:
+                self.__decrease(f"往返时延升高({round(rtt * 1000)}ms)")
+            elif previous and estimate < previous * self.drop_ratio:
+                self.__decrease("吞吐量下降")
+            elif self.requests < self.max_requests:
+                self.__apply(self.workers, min(self.requests + self.request_step, self.max_requests), "探测增加")
+            elif self.workers < self.max_workers:
+                self.__apply(self.workers + 1, self.requests, "探测增加")
+
+    def snapshot(self) -> dict:
+        """获取当前的控制状态，用于输出指标"""
+        with self.lock:
+            return {
+                "workers": self.workers,
+                "requests": self.requests,
+                "throughput": round(self.throughput, 1) if self.throughput else None,
+                "min_rtt": round(self.min_rtt, 4) if self.min_rtt else None,
+            }
+
+    def __decrease(self, reason: str):
+        """乘性减少并发数和预读请求数"""
+        self.__apply(max(self.min_workers, self.workers // 2), max(self.min_requests, self.requests // 2), reason)
+
+    def __apply(self, workers: int, requests: int, reason: str):
+        """应用新的并发数和预读请求数，发生变化时输出日志"""
+        if workers == self.workers and requests == self.requests:
+            return
+        self.logger.info(
+            f"自适应调整({reason}): 并发数 {self.workers}->{workers}, 预读请求数 {self.requests}->{requests}, "
+            f"估算吞吐量: {round((self.throughput or 0) / 1024 / 1024, 2)}MB/s, "
+            f"最小往返时延: {round((self.min_rtt or 0) * 1000)}ms")
+        self.workers = workers
+        self.requests = requests
+        self.samples_since_change = 0
@@ -0,0 +1,233 @@
+# -*- coding:utf-8 -*
+"""
+@File  : config.py
+@Author: DJW
+@Date  : 2023-11-23 10:20
+@Desc  : 可热重载的项目配置对象
+"""
+import os
+import signal
+import threading
+import time
+from configparser import ConfigParser
+
+from logging_config import main as logger
+
+
+def _split_list(value: str, commas: bool = True) -> tuple:
+    """将多行（及逗号分隔）的配置值拆分为列表"""
+    if commas:
+        value = value.replace(',', '\n')
+    return tuple(item.strip() for item in value.splitlines() if item.strip())
+
+
+def _parse_time(value: str) -> float:
+    """将"年-月-日"或"年-月-日 时:分:秒"格式的时间解析为时间戳，为空时为0"""
+    value = value.strip()
+    if not value:
+        return 0
+    fmt = '%Y-%m-%d %H:%M:%S' if ' ' in value else '%Y-%m-%d'
+    return time.mktime(time.strptime(value, fmt))
+
+
+def _parse_fsync(value: str) -> int:
+    """
+    解析下载写盘的同步策略
+
+    :param value:never：从不同步、file：文件写完后同步、数字：每写入该MB数同步一次
+    :return:-1：从不、0：文件写完后、大于0：同步间隔字节数，与core.disk_writer中的常量一致
+    """
+    value = value.strip().lower()
+    if value == 'never':
+        return -1
+    if value == 'file':
+        return 0
+    return int(value) * 1024 * 1024
+
+
+def _parse_filter(section) -> dict:
+    """
+    解析上传/下载配置中的文件过滤规则，参数对应FileFilter.set_rules
+
+    :param section:上传或下载配置段
+    :return:过滤规则字典
+    """
+    return dict(
+        include=_split_list(section.get('include', '')),
+        exclude=_split_list(section.get('exclude', '')),
+        # 正则中可能包含逗号，只按行拆分
+        include_regex=_split_list(section.get('include_regex', ''), commas=False),
+        exclude_regex=_split_list(section.get('exclude_regex', ''), commas=False),
+        prune_dirs=_split_list(section.get('prune_dirs', '')),
+        min_age=int(section.get('min_age', '0')),
+        min_size=int(section.get('min_size', '0')),
+        max_size=int(section.get('max_size', '0')),
+        mtime_after=_parse_time(section.get('mtime_after', '')),
+        mtime_before=_parse_time(section.get('mtime_before', '')),
+    )
+
+
+def _parse(path: str) -> dict:
+    """
+    读取并解析配置文件
+
+    :param path:配置文件路径
+    :return:配置项字典
+    """
+    config = ConfigParser()
+    with open(path, encoding='utf-8') as f:
+        config.read_file(f)
+    log = config['log'] if config.has_section('log') else {}
+    daemon = config['daemon'] if config.has_section('daemon') else {}
+    journal = config['journal'] if config.has_section('journal') else {}
+    profile = config['profile'] if config.has_section('profile') else {}
+    return dict(
+        # 运行模式
+        run_mode=int(config['main']['run_mode']),
+        # 日志配置信息
+        log_json_format=int(log.get('json_format', '0')),
+        # 常驻传输服务配置信息
+        daemon_socket_path=daemon.get('socket_path', '/tmp/sftp_job_daemon.sock'),
+        daemon_channels=int(daemon.get('channels', '4')),
+        # 传输日志配置信息，路径为空时不记录
+        journal_path=journal.get('path', ''),
+        # 阶段耗时记录及性能分析配置信息，参数对应Tracer.configure
+        profile=dict(
+            trace_path=profile.get('trace_path', ''),
+            max_events=int(profile.get('max_events', '100000')),
+            profile_cycles=int(profile.get('profile_cycles', '0')),
+            profile_path=profile.get('profile_path', 'profile.prof'),
+        ),
+        # 上传配置信息
+        upload_local_path=config['upload']['local_path'],
+        upload_remote_path=config['upload']['remote_path'],
+        upload_file_layout=config['upload']['file_layout'],
+        upload_time_interval=int(config['upload']['time_interval']),
+        upload_delta=int(config['upload'].get('delta_upload', '0')),
+        upload_delta_block_size=int(config['upload'].get('delta_block_size', '1048576')),
+        upload_scan_workers=int(config['upload'].get('scan_workers', '1')),
+        upload_filter=_parse_filter(config['upload']),
+        upload_dedup=int(config['upload'].get('dedup', '0')),
+        upload_dedup_index=config['upload'].get('dedup_index', 'dedup_index.db'),
+        upload_dedup_link=config['upload'].get('dedup_link', 'copy'),
+        # 下载配置信息
+        download_local_path=config['download']['local_path'],
+        download_remote_path=config['download']['remote_path'],
+        download_file_layout=config['download']['file_layout'],
+        download_time_interval=int(config['download']['time_interval']),
+        download_min_workers=int(config['download'].get('min_workers', '1')),
+        download_max_workers=int(config['download'].get('max_workers', '4')),
+        download_min_requests=int(config['download'].get('min_requests', '16')),
+        download_max_requests=int(config['download'].get('max_requests', '256')),
+        download_processes=int(config['download'].get('processes', '0')),
+        download_write_buffers=int(config['download'].get('write_buffers', '0')),
+        download_write_buffer_size=int(config['download'].get('write_buffer_size', '1048576')),
+        download_preallocate=int(config['download'].get('preallocate', '0')),
+        download_fsync=_parse_fsync(config['download'].get('fsync', 'never')),
+        download_filter=_parse_filter(config['download']),
+    )
+
+
+class ReloadableConfig:
+    """
+    可热重载的配置对象
+    配置项以属性形式读取（例如CONFIG.upload_time_interval），收到SIGHUP信号或配置文件修改时间变化后重新加载，
+    运行中的SFTP连接和待处理任务不受影响，新的配置从下一个文件或下一轮扫描开始生效
+
+    :param path:配置文件路径
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.mtime = None
+        self.values = {}
+        self.callbacks = []
+        self.changed = threading.Condition()
+        self.watch_thread = None
+        self.load()
+
+    def __getattr__(self, item):
+        try:
+            return self.__dict__['values'][item]
+        except KeyError:
+            raise AttributeError(item) from None
+
+    def load(self):
+        """加载配置文件，启动时配置有误直接抛出异常"""
+        self.mtime = os.path.getmtime(self.path)
+        self.values = _parse(self.path)
+
+    def reload(self) -> bool:
+        """
+        重新加载配置文件，新配置有误时保留原配置
+
+        :return:配置是否发生变化
+        """
+        try:
+            self.mtime = os.path.getmtime(self.path)
+            values = _parse(self.path)
+        except Exception as e:
+            logger.error(f"配置文件重新加载失败，继续使用原配置: {repr(e)}")
+            return False
+        changed = {key: value for key, value in values.items() if self.values.get(key) != value}
+        if not changed:
+            return False
+        self.values = values
+        for key, value in changed.items():
+            logger.info(f"配置已更新: {key} = {value}")
+        if 'run_mode' in changed:
+            logger.warning("运行模式的修改需要重启进程后生效")
+        for callback in self.callbacks:
+            try:
+                callback(changed)
+            except Exception as e:
+                logger.error(f"{repr(e)}")
+        with self.changed:
+            self.changed.notify_all()
+        return True
+
+    def on_reload(self, callback):
+        """
+        注册配置变化回调
+
+        :param callback:回调函数，参数为发生变化的配置项字典
+        """
+        self.callbacks.append(callback)
+
+    def sleep(self, seconds: float):
+        """
+        等待指定时间，期间配置发生变化时提前返回，使新的时间间隔立即生效
+
+        :param seconds:等待时间，单位（s）
+        """
+        with self.changed:
+            self.changed.wait(timeout=seconds)
+
+    def start_watching(self, interval: float = 5):
+        """
+        开始监听配置变化：后台线程定时检查配置文件修改时间，并在支持的平台上注册SIGHUP信号
+
+        :param interval:检查配置文件修改时间的间隔，单位（s）
+        """
+        if self.watch_thread is not None:
+            return
+        self.watch_thread = threading.Thread(target=self.__watch, args=(interval,), name="config_watch", daemon=True)
+        self.watch_thread.start()
+        # windows没有SIGHUP信号，且信号处理函数只能在主线程注册
+        if hasattr(signal, 'SIGHUP') and threading.current_thread() is threading.main_thread():
+            signal.signal(signal.SIGHUP, self.__on_sighup)
+
+    def __on_sighup(self, signum, frame):
+        """SIGHUP信号处理：在新线程中重新加载，避免在信号处理函数中等待锁"""
+        logger.info("收到SIGHUP信号，重新加载配置文件")
+        threading.Thread(target=self.reload, name="config_reload", daemon=True).start()
+
+    def __watch(self, interval: float):
+        """后台线程：配置文件修改时间变化时重新加载"""
+        while True:
+            time.sleep(interval)
+            try:
+                if os.path.getmtime(self.path) != self.mtime:
+                    self.reload()
+            except OSError as e:
+                logger.error(f"{repr(e)}")
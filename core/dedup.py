@@ -0,0 +1,126 @@
+# -*- coding:utf-8 -*
+"""
+@File  : dedup.py
+@Author: DJW
+@Date  : 2023-12-05 09:50
+@Desc  : 内容寻址去重索引：缓存本地文件的内容摘要，记录远程已有内容所在的文件，相同内容的文件不再重复上传
+"""
+import hashlib
+import os
+import sqlite3
+import threading
+from typing import Optional, NamedTuple
+
+# 流式计算摘要时每次读取的大小，单位（B）
+HASH_CHUNK_SIZE = 1024 * 1024
+
+
+def hash_file(local_file: str) -> str:
+    """
+    流式计算本地文件内容的sha256摘要
+
+    :param local_file:本地文件绝对路径
+    :return:十六进制摘要
+    """
+    digest = hashlib.sha256()
+    with open(local_file, 'rb') as f:
+        for chunk in iter(lambda: f.read(HASH_CHUNK_SIZE), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class RemoteObject(NamedTuple):
+    """远程已有的内容"""
+    remote_file: str  # 远程文件绝对路径
+    size: int  # 文件大小，单位（B）
+
+
+class DedupIndex:
+    """
+    内容寻址去重索引（sqlite，WAL模式）
+    本地索引按(路径, 大小, 修改时间)缓存文件的内容摘要，文件未变化时不再重新计算；
+    远程索引记录每个摘要对应的一个远程文件，由本程序上传成功的文件登记，使用前需确认远程文件仍然存在且大小一致
+
+    :param path:sqlite数据库文件路径
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS local_hashes ("
+            "path TEXT PRIMARY KEY, size INTEGER NOT NULL, mtime REAL NOT NULL, digest TEXT NOT NULL)")
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS remote_objects ("
+            "digest TEXT PRIMARY KEY, remote_file TEXT NOT NULL, size INTEGER NOT NULL)")
+        self.lock = threading.Lock()
+
+    def file_digest(self, local_file: str, size: int, mtime: float) -> str:
+        """
+        获取本地文件的内容摘要，路径、大小和修改时间均未变化时直接使用缓存
+
+        :param local_file:本地文件绝对路径
+        :param size:文件大小，单位（B）
+        :param mtime:文件修改时间戳
+        :return:十六进制摘要
+        """
+        with self.lock:
+            row = self.conn.execute(
+                "SELECT digest FROM local_hashes WHERE path = ? AND size = ? AND mtime = ?",
+                (local_file, size, mtime)).fetchone()
+        if row:
+            return row[0]
+        digest = hash_file(local_file)
+        with self.lock:
+            self.conn.execute("INSERT OR REPLACE INTO local_hashes (path, size, mtime, digest) VALUES (?, ?, ?, ?)",
+                              (local_file, size, mtime, digest))
+        return digest
+
+    def find_remote(self, digest: str) -> Optional[RemoteObject]:
+        """
+        查询远程已有相同内容的文件
+
+        :param digest:十六进制摘要
+        :return:远程文件，没有时为None
+        """
+        with self.lock:
+            row = self.conn.execute("SELECT remote_file, size FROM remote_objects WHERE digest = ?",
+                                    (digest,)).fetchone()
+        return RemoteObject(*row) if row else None
+
+    def add_remote(self, digest: str, remote_file: str, size: int):
+        """
+        登记远程文件的内容
+
+        :param digest:十六进制摘要
+        :param remote_file:远程文件绝对路径
+        :param size:文件大小，单位（B）
+        """
+        with self.lock:
+            self.conn.execute("INSERT OR REPLACE INTO remote_objects (digest, remote_file, size) VALUES (?, ?, ?)",
+                              (digest, remote_file, size))
+
+    def forget_remote(self, digest: str):
+        """
+        删除远程索引中失效（远程文件已被删除或修改）的记录
+
+        :param digest:十六进制摘要
+        """
+        with self.lock:
+            self.conn.execute("DELETE FROM remote_objects WHERE digest = ?", (digest,))
+
+    def prune_local(self):
+        """删除本地索引中已不存在的文件（例如上传后已删除的本地文件）的缓存"""
+        with self.lock:
+            paths = [row[0] for row in self.conn.execute("SELECT path FROM local_hashes")]
+        missing = [(path,) for path in paths if not os.path.exists(path)]
+        if missing:
+            with self.lock:
+                self.conn.executemany("DELETE FROM local_hashes WHERE path = ?", missing)
+
+    def close(self):
+        """关闭数据库连接"""
+        with self.lock:
+            self.conn.close()
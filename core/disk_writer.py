@@ -0,0 +1,136 @@
+# -*- coding:utf-8 -*
+"""
+@File  : disk_writer.py
+@Author: DJW
+@Date  : 2023-12-01 15:20
+@Desc  : 下载文件的独立写盘线程：网络读取的数据块放入有界缓冲环，由写盘线程写入本地文件，使网络读取和磁盘写入并行
+"""
+import os
+import queue
+import threading
+
+# 同步策略：从不主动同步，由操作系统决定何时写回磁盘
+FSYNC_NEVER = -1
+# 同步策略：文件写完后同步一次；大于0时表示每写入该字节数同步一次，文件写完后再同步一次
+FSYNC_FILE = 0
+# 预分配空间时先写入的临时文件后缀，写完后重命名为目标文件
+PART_SUFFIX = ".part"
+
+
+class DiskWriter:
+    """
+    独立写盘线程
+    下载线程调用write将读取到的数据块放入有界缓冲环后立即继续读取下一块，写盘线程按顺序取出写入本地文件；
+    缓冲环已满（磁盘跟不上网络）时write等待，内存占用不超过buffers个数据块。
+    预分配空间时先写入"本地文件.part"，写完并截断到实际大小后再重命名，进程中途退出时不会留下大小完整但内容不全的目标文件。
+    支持with语句：正常结束时完成写入，出现异常时丢弃未写入的数据块并关闭文件。
+
+    :param local_file:本地文件绝对路径
+    :param size:文件大小，单位（B），用于预分配空间
+    :param buffers:缓冲环大小（数据块个数），为2时即双缓冲
+    :param preallocate:是否预先分配文件空间，减少文件系统碎片及写入时的元数据更新
+    :param fsync_every:同步策略，FSYNC_NEVER：从不、FSYNC_FILE：文件写完后、大于0：每写入该字节数
+    """
+
+    def __init__(self, local_file: str, size: int, buffers: int = 4, preallocate: bool = False,
+                 fsync_every: int = FSYNC_NEVER):
+        self.local_file = local_file
+        self.path = local_file + PART_SUFFIX if preallocate else local_file
+        self.fsync_every = fsync_every
+        self.ring = queue.Queue(maxsize=max(1, buffers))
+        self.written = 0
+        self.error = None
+        # 数据块直接以系统调用写入，不再经过Python的文件缓冲区复制一次
+        self.file = open(self.path, 'wb', buffering=0)
+        try:
+            if preallocate and size:
+                self.__preallocate(size)
+        except OSError:
+            # 例如磁盘空间不足，不能把预分配失败的临时文件留在已满的磁盘上
+            self.file.close()
+            self.__remove_part()
+            raise
+        self.thread = threading.Thread(target=self.__run, name="disk_writer", daemon=True)
+        self.thread.start()
+
+    def __enter__(self) -> 'DiskWriter':
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+
+    def write(self, data: bytes):
+        """
+        将数据块放入缓冲环，缓冲环已满时等待写盘线程腾出空间
+
+        :param data:数据块
+        """
+        if self.error is not None:
+            raise self.error
+        self.ring.put(data)
+
+    def close(self):
+        """
+        等待写盘线程写完全部数据块，按同步策略同步后关闭文件，预分配时截断并重命名为目标文件
+        写盘线程在最后一次write之后才出错时，在这里抛出异常并删除临时文件（with语句此时不会再调用abort）
+        """
+        self.ring.put(None)
+        self.thread.join()
+        try:
+            if self.error is not None:
+                raise self.error
+            if self.path != self.local_file:
+                self.file.truncate(self.written)
+            if self.fsync_every != FSYNC_NEVER:
+                os.fsync(self.file.fileno())
+        except BaseException:
+            self.file.close()
+            self.__remove_part()
+            raise
+        self.file.close()
+        if self.path != self.local_file:
+            os.replace(self.path, self.local_file)
+
+    def abort(self):
+        """丢弃未写入的数据块并关闭文件；预分配的临时文件内容不完整，直接删除"""
+        self.ring.put(None)
+        self.thread.join()
+        self.file.close()
+        self.__remove_part()
+
+    def __remove_part(self):
+        """删除预分配的临时文件"""
+        if self.path != self.local_file and os.path.exists(self.path):
+            os.remove(self.path)
+
+    def __preallocate(self, size: int):
+        """预分配文件空间，Linux使用posix_fallocate分配实际的磁盘块，其它系统扩展文件大小"""
+        if hasattr(os, 'posix_fallocate'):
+            os.posix_fallocate(self.file.fileno(), 0, size)
+        else:
+            self.file.truncate(size)
+
+    def __run(self):
+        """写盘线程：按顺序取出数据块写入，出错后继续取出数据块丢弃，避免下载线程阻塞在已满的缓冲环上"""
+        unsynced = 0
+        while True:
+            data = self.ring.get()
+            if data is None:
+                break
+            if self.error is not None:
+                continue
+            try:
+                view = memoryview(data)
+                while view:
+                    view = view[self.file.write(view):]
+                self.written += len(data)
+                if self.fsync_every > 0:
+                    unsynced += len(data)
+                    if unsynced >= self.fsync_every:
+                        os.fsync(self.file.fileno())
+                        unsynced = 0
+            except OSError as e:
+                self.error = e
@@ -0,0 +1,150 @@
+# -*- coding:utf-8 -*
+"""
+@File  : file_tree.py
+@Author: DJW
+@Date  : 2023-11-21 14:05
+@Desc  : 紧凑的目录树表示，用于百万级条目的远程目录列表
+"""
+import os
+import stat
+from array import array
+from typing import Iterator, Optional
+
+from core.walker import FileEntry
+
+# 每隔该数量的条目完整保存一次文件名，按id读取文件名时最多向前解码该数量的条目
+_RESTART_INTERVAL = 16
+# 与前一个文件名共用前缀的最大长度（单字节保存）
+_MAX_PREFIX = 255
+
+
+class FileTree:
+    """
+    紧凑目录树：按列存储每个条目的父目录id、大小和修改时间，不为每个条目创建Python对象。
+    文件名以UTF-8编码依次写入同一个字节缓冲区，并按前缀压缩：同一目录下按文件名排序的相邻条目通常有较长的公共前缀
+    （例如按时间命名的数据包），每个条目只保存与前一个条目共用的前缀长度和剩余部分，每隔_RESTART_INTERVAL个条目完整保存一次。
+    修改时间按SFTP协议（v3）的整数秒保存。目录的完整路径只保存一份，文件路径在遍历时按需拼接。
+    条目id按添加顺序递增，根目录id为0。
+
+    :param root_path:根目录绝对路径
+    :param sep:路径分隔符，本地目录树使用os.sep，远程目录树使用"/"
+    """
+    __slots__ = ("name_buf", "name_offsets", "name_prefixes", "last_name", "parents", "sizes", "mtimes", "dir_paths",
+                 "file_count", "sep", "incomplete")
+
+    def __init__(self, root_path: str, sep: str = os.sep):
+        self.sep = sep
+        self.name_buf = bytearray()
+        # 第i个条目保存的文件名剩余部分为name_buf[name_offsets[i]:name_offsets[i + 1]]
+        self.name_offsets = array('I', [0])
+        # 第i个条目与第i-1个条目共用的文件名前缀长度（字节）
+        self.name_prefixes = array('B')
+        self.last_name = b""
+        self.parents = array('i')
+        self.sizes = array('q')
+        self.mtimes = array('I')
+        # 目录id -> 目录绝对路径
+        self.dir_paths = {}
+        self.file_count = 0
+        # 列出失败、其中的条目不完整的子目录（以"/"分隔的相对路径）
+        self.incomplete = []
+        self.add(-1, "", 0, 0, stat.S_IFDIR, root_path)
+
+    def __len__(self) -> int:
+        return len(self.parents)
+
+    def add(self, parent: int, name: str, size: int, mtime: float, mode: int, path: Optional[str] = None) -> int:
+        """
+        添加一个条目
+
+        :param parent:父目录id
+        :param name:文件名
+        :param size:文件大小，单位（B）
+        :param mtime:修改时间戳
+        :param mode:st_mode权限位，用于区分目录和文件
+        :param path:目录的绝对路径，仅目录需要传入；为空时由父目录路径拼接
+        :return:条目id
+        """
+        entry_id = len(self.parents)
+        # 无法解码的字节经surrogateescape还原，不丢失
+        encoded = name.encode('utf-8', 'surrogateescape')
+        prefix = 0
+        if entry_id % _RESTART_INTERVAL:
+            last = self.last_name
+            limit = min(len(last), len(encoded), _MAX_PREFIX)
+            while prefix < limit and last[prefix] == encoded[prefix]:
+                prefix += 1
+        self.last_name = encoded
+        self.name_buf += encoded[prefix:]
+        try:
+            self.name_offsets.append(len(self.name_buf))
+        except OverflowError:
+            # 文件名总长度超过4GB时改用64位偏移
+            self.name_offsets = array('q', self.name_offsets)
+            self.name_offsets.append(len(self.name_buf))
+        self.name_prefixes.append(prefix)
+        self.parents.append(parent)
+        self.sizes.append(size or 0)
+        self.mtimes.append(int(mtime or 0))
+        if stat.S_ISDIR(mode or 0):
+            self.dir_paths[entry_id] = path or self._join(self.dir_paths[parent], name)
+        else:
+            self.file_count += 1
+        return entry_id
+
+    def name(self, entry_id: int) -> str:
+        """
+        获取条目的文件名：从最近一个完整保存的条目开始依次还原
+
+        :param entry_id:条目id
+        :return:文件名
+        """
+        start = entry_id - entry_id % _RESTART_INTERVAL
+        encoded = b""
+        for i in range(start, entry_id + 1):
+            encoded = encoded[:self.name_prefixes[i]] + self.name_buf[self.name_offsets[i]:self.name_offsets[i + 1]]
+        return encoded.decode('utf-8', 'surrogateescape')
+
+    def is_dir(self, entry_id: int) -> bool:
+        """条目是否为目录"""
+        return entry_id in self.dir_paths
+
+    def path(self, entry_id: int) -> str:
+        """
+        获取条目的绝对路径
+
+        :param entry_id:条目id
+        :return:绝对路径
+        """
+        if entry_id in self.dir_paths:
+            return self.dir_paths[entry_id]
+        return self._join(self.dir_paths[self.parents[entry_id]], self.name(entry_id))
+
+    def _join(self, dir_path: str, name: str) -> str:
+        """拼接目录路径和文件名"""
+        if dir_path.endswith(self.sep):
+            return dir_path + name
+        return dir_path + self.sep + name
+
+    def iter_files(self) -> Iterator[FileEntry]:
+        """
+        按添加顺序（即目录深度优先、文件名排序）遍历所有文件
+
+        :return:文件条目生成器
+        """
+        dir_paths = self.dir_paths
+        name_buf = self.name_buf
+        offsets = self.name_offsets
+        prefixes = self.name_prefixes
+        parents = self.parents
+        sizes = self.sizes
+        mtimes = self.mtimes
+        join = self._join
+        encoded = b""
+        for entry_id in range(1, len(parents)):
+            # 目录条目也参与前缀压缩，需要依次还原
+            encoded = encoded[:prefixes[entry_id]] + name_buf[offsets[entry_id]:offsets[entry_id + 1]]
+            if entry_id in dir_paths:
+                continue
+            yield FileEntry(join(dir_paths[parents[entry_id]], encoded.decode('utf-8', 'surrogateescape')),
+                            sizes[entry_id], mtimes[entry_id])
@@ -0,0 +1,179 @@
+# -*- coding:utf-8 -*
+"""
+@File  : filters.py
+@Author: DJW
+@Date  : 2023-12-01 09:40
+@Desc  : 文件过滤规则：包含/排除的通配符和正则、目录剪枝、文件年龄、大小及修改时间窗口，编译一次后在遍历目录时使用
+"""
+import fnmatch
+import re
+import time
+from typing import Iterable, NamedTuple, Optional, Pattern
+
+
+class _Rules(NamedTuple):
+    """编译后的过滤规则"""
+    file_layout: str
+    include_names: Optional[Pattern]
+    include_paths: Optional[Pattern]
+    exclude_names: Optional[Pattern]
+    exclude_paths: Optional[Pattern]
+    prune_names: Optional[Pattern]
+    prune_paths: Optional[Pattern]
+    min_age: float
+    min_size: int
+    max_size: int
+    mtime_after: float
+    mtime_before: float
+
+
+def _compile_globs(patterns: Iterable[str]) -> Optional[Pattern]:
+    """将多个通配符合并编译为一个正则，没有规则时为None"""
+    patterns = [p for p in patterns if p]
+    if not patterns:
+        return None
+    return re.compile("|".join(f"(?:{fnmatch.translate(p)})" for p in patterns))
+
+
+def _compile_regexes(patterns: Iterable[str]) -> Optional[Pattern]:
+    """将多个正则合并编译为一个正则，没有规则时为None"""
+    patterns = [p for p in patterns if p]
+    if not patterns:
+        return None
+    return re.compile("|".join(f"(?:{p})" for p in patterns))
+
+
+def _split_globs(patterns: Iterable[str]) -> tuple:
+    """按是否包含"/"将通配符分为匹配文件名的和匹配相对路径的两组"""
+    patterns = list(patterns)
+    return [p for p in patterns if "/" not in p], [p for p in patterns if "/" in p]
+
+
+class FileFilter:
+    """
+    文件过滤器
+    规则在创建或调用set_rules时编译为正则，遍历目录时只做匹配：
+    目录命中剪枝规则时整个子树不再列出，文件依次检查文件格式、包含/排除规则、大小、修改时间窗口及最小年龄。
+    通配符不含"/"时匹配文件名（目录名），含"/"时匹配相对于遍历根目录、以"/"分隔的相对路径；正则均匹配相对路径。
+
+    :param file_layout:文件格式（文件名后缀），为空时不限制
+    :param include:包含的通配符列表，为空时包含全部
+    :param exclude:排除的通配符列表
+    :param include_regex:包含的正则列表（在相对路径中搜索），为空时包含全部
+    :param exclude_regex:排除的正则列表（在相对路径中搜索）
+    :param prune_dirs:剪枝的目录通配符列表，命中的目录不再遍历
+    :param min_age:最小文件年龄，单位（s），修改时间距今不足该值的文件视为仍在写入，本轮跳过
+    :param min_size:最小文件大小，单位（B）
+    :param max_size:最大文件大小，单位（B），为0时不限制
+    :param mtime_after:只包含修改时间不早于该时间戳的文件，为0时不限制
+    :param mtime_before:只包含修改时间早于该时间戳的文件，为0时不限制
+    """
+
+    def __init__(self, file_layout: str = "", **rules):
+        self.rules = None
+        self.set_rules(file_layout, **rules)
+
+    def set_rules(
+            self,
+            file_layout: str = "",
+            include: Iterable[str] = (),
+            exclude: Iterable[str] = (),
+            include_regex: Iterable[str] = (),
+            exclude_regex: Iterable[str] = (),
+            prune_dirs: Iterable[str] = (),
+            min_age: float = 0,
+            min_size: int = 0,
+            max_size: int = 0,
+            mtime_after: float = 0,
+            mtime_before: float = 0
+    ):
+        """
+        编译并替换过滤规则，遍历中的线程从下一个条目开始使用新规则
+
+        参数含义同类说明
+        """
+        include_names, include_paths = _split_globs(include)
+        exclude_names, exclude_paths = _split_globs(exclude)
+        prune_names, prune_paths = _split_globs(prune_dirs)
+        # 匹配相对路径的通配符与正则合并编译，通配符需匹配完整的相对路径
+        include_paths = ["^" + fnmatch.translate(p) for p in include_paths] + list(include_regex)
+        exclude_paths = ["^" + fnmatch.translate(p) for p in exclude_paths] + list(exclude_regex)
+        self.rules = _Rules(
+            file_layout=file_layout,
+            include_names=_compile_globs(include_names),
+            include_paths=_compile_regexes(include_paths),
+            exclude_names=_compile_globs(exclude_names),
+            exclude_paths=_compile_regexes(exclude_paths),
+            prune_names=_compile_globs(prune_names),
+            prune_paths=_compile_globs(prune_paths),
+            min_age=min_age,
+            min_size=min_size,
+            max_size=max_size,
+            mtime_after=mtime_after,
+            mtime_before=mtime_before,
+        )
+
+    def match_dir(self, rel_path: str, name: str) -> bool:
+        """
+        目录是否需要遍历
+
+        :param rel_path:目录相对于遍历根目录的相对路径，以"/"分隔
+        :param name:目录名
+        :return:需要遍历：True、剪枝：False
+        """
+        rules = self.rules
+        if rules.prune_names is not None and rules.prune_names.match(name):
+            return False
+        if rules.prune_paths is not None and rules.prune_paths.match(rel_path):
+            return False
+        return True
+
+    def match_name(self, rel_path: str, name: str) -> bool:
+        """
+        文件名及相对路径是否符合规则，不需要文件属性，可在获取文件属性之前调用
+
+        :param rel_path:文件相对于遍历根目录的相对路径，以"/"分隔
+        :param name:文件名
+        :return:是否符合
+        """
+        rules = self.rules
+        if not name.endswith(rules.file_layout):
+            return False
+        if rules.include_names is not None and not rules.include_names.match(name):
+            return False
+        if rules.include_paths is not None and not rules.include_paths.search(rel_path):
+            return False
+        if rules.exclude_names is not None and rules.exclude_names.match(name):
+            return False
+        if rules.exclude_paths is not None and rules.exclude_paths.search(rel_path):
+            return False
+        return True
+
+    def match_stat(self, size: int, mtime: float) -> bool:
+        """
+        文件大小及修改时间是否符合规则
+
+        :param size:文件大小，单位（B）
+        :param mtime:修改时间戳
+        :return:是否符合
+        """
+        rules = self.rules
+        if size < rules.min_size or (rules.max_size and size > rules.max_size):
+            return False
+        if (rules.mtime_after and mtime < rules.mtime_after) or (rules.mtime_before and mtime >= rules.mtime_before):
+            return False
+        if rules.min_age and time.time() - mtime < rules.min_age:
+            return False
+        return True
+
+    def match_file(self, rel_path: str, name: str, size: int, mtime: float) -> bool:
+        """
+        文件是否符合全部规则
+
+        :param rel_path:文件相对于遍历根目录的相对路径，以"/"分隔
+        :param name:文件名
+        :param size:文件大小，单位（B）
+        :param mtime:修改时间戳
+        :return:是否符合
+        """
+        return self.match_name(rel_path, name) and self.match_stat(size, mtime)
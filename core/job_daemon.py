@@ -0,0 +1,319 @@
+# -*- coding:utf-8 -*
+"""
+@File  : job_daemon.py
+@Author: DJW
+@Date  : 2023-11-27 11:15
+@Desc  : 常驻传输服务：持有SFTP连接池，通过Unix域套接字接收上传、下载、列目录、查询、删除任务，并提供客户端接口
+"""
+import json
+import os
+import queue
+import socket
+import socketserver
+import stat
+import threading
+import time
+from contextlib import contextmanager
+from typing import Iterator, List, Optional, Callable
+
+import paramiko
+from paramiko.ssh_exception import SSHException
+
+from core.sftp_client import SFTPClient
+from logging_config import sftp_client as logger
+
+# 传输进度回复的最小间隔，单位（s）
+PROGRESS_INTERVAL = 0.5
+# 列目录时每条回复包含的最大条目数
+LIST_BATCH_SIZE = 1000
+
+
+class ChannelPool:
+    """
+    SFTP通道池：所有通道复用同一个SSH连接，任务执行时借出一个通道，结束后归还
+    连接断开时由第一个发现的线程负责重连，其它通道随之失效并在下次借出时重新打开
+
+    :param sftp_c:sftp客户端类，持有SSH连接
+    :param size:通道池大小，即同时执行的任务数上限
+    """
+
+    def __init__(self, sftp_c: SFTPClient, size: int = 4):
+        self.sftp_c = sftp_c
+        self.channels = queue.Queue()
+        for _ in range(size):
+            self.channels.put(None)
+        self.reconnect_lock = threading.Lock()
+
+    @contextmanager
+    def channel(self) -> Iterator[paramiko.SFTPClient]:
+        """借出一个可用的SFTP通道"""
+        channel = self.channels.get()
+        try:
+            if channel is None or channel.sock.closed:
+                channel = self.__open()
+            yield channel
+        except (SSHException, EOFError):
+            channel = None
+            raise
+        finally:
+            self.channels.put(channel)
+
+    def __open(self) -> paramiko.SFTPClient:
+        """打开新通道，SSH连接已断开时先重连"""
+        with self.reconnect_lock:
+            if self.sftp_c.transport is None or not self.sftp_c.transport.is_active():
+                self.sftp_c.reconnect()
+            return self.sftp_c.open_sftp_channel()
+
+
+class JobServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    """
+    常驻传输服务
+    每个请求为一行JSON（例如{"op": "upload", "local": "/path/a.tar.gz", "remote": "/path/a.tar.gz"}），
+    服务端逐行回复JSON：传输过程中回复{"status": "progress", ...}，结束时回复{"status": "ok", ...}或{"status": "error", ...}
+    一个连接上可以依次发送多个请求
+
+    :param sftp_c:已连接的sftp客户端类
+    :param socket_path:Unix域套接字路径
+    :param channels:SFTP通道池大小
+    """
+    daemon_threads = True
+
+    def __init__(self, sftp_c: SFTPClient, socket_path: str, channels: int = 4):
+        self.sftp_c = sftp_c
+        self.pool = ChannelPool(sftp_c, channels)
+        self.socket_path = socket_path
+        if os.path.exists(socket_path):
+            os.remove(socket_path)
+        super().__init__(socket_path, _JobHandler)
+
+    def server_bind(self):
+        """
+        绑定时临时设置umask，使套接字文件创建时即只允许当前用户访问
+        绑定后再chmod会留下一个窗口，其它本地用户可以在此期间连接并提交任意本地路径的传输任务
+        """
+        old_umask = os.umask(0o077)
+        try:
+            super().server_bind()
+        finally:
+            os.umask(old_umask)
+
+    def server_close(self):
+        super().server_close()
+        if os.path.exists(self.socket_path):
+            os.remove(self.socket_path)
+
+    def run_job(self, job: dict, reply: Callable[[dict], None]):
+        """
+        执行单个任务
+
+        :param job:任务内容
+        :param reply:回复函数
+        """
+        op = job.get("op")
+        handler = getattr(self, f"_op_{op}", None)
+        if handler is None:
+            reply({"status": "error", "message": f"不支持的操作: {op}"})
+            return
+        time_start = time.time()
+        try:
+            with self.pool.channel() as channel:
+                result = handler(channel, job, reply)
+            reply({"status": "ok", "duration": round(time.time() - time_start, 3), **(result or {})})
+        except Exception as e:
+            logger.error(f"任务执行失败 {job}: {repr(e)}")
+            reply({"status": "error", "message": repr(e)})
+
+    @staticmethod
+    def _progress(reply: Callable[[dict], None]) -> Callable[[int, int], None]:
+        """生成按时间间隔节流的传输进度回调"""
+        last = [0.0]
+
+        def callback(transferred: int, total: int):
+            now = time.time()
+            if now - last[0] >= PROGRESS_INTERVAL or transferred == total:
+                last[0] = now
+                reply({"status": "progress", "transferred": transferred, "total": total})
+
+        return callback
+
+    def _op_upload(self, channel: paramiko.SFTPClient, job: dict, reply: Callable[[dict], None]) -> dict:
+        attr = channel.put(job["local"], job["remote"], callback=self._progress(reply))
+        logger.info(f"任务上传完成: [ {job['local']} ] -> [ {job['remote']} ]")
+        return {"size": attr.st_size}
+
+    def _op_download(self, channel: paramiko.SFTPClient, job: dict, reply: Callable[[dict], None]) -> dict:
+        channel.get(job["remote"], job["local"], callback=self._progress(reply))
+        logger.info(f"任务下载完成: [ {job['remote']} ] -> [ {job['local']} ]")
+        return {"size": os.path.getsize(job["local"])}
+
+    def _op_list(self, channel: paramiko.SFTPClient, job: dict, reply: Callable[[dict], None]) -> dict:
+        count = 0
+        batch = []
+        for item in channel.listdir_iter(job["remote"]):
+            batch.append(_attr_to_dict(item))
+            if len(batch) >= LIST_BATCH_SIZE:
+                reply({"status": "entries", "entries": batch})
+                count += len(batch)
+                batch = []
+        if batch:
+            reply({"status": "entries", "entries": batch})
+            count += len(batch)
+        return {"count": count}
+
+    def _op_stat(self, channel: paramiko.SFTPClient, job: dict, reply: Callable[[dict], None]) -> dict:
+        attr = channel.stat(job["remote"])
+        attr.filename = os.path.basename(job["remote"])
+        return {"entry": _attr_to_dict(attr)}
+
+    def _op_delete(self, channel: paramiko.SFTPClient, job: dict, reply: Callable[[dict], None]) -> dict:
+        channel.remove(job["remote"])
+        logger.info(f"任务删除远程文件: [ {job['remote']} ]")
+        return {}
+
+
+def _attr_to_dict(attr: paramiko.SFTPAttributes) -> dict:
+    """将SFTP文件属性转换为可序列化的字典"""
+    return {
+        "name": attr.filename,
+        "type": "dir" if stat.S_ISDIR(attr.st_mode or 0) else "file",
+        "size": attr.st_size,
+        "mtime": attr.st_mtime,
+    }
+
+
+class _JobHandler(socketserver.StreamRequestHandler):
+    """逐行读取任务并执行"""
+
+    def setup(self):
+        super().setup()
+        self.disconnected = False
+
+    def handle(self):
+        for line in self.rfile:
+            if self.disconnected:
+                break
+            if not line.strip():
+                continue
+            try:
+                job = json.loads(line)
+            except ValueError as e:
+                self.reply({"status": "error", "message": f"请求格式有误: {e}"})
+                continue
+            self.server.run_job(job, self.reply)
+
+    def reply(self, message: dict):
+        """回复客户端；客户端已断开时不再回复，已开始的任务继续执行完成"""
+        if self.disconnected:
+            return
+        try:
+            self.wfile.write(json.dumps(message, ensure_ascii=False).encode("utf-8") + b"\n")
+            self.wfile.flush()
+        except OSError as e:
+            self.disconnected = True
+            logger.warning(f"客户端已断开，不再回复: {repr(e)}")
+
+
+class JobClient:
+    """
+    常驻传输服务的客户端，每次调用新建一个Unix域套接字连接，不需要SSH握手
+
+    :param socket_path:常驻传输服务的Unix域套接字路径
+    :param timeout:等待回复的超时时间，单位（s），为空时不超时
+    """
+
+    def __init__(self, socket_path: str, timeout: Optional[float] = None):
+        self.socket_path = socket_path
+        self.timeout = timeout
+
+    def request(self, op: str, **params) -> Iterator[dict]:
+        """
+        发送任务并逐条返回服务端的回复，最后一条回复的status为"ok"或"error"
+
+        :param op:操作类型，upload/download/list/stat/delete
+        :param params:任务参数
+        :return:回复生成器
+        """
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+            sock.settimeout(self.timeout)
+            sock.connect(self.socket_path)
+            sock.sendall(json.dumps({"op": op, **params}, ensure_ascii=False).encode("utf-8") + b"\n")
+            with sock.makefile("rb") as f:
+                for line in f:
+                    message = json.loads(line)
+                    yield message
+                    if message.get("status") in ("ok", "error"):
+                        return
+
+    def call(self, op: str, progress: Callable[[int, int], None] = None, **params) -> dict:
+        """
+        发送任务并等待结束
+
+        :param op:操作类型
+        :param progress:传输进度回调函数，参数为已传输字节数和总字节数
+        :param params:任务参数
+        :return:最后一条回复
+        """
+        message = {"status": "error", "message": "连接已关闭"}
+        for message in self.request(op, **params):
+            if message["status"] == "progress" and progress:
+                progress(message["transferred"], message["total"])
+            elif message["status"] == "error":
+                logger.error(f"任务执行失败 [ {op} {params} ]: {message['message']}")
+        return message
+
+    def upload(self, local_file: str, remote_file: str, progress: Callable[[int, int], None] = None) -> bool:
+        """
+        上传单个文件
+
+        :param local_file:本地文件的绝对路径
+        :param remote_file:远程文件的绝对路径
+        :param progress:传输进度回调函数
+        :return:是否成功
+        """
+        return self.call("upload", progress, local=local_file, remote=remote_file)["status"] == "ok"
+
+    def download(self, remote_file: str, local_file: str, progress: Callable[[int, int], None] = None) -> bool:
+        """
+        下载单个文件
+
+        :param remote_file:远程文件的绝对路径
+        :param local_file:本地文件的绝对路径
+        :param progress:传输进度回调函数
+        :return:是否成功
+        """
+        return self.call("download", progress, remote=remote_file, local=local_file)["status"] == "ok"
+
+    def list(self, remote_path: str) -> List[dict]:
+        """
+        列出远程目录下的条目
+
+        :param remote_path:远程目录的绝对路径
+        :return:条目列表（name/type/size/mtime），出错时为空列表
+        """
+        entries = []
+        for message in self.request("list", remote=remote_path):
+            if message["status"] == "entries":
+                entries += message["entries"]
+            elif message["status"] == "error":
+                logger.error(f"任务执行失败 [ list {remote_path} ]: {message['message']}")
+                return []
+        return entries
+
+    def stat(self, remote_file: str) -> Optional[dict]:
+        """
+        查询远程文件属性
+
+        :param remote_file:远程文件的绝对路径
+        :return:文件属性（name/type/size/mtime），不存在或出错时为None
+        """
+        return self.call("stat", remote=remote_file).get("entry")
+
+    def delete(self, remote_file: str) -> bool:
+        """
+        删除远程文件
+
+        :param remote_file:远程文件的绝对路径
+        :return:是否成功
+        """
+        return self.call("delete", remote=remote_file)["status"] == "ok"
@@ -0,0 +1,193 @@
+# -*- coding:utf-8 -*
+"""
+@File  : journal.py
+@Author: DJW
+@Date  : 2023-11-29 10:30
+@Desc  : 基于sqlite(WAL模式)的传输日志，进程崩溃重启后可以从中断处继续，无需重新逐个核对文件
+"""
+import sqlite3
+import threading
+import time
+from typing import NamedTuple, Optional, List
+
+from logging_config import sftp_client as logger
+
+# 传输状态
+QUEUED = "queued"  # 已排队
+IN_PROGRESS = "in_progress"  # 传输中
+TRANSFERRED = "transferred"  # 已传输，尚未校验
+VERIFIED = "verified"  # 已校验
+SOURCE_DELETED = "source_deleted"  # 源文件已删除，传输流程结束
+
+# 传输方向
+UPLOAD = "upload"
+DOWNLOAD = "download"
+
+# 传输方式
+FULL = ""  # 按顺序写入目标文件，目标文件的大小即已传输的字节数，中断后可以续传
+DELTA = "delta"  # 增量上传，原地改写远端文件，远端文件的大小不代表进度，中断后需要重新比较全部分块
+
+
+class JournalEntry(NamedTuple):
+    """传输日志记录"""
+    direction: str  # 传输方向
+    source: str  # 源文件绝对路径（上传为本地路径，下载为远程路径）
+    target: str  # 目标文件绝对路径
+    state: str  # 传输状态
+    offset: int  # 已确认传输的字节数
+    size: int  # 记录时源文件的大小，单位（B）
+    mtime: float  # 记录时源文件的修改时间戳
+    mode: str = FULL  # 传输方式
+
+    def matches(self, size: int, mtime: float) -> bool:
+        """源文件的大小和修改时间是否与记录一致，不一致说明文件已被替换，记录作废"""
+        return self.size == size and self.mtime == mtime
+
+
+class TransferJournal:
+    """
+    传输日志
+    状态变化先写入内存缓冲区，由后台线程按时间间隔或缓冲条数批量写入sqlite，单次记录的开销只是一次字典写入；
+    sqlite使用WAL模式，进程崩溃时最多丢失最后一个写入间隔内的状态变化，这些文件会按照更早的状态重新处理
+
+    :param path:sqlite数据库文件路径
+    :param flush_interval:批量写入的时间间隔，单位（s）
+    :param batch_size:缓冲区达到该条数时立即写入
+    """
+
+    def __init__(self, path: str, flush_interval: float = 1.0, batch_size: int = 256):
+        self.path = path
+        self.flush_interval = flush_interval
+        self.batch_size = batch_size
+        self.conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS transfers ("
+            "direction TEXT NOT NULL, source TEXT NOT NULL, target TEXT NOT NULL, state TEXT NOT NULL, "
+            "offset INTEGER NOT NULL DEFAULT 0, size INTEGER, mtime REAL, updated REAL NOT NULL, "
+            "mode TEXT NOT NULL DEFAULT '', PRIMARY KEY (direction, source))")
+        # 旧版本创建的日志没有传输方式列
+        columns = [row[1] for row in self.conn.execute("PRAGMA table_info(transfers)")]
+        if "mode" not in columns:
+            self.conn.execute("ALTER TABLE transfers ADD COLUMN mode TEXT NOT NULL DEFAULT ''")
+        self.db_lock = threading.Lock()
+        self.buffer_lock = threading.Lock()
+        # (方向, 源文件) -> 待写入的记录，为None时表示删除该记录
+        self.buffer = {}
+        self.wakeup = threading.Event()
+        self.closed = False
+        self.thread = threading.Thread(target=self.__run, name="transfer_journal", daemon=True)
+        self.thread.start()
+
+    def record(self, direction: str, source: str, target: str, state: str, size: int = None, mtime: float = None,
+               offset: int = 0, mode: str = FULL):
+        """
+        记录状态变化（写入缓冲区，由后台线程批量落盘）
+
+        :param direction:传输方向，UPLOAD/DOWNLOAD
+        :param source:源文件绝对路径
+        :param target:目标文件绝对路径
+        :param state:传输状态
+        :param size:源文件大小，为空时沿用已有记录
+        :param mtime:源文件修改时间戳，为空时沿用已有记录
+        :param offset:已确认传输的字节数
+        :param mode:传输方式，FULL/DELTA
+        """
+        if size is None or mtime is None:
+            previous = self.get(direction, source)
+            if previous is not None:
+                size = previous.size if size is None else size
+                mtime = previous.mtime if mtime is None else mtime
+        with self.buffer_lock:
+            self.buffer[(direction, source)] = JournalEntry(direction, source, target, state, offset, size, mtime, mode)
+            full = len(self.buffer) >= self.batch_size
+        if full:
+            self.wakeup.set()
+
+    def forget(self, direction: str, source: str):
+        """
+        删除记录
+
+        :param direction:传输方向
+        :param source:源文件绝对路径
+        """
+        with self.buffer_lock:
+            self.buffer[(direction, source)] = None
+
+    def get(self, direction: str, source: str) -> Optional[JournalEntry]:
+        """
+        查询记录，优先返回缓冲区中尚未落盘的最新状态
+
+        :param direction:传输方向
+        :param source:源文件绝对路径
+        :return:记录，不存在时为None
+        """
+        key = (direction, source)
+        with self.buffer_lock:
+            if key in self.buffer:
+                return self.buffer[key]
+        with self.db_lock:
+            row = self.conn.execute(
+                "SELECT direction, source, target, state, offset, size, mtime, mode FROM transfers "
+                "WHERE direction = ? AND source = ?", key).fetchone()
+        return JournalEntry(*row) if row else None
+
+    def pending(self, direction: str) -> List[JournalEntry]:
+        """
+        获取尚未结束（源文件未删除）的记录，用于重启后恢复
+
+        :param direction:传输方向
+        :return:记录列表
+        """
+        self.flush()
+        with self.db_lock:
+            rows = self.conn.execute(
+                "SELECT direction, source, target, state, offset, size, mtime, mode FROM transfers "
+                "WHERE direction = ? AND state != ? ORDER BY source", (direction, SOURCE_DELETED)).fetchall()
+        return [JournalEntry(*row) for row in rows]
+
+    def purge(self):
+        """清除已结束的记录"""
+        self.flush()
+        with self.db_lock:
+            self.conn.execute("DELETE FROM transfers WHERE state = ?", (SOURCE_DELETED,))
+
+    def flush(self):
+        """将缓冲区中的状态变化在一个事务中批量写入"""
+        # 取出缓冲区和写入都在数据库锁内完成，保证同一文件先后的状态按顺序落盘
+        with self.db_lock:
+            with self.buffer_lock:
+                if not self.buffer:
+                    return
+                buffer, self.buffer = self.buffer, {}
+            now = time.time()
+            upserts = [(*entry, now) for entry in buffer.values() if entry is not None]
+            deletes = [key for key, entry in buffer.items() if entry is None]
+            try:
+                self.conn.execute("BEGIN")
+                self.conn.executemany(
+                    "INSERT OR REPLACE INTO transfers "
+                    "(direction, source, target, state, offset, size, mtime, mode, updated) "
+                    "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)", upserts)
+                self.conn.executemany("DELETE FROM transfers WHERE direction = ? AND source = ?", deletes)
+                self.conn.execute("COMMIT")
+            except sqlite3.Error as e:
+                self.conn.execute("ROLLBACK")
+                logger.error(f"传输日志写入失败: {repr(e)}")
+
+    def close(self):
+        """停止后台线程并写入剩余的状态变化"""
+        self.closed = True
+        self.wakeup.set()
+        self.thread.join()
+        self.flush()
+        with self.db_lock:
+            self.conn.close()
+
+    def __run(self):
+        """后台线程：定时批量写入"""
+        while not self.closed:
+            self.wakeup.wait(self.flush_interval)
+            self.wakeup.clear()
+            self.flush()
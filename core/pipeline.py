@@ -0,0 +1,292 @@
+# -*- coding:utf-8 -*
+"""
+@File  : pipeline.py
+@Author: DJW
+@Date  : 2023-11-22 15:40
+@Desc  : 传输后处理流水线阶段，在后台线程中完成文件校验和删除
+"""
+import os
+import queue
+import threading
+from logging import Logger
+from typing import NamedTuple, Optional, List, Callable
+
+import paramiko
+from paramiko.sftp import CMD_REMOVE, CMD_STAT, CMD_STATUS
+from paramiko.sftp_attr import SFTPAttributes
+
+from core import journal as jn
+from core.adaptive import AdaptiveController
+from core.profiling import span
+from core.sftp_client import SFTPClient
+
+# 批量发出请求依赖paramiko SFTPClient的内部接口（requirements.txt固定的3.3.x中存在），其它版本中不存在时退回逐个请求
+PIPELINED = (all(hasattr(paramiko.SFTPClient, name) for name in ("_async_request", "_read_response", "_convert_status"))
+             and hasattr(SFTPAttributes, "_from_msg"))
+
+
+class PostTransferJob(NamedTuple):
+    """传输后处理任务"""
+    local_file: str  # 本地文件绝对路径
+    remote_file: str  # 远程文件绝对路径
+    delete: str  # 校验通过后删除哪一端的文件，"local"：本地  "remote"：远程
+    verify: bool  # 删除前是否比较本地和远程文件大小
+
+
+class _Replies:
+    """收集流水线请求的应答，由SFTP通道读取到应答时回调_async_response"""
+
+    def __init__(self):
+        self.replies = {}
+
+    def __len__(self) -> int:
+        return len(self.replies)
+
+    def _async_response(self, t, msg, num):
+        self.replies[num] = (t, msg)
+
+
+class PostTransferStage:
+    """
+    传输后处理流水线阶段
+    传输线程提交任务后立即开始下一个文件的传输，校验和删除由后台线程在独立的SFTP通道上批量完成，
+    一批任务的远程stat和remove请求一次全部发出后再依次读取应答，只占用一次往返时延
+
+    :param sftp_c:sftp客户端类，后台线程在其SSH连接上新开SFTP通道
+    :param logger:输出处理结果的日志对象
+    :param batch_size:后台线程每次最多合并处理的任务数
+    :param journal:传输日志，传入时记录校验和删除后的状态
+    """
+
+    def __init__(self, sftp_c: SFTPClient, logger: Logger, batch_size: int = 32,
+                 journal: jn.TransferJournal = None):
+        self.sftp_c = sftp_c
+        self.logger = logger
+        self.batch_size = batch_size
+        self.journal = journal
+        self.jobs = queue.Queue()
+        self.channel: Optional[paramiko.SFTPClient] = None
+        self.thread = None
+
+    def start(self):
+        """启动后台处理线程"""
+        if self.thread is None or not self.thread.is_alive():
+            self.thread = threading.Thread(target=self.__run, name="post_transfer_stage", daemon=True)
+            self.thread.start()
+
+    def submit(self, local_file: str, remote_file: str, delete: str, verify: bool = True):
+        """
+        提交传输后处理任务
+
+        :param local_file:本地文件绝对路径
+        :param remote_file:远程文件绝对路径
+        :param delete:校验通过后删除哪一端的文件，"local"：本地  "remote"：远程
+        :param verify:删除前是否比较本地和远程文件大小
+        """
+        self.jobs.put(PostTransferJob(local_file, remote_file, delete, verify))
+
+    def join(self):
+        """等待已提交的任务全部处理完成"""
+        self.jobs.join()
+
+    def __run(self):
+        """后台线程：取出一批任务批量校验、删除"""
+        while True:
+            batch: List[PostTransferJob] = [self.jobs.get()]
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(self.jobs.get_nowait())
+                except queue.Empty:
+                    break
+            try:
+                self.__process(batch)
+            finally:
+                for _ in batch:
+                    self.jobs.task_done()
+
+    def __process(self, batch: List[PostTransferJob]):
+        """校验并删除一批文件，出错时只记录日志，由下一轮扫描重新处理这些文件"""
+        try:
+            # 主线程重连后原通道所在的连接已关闭，需要在新连接上重新打开
+            if self.channel is None or self.channel.sock.closed:
+                self.channel = self.sftp_c.open_sftp_channel()
+            self.__delete(self.__verify(batch))
+        except (paramiko.SSHException, EOFError, OSError) as e:
+            self.logger.error(f"{repr(e)}")
+            # 连接可能已断开或被重连，丢弃当前通道，下一批任务重新打开
+            self.channel = None
+        except Exception as e:
+            self.logger.error(f"{repr(e)}")
+
+    def __verify(self, batch: List[PostTransferJob]) -> List[PostTransferJob]:
+        """
+        比较需要校验的任务两端的文件大小，返回可以删除的任务
+        校验失败（任一端文件不存在或大小不一致）时删除该文件的传输日志记录，由下一轮扫描按两端的实际情况重新处理
+        """
+        checks = [job for job in batch if job.verify]
+        with span("verify", files=len(checks)):
+            stats = iter(self.__pipelined(CMD_STAT, [job.remote_file for job in checks]))
+        passed = []
+        for job in batch:
+            if not job.verify:
+                passed.append(job)
+                continue
+            result = next(stats)
+            try:
+                if isinstance(result, Exception):
+                    raise result
+                local_size = os.path.getsize(job.local_file)
+            except Exception as e:
+                self.logger.error(f"{repr(e)}\n本地:[ {job.local_file} ]\n远程:[ {job.remote_file} ]")
+                self.__forget(job)
+                continue
+            if local_size != result.st_size:
+                self.logger.error(
+                    f"文件校验失败(本地: {local_size}B, 远程: {result.st_size}B)\n"
+                    f"本地:[ {job.local_file} ]\n远程:[ {job.remote_file} ]")
+                self.__forget(job)
+                continue
+            self.__record(job, jn.VERIFIED)
+            passed.append(job)
+        return passed
+
+    def __delete(self, jobs: List[PostTransferJob]):
+        """删除校验通过的任务的源文件"""
+        remote_jobs = [job for job in jobs if job.delete != "local"]
+        for job in jobs:
+            if job.delete != "local":
+                continue
+            try:
+                with span("delete_local", path=job.local_file):
+                    os.remove(job.local_file)
+            except Exception as e:
+                self.logger.error(f"{repr(e)}\n本地:[ {job.local_file} ]\n远程:[ {job.remote_file} ]")
+                continue
+            self.logger.info(f"删除本地文件 [ {job.local_file} ]")
+            self.__record(job, jn.SOURCE_DELETED)
+        if not remote_jobs:
+            return
+        with span("delete_remote", files=len(remote_jobs)):
+            results = self.__pipelined(CMD_REMOVE, [job.remote_file for job in remote_jobs])
+        for job, result in zip(remote_jobs, results):
+            if result is not None:
+                self.logger.error(f"{repr(result)}\n本地:[ {job.local_file} ]\n远程:[ {job.remote_file} ]")
+                continue
+            self.logger.info(f"删除远程文件 [ {job.remote_file} ]")
+            self.__record(job, jn.SOURCE_DELETED)
+
+    def __pipelined(self, t: int, paths: List[str]) -> list:
+        """
+        在当前通道上一次发出一批同类请求，再依次读取应答（应答可以乱序到达）
+
+        :param t:请求类型，CMD_STAT或CMD_REMOVE
+        :param paths:远程文件绝对路径
+        :return:与paths顺序一致的结果，stat为文件属性，remove成功为None，失败的请求为对应的IOError
+        """
+        channel = self.channel
+        if not PIPELINED:
+            return self.__sequential(t, paths)
+        replies = _Replies()
+        nums = [channel._async_request(replies, t, path) for path in paths]
+        while len(replies) < len(nums):
+            channel._read_response()
+        results = []
+        for num in nums:
+            reply_t, msg = replies.replies[num]
+            try:
+                if reply_t == CMD_STATUS:
+                    # 错误状态转换为IOError，成功状态返回None
+                    results.append(channel._convert_status(msg))
+                else:
+                    results.append(SFTPAttributes._from_msg(msg))
+            except IOError as e:
+                results.append(e)
+        return results
+
+    def __sequential(self, t: int, paths: List[str]) -> list:
+        """逐个发出请求并等待应答，参数及返回值同__pipelined"""
+        results = []
+        for path in paths:
+            try:
+                results.append(self.channel.stat(path) if t == CMD_STAT else self.channel.remove(path))
+            except IOError as e:
+                results.append(e)
+        return results
+
+    def __record(self, job: PostTransferJob, state: str):
+        """在传输日志中记录任务的状态"""
+        if self.journal is None:
+            return
+        if job.delete == "local":
+            self.journal.record(jn.UPLOAD, job.local_file, job.remote_file, state)
+        else:
+            self.journal.record(jn.DOWNLOAD, job.remote_file, job.local_file, state)
+
+    def __forget(self, job: PostTransferJob):
+        """删除任务在传输日志中的记录"""
+        if self.journal is None:
+            return
+        if job.delete == "local":
+            self.journal.forget(jn.UPLOAD, job.local_file)
+        else:
+            self.journal.forget(jn.DOWNLOAD, job.remote_file)
+
+
+class TransferPool:
+    """
+    传输线程池，同时进行的传输数由自适应控制器的并发数决定
+    每个工作线程在SSH连接上使用各自的SFTP通道，通道断开后自动重新打开
+
+    :param sftp_c:sftp客户端类，工作线程在其SSH连接上新开SFTP通道
+    :param controller:自适应控制器，提供当前允许的并发数
+    :param logger:输出错误信息的日志对象
+    """
+
+    def __init__(self, sftp_c: SFTPClient, controller: AdaptiveController, logger: Logger):
+        self.sftp_c = sftp_c
+        self.controller = controller
+        self.logger = logger
+        self.jobs = queue.Queue()
+        self.threads: List[threading.Thread] = []
+        self.active = 0
+        self.slot = threading.Condition()
+
+    def submit(self, fn: Callable, *args, **kwargs):
+        """
+        提交传输任务，工作线程以fn(*args, sftp=通道, **kwargs)的形式调用
+
+        :param fn:传输函数
+        """
+        self.jobs.put((fn, args, kwargs))
+        self.threads = [thread for thread in self.threads if thread.is_alive()]
+        if len(self.threads) < self.controller.workers:
+            thread = threading.Thread(target=self.__run, name=f"transfer_pool_{len(self.threads)}", daemon=True)
+            thread.start()
+            self.threads.append(thread)
+
+    def join(self):
+        """等待已提交的任务全部完成"""
+        self.jobs.join()
+
+    def __run(self):
+        """工作线程：取出任务，等待空闲的并发名额后执行"""
+        channel: Optional[paramiko.SFTPClient] = None
+        while True:
+            fn, args, kwargs = self.jobs.get()
+            with self.slot:
+                # 控制器可能随时调整并发数，定时重新检查
+                while self.active >= self.controller.workers:
+                    self.slot.wait(timeout=1)
+                self.active += 1
+            try:
+                if channel is None or channel.sock.closed:
+                    channel = self.sftp_c.open_sftp_channel()
+                fn(*args, sftp=channel, **kwargs)
+            except Exception as e:
+                self.logger.error(f"{repr(e)}")
+                channel = None
+            finally:
+                with self.slot:
+                    self.active -= 1
+                    self.slot.notify()
+                self.jobs.task_done()
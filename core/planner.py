@@ -0,0 +1,233 @@
+# -*- coding:utf-8 -*
+"""
+@File  : planner.py
+@Author: DJW
+@Date  : 2023-11-30 09:20
+@Desc  : 同步计划：线性归并已排序的源端和目标端文件列表，按源端文件顺序逐个产出本轮需要执行的操作
+"""
+import json
+from typing import Iterable, Iterator, NamedTuple, Optional, List, Tuple
+
+from core import journal as jn
+from core.walker import FileEntry
+
+# 计划中的操作
+TRANSFER = "transfer"  # 目标端不存在，传输
+RETRANSFER = "retransfer"  # 目标端文件较小，重传（上传启用增量上传时只发送变化的块）
+RESUME = "resume"  # 传输日志记录传输中断，从目标端已有的大小处续传（增量上传中断时改为重传）
+FINISH = "finish"  # 传输日志记录已传输且目标端文件大小一致，校验后删除源文件
+DELETE = "delete"  # 目标端已存在完整文件，删除源文件
+SKIP = "skip"  # 文件格式不符，跳过
+
+ACTIONS = (TRANSFER, RETRANSFER, RESUME, FINISH, DELETE, SKIP)
+
+
+class PlanItem(NamedTuple):
+    """同步计划中的单个操作"""
+    action: str  # 操作
+    source: FileEntry  # 源文件条目（上传为本地文件，下载为远程文件）
+    target: str  # 目标文件绝对路径
+    target_size: Optional[int]  # 目标端已有文件的大小，不存在时为None
+    verify: bool  # 删除源文件前是否比较两端文件大小
+
+    @property
+    def transfer_size(self) -> int:
+        """执行该操作需要传输的字节数"""
+        if self.action in (TRANSFER, RETRANSFER):
+            return self.source.size
+        if self.action == RESUME:
+            return self.source.size - min(self.target_size or 0, self.source.size)
+        return 0
+
+
+class SyncPlan:
+    """
+    同步计划：按源端文件顺序保存的操作列表，以及各操作的文件数和传输字节数统计
+
+    :param direction:传输方向，UPLOAD/DOWNLOAD
+    :param source_root:源端根目录绝对路径
+    :param target_root:目标端根目录绝对路径
+    :param keep_items:是否保存每个操作，为False时只做统计（边归并边执行时使用，内存占用与文件数无关）
+    """
+
+    def __init__(self, direction: str, source_root: str, target_root: str, keep_items: bool = True):
+        self.direction = direction
+        self.source_root = source_root
+        self.target_root = target_root
+        self.keep_items = keep_items
+        self.items: List[PlanItem] = []
+        self.counts = dict.fromkeys(ACTIONS, 0)
+        self.sizes = dict.fromkeys(ACTIONS, 0)
+        self.transfer_bytes = 0
+
+    def __len__(self) -> int:
+        return sum(self.counts.values())
+
+    def __iter__(self) -> Iterator[PlanItem]:
+        return iter(self.items)
+
+    def add(self, item: PlanItem):
+        """添加一个操作并更新统计"""
+        if self.keep_items:
+            self.items.append(item)
+        self.counts[item.action] += 1
+        self.sizes[item.action] += item.source.size
+        self.transfer_bytes += item.transfer_size
+
+    def by_action(self, *actions: str) -> Iterator[PlanItem]:
+        """
+        按源端文件顺序遍历指定操作
+
+        :param actions:操作
+        :return:操作生成器
+        """
+        return (item for item in self.items if item.action in actions)
+
+    def summary(self) -> str:
+        """计划概要：各操作的文件数、源文件总大小及需要传输的总字节数"""
+        parts = [f"{action}: {self.counts[action]}个({_format_size(self.sizes[action])})"
+                 for action in ACTIONS if self.counts[action]]
+        return (f"{'上传' if self.direction == jn.UPLOAD else '下载'}计划 [ {self.source_root} ] -> "
+                f"[ {self.target_root} ]  {', '.join(parts) or '无文件'}  "
+                f"需传输: {_format_size(self.transfer_bytes)}")
+
+    def to_dict(self) -> dict:
+        """转换为可序列化的字典"""
+        return {
+            "direction": self.direction,
+            "source_root": self.source_root,
+            "target_root": self.target_root,
+            "counts": self.counts,
+            "sizes": self.sizes,
+            "transfer_bytes": self.transfer_bytes,
+            "items": [{
+                "action": item.action,
+                "source": item.source.path,
+                "size": item.source.size,
+                "mtime": item.source.mtime,
+                "target": item.target,
+                "target_size": item.target_size,
+                "transfer_size": item.transfer_size,
+            } for item in self.items],
+        }
+
+    def export(self, path: str):
+        """
+        将计划导出为JSON文件
+
+        :param path:导出文件路径
+        """
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump(self.to_dict(), f, ensure_ascii=False, indent=2)
+
+
+def _format_size(size: int) -> str:
+    """将字节数格式化为便于阅读的大小"""
+    for unit in ("B", "KB", "MB", "GB"):
+        if size < 1024:
+            return f"{round(size, 2)}{unit}"
+        size /= 1024
+    return f"{round(size, 2)}TB"
+
+
+def sync_key(path: str, root: str, sep: str) -> Tuple[str, ...]:
+    """
+    计算文件相对于根目录的各级路径名，作为归并两端列表时的排序键
+    两端的遍历均为按文件名排序的深度优先顺序，该顺序与按各级路径名组成的元组排序一致
+
+    :param path:文件绝对路径
+    :param root:根目录绝对路径
+    :param sep:路径分隔符
+    :return:各级路径名组成的元组
+    """
+    return tuple(path[len(root):].strip(sep).split(sep))
+
+
+def iter_sync(
+        direction: str,
+        sources: Iterable[FileEntry],
+        source_root: str,
+        source_sep: str,
+        targets: Iterable[FileEntry],
+        target_root: str,
+        target_sep: str,
+        file_layout: str,
+        journal: jn.TransferJournal = None,
+        sources_sorted: bool = True
+) -> Iterator[PlanItem]:
+    """
+    线性归并源端和目标端的文件列表，按源端文件顺序逐个产出操作，不需要为每个文件单独查询目标端
+    每取到一个源端文件就产出它的操作，源端为流式遍历时可以边遍历边执行
+
+    :param direction:传输方向，UPLOAD/DOWNLOAD
+    :param sources:源端文件条目，按文件名排序的深度优先顺序
+    :param source_root:源端根目录绝对路径
+    :param source_sep:源端路径分隔符
+    :param targets:目标端文件条目，按文件名排序的深度优先顺序
+    :param target_root:目标端根目录绝对路径
+    :param target_sep:目标端路径分隔符
+    :param file_layout:需要传输的文件格式（文件名后缀）
+    :param journal:传输日志，传入时按已记录的状态续传或直接校验删除
+    :param sources_sorted:源端文件条目是否已排序，为False时先全部取出排序（例如多线程扫描本地目录）
+    :return:操作生成器
+    """
+    source_items = ((sync_key(entry.path, source_root, source_sep), entry) for entry in sources)
+    if not sources_sorted:
+        source_items = iter(sorted(source_items, key=lambda x: x[0]))
+    target_items = ((sync_key(entry.path, target_root, target_sep), entry) for entry in targets)
+    target_key, target = next(target_items, (None, None))
+    for key, source in source_items:
+        # 跳过只存在于目标端的文件
+        while target is not None and target_key < key:
+            target_key, target = next(target_items, (None, None))
+        matched = target if target is not None and target_key == key else None
+        target_path = target_root.rstrip(target_sep) + target_sep + target_sep.join(key)
+        yield _decide(direction, source, key[-1], matched, target_path, file_layout, journal)
+
+
+def plan_sync(
+        direction: str,
+        sources: Iterable[FileEntry],
+        source_root: str,
+        source_sep: str,
+        targets: Iterable[FileEntry],
+        target_root: str,
+        target_sep: str,
+        file_layout: str,
+        journal: jn.TransferJournal = None,
+        sources_sorted: bool = True
+) -> SyncPlan:
+    """
+    归并源端和目标端的文件列表，一次生成完整的同步计划（用于预览及批量执行），参数同iter_sync
+
+    :return:同步计划
+    """
+    plan = SyncPlan(direction, source_root, target_root)
+    for item in iter_sync(direction, sources, source_root, source_sep, targets, target_root, target_sep, file_layout,
+                          journal, sources_sorted):
+        plan.add(item)
+    return plan
+
+
+def _decide(direction: str, source: FileEntry, filename: str, target: Optional[FileEntry], target_path: str,
+            file_layout: str, journal: Optional[jn.TransferJournal]) -> PlanItem:
+    """根据源端文件、目标端文件及传输日志确定操作"""
+    target_size = target.size if target is not None else None
+    if not filename.endswith(file_layout):
+        return PlanItem(SKIP, source, target_path, target_size, False)
+    row = journal.get(direction, source.path) if journal is not None else None
+    # 文件已被替换的记录不再使用
+    state = row.state if row is not None and row.matches(source.size, source.mtime) else None
+    # 目标端文件已不存在或大小不一致（例如被其它程序取走）时，记录不再可信，按两端的实际情况处理
+    if state in (jn.TRANSFERRED, jn.VERIFIED) and target_size == source.size:
+        return PlanItem(FINISH, source, row.target, target_size, state == jn.TRANSFERRED)
+    if state == jn.IN_PROGRESS:
+        # 增量上传原地改写远端文件，远端文件大小不代表进度，需要重新比较全部分块
+        if row.mode == jn.DELTA:
+            return PlanItem(RETRANSFER, source, row.target, target_size, True)
+        return PlanItem(RESUME, source, row.target, target_size, True)
+    if target is None:
+        return PlanItem(TRANSFER, source, target_path, None, True)
+    if source.size > target.size:
+        return PlanItem(RETRANSFER, source, target_path, target_size, True)
+    return PlanItem(DELETE, source, target_path, target_size, False)
@@ -0,0 +1,329 @@
+# -*- coding:utf-8 -*
+"""
+@File  : process_pool.py
+@Author: DJW
+@Date  : 2023-11-28 09:45
+@Desc  : 多进程传输引擎，每个工作进程持有独立的SSH连接，使加解密可以利用多个CPU核心
+"""
+import logging
+import multiprocessing
+import os
+import queue
+import threading
+import time
+from collections import deque
+from logging import Logger
+from logging.handlers import QueueHandler
+from typing import Callable, Optional
+
+from paramiko.ssh_exception import SSHException
+
+from core.disk_writer import PART_SUFFIX
+from core.sftp_client import SFTPClient
+from logging_config import LOGGING_CONFIG, sftp_client as default_logger, transfer_extra
+
+# 工作进程读取文件及上报进度的块大小，单位（B）
+CHUNK_SIZE = 1024 * 1024
+
+
+class _ForwardHandler(QueueHandler):
+    """工作进程中将日志通过结果队列转发给主进程输出"""
+
+    def enqueue(self, record):
+        self.queue.put(("log", record))
+
+
+def _forward_logging(results):
+    """工作进程的所有日志对象只保留转发handler，避免多个进程同时写入并轮转同一个日志文件"""
+    handler = _ForwardHandler(results)
+    for name in LOGGING_CONFIG['loggers']:
+        log = logging.getLogger(name)
+        for old_handler in log.handlers[:]:
+            log.removeHandler(old_handler)
+        log.addHandler(handler)
+        log.setLevel(logging.INFO)
+        log.propagate = False
+
+
+def _download_range(sftp, remote_file: str, local_file: str, offset: int, length: int, create: bool, progress):
+    """下载远程文件的指定字节范围到本地文件的相同位置"""
+    with sftp.open(remote_file, 'r') as remote_f, open(local_file, 'wb' if create else 'r+b') as local_f:
+        local_f.seek(offset)
+        end = offset + length
+        chunks = [(start, min(CHUNK_SIZE, end - start)) for start in range(offset, end, CHUNK_SIZE)]
+        for data in remote_f.readv(chunks):
+            local_f.write(data)
+            progress(len(data))
+
+
+def _worker(index: int, hostname: str, username: str, password: str, port: int, jobs, results):
+    """
+    工作进程：建立独立的SSH连接，从自己的任务队列中取出文件或字节范围执行下载，并上报进度和结果
+    任务格式：(分段序号, 任务id, 本地路径, 远程路径, 起始偏移, 长度, 是否新建文件)，收到None时退出
+    """
+    _forward_logging(results)
+    sftp_c = SFTPClient(hostname, username, password, port)
+    sftp_c.connect()
+    while True:
+        part = jobs.get()
+        if part is None:
+            break
+        seq, job_id, local_file, remote_file, offset, length, create = part
+
+        def progress(size):
+            results.put(("progress", index, seq, job_id, size))
+
+        try:
+            _download_range(sftp_c.sftp, remote_file, local_file, offset, length, create, progress)
+            results.put(("done", index, seq, job_id, None))
+        except (SSHException, EOFError) as e:
+            results.put(("done", index, seq, job_id, repr(e)))
+            sftp_c.reconnect()
+        except Exception as e:
+            results.put(("done", index, seq, job_id, repr(e)))
+    sftp_c.disconnect()
+
+
+class _Job:
+    """主进程中记录的传输任务状态"""
+    __slots__ = ("local_file", "remote_file", "part_file", "size", "pending", "error", "transferred", "time_start",
+                 "callback")
+
+    def __init__(self, local_file: str, remote_file: str, size: int, callback: Optional[Callable]):
+        self.local_file = local_file
+        self.remote_file = remote_file
+        # 各段先写入临时文件，全部成功后才重命名为目标文件
+        self.part_file = local_file + PART_SUFFIX
+        self.size = size
+        self.pending = 0
+        self.error = None
+        self.transferred = 0
+        self.time_start = time.time()
+        self.callback = callback
+
+
+class ProcessTransferPool:
+    """
+    多进程传输引擎
+    paramiko在持有GIL的情况下进行加解密，单进程内增加线程无法突破单核的加解密吞吐量；
+    本引擎启动多个工作进程，各自持有独立的SSH连接，领取文件或大文件的字节范围进行下载，
+    进度、结果和日志通过结果队列上报给主进程。
+    待传输的分段保存在主进程的共享队列中，每个工作进程同时只领取一段，主进程因此知道每个进程正在传输哪一段：
+    工作进程意外退出（内存不足、段错误、被杀死等）时，该段按失败处理并启动新的工作进程，任务不会一直等待。
+    各段写入"本地文件.part"，全部成功后才重命名为目标文件，任一段失败时删除临时文件，不会留下大小完整但内容不全的文件。
+
+    :param hostname:连接到的ftp服务器ip
+    :param username:用户名
+    :param password:密码
+    :param port:端口
+    :param processes:工作进程数，为空时使用CPU核心数
+    :param range_size:大文件分段传输时每段的大小，单位（B），不超过该大小的文件整个作为一段
+    :param logger:输出传输结果的日志对象
+    """
+
+    def __init__(
+            self,
+            hostname: str,
+            username: str,
+            password: str,
+            port: int = 22,
+            processes: int = None,
+            range_size: int = 64 * 1024 * 1024,
+            logger: Logger = default_logger
+    ):
+        self.connect_args = (hostname, username, password, port)
+        self.processes = processes or os.cpu_count() or 1
+        self.range_size = range_size
+        self.logger = logger
+        # 主进程中运行着日志、配置监听等线程，使用spawn方式启动工作进程以免fork后继承持有的锁
+        self.context = multiprocessing.get_context("spawn")
+        self.results = self.context.Queue()
+        self.workers = []
+        self.worker_queues = []
+        # 待下发的分段：(任务id, 起始偏移, 长度, 是否新建文件)
+        self.backlog = deque()
+        # 工作进程下标 -> 正在传输的(分段序号, 任务id)
+        self.running = {}
+        self.next_seq = 0
+        self.collector = None
+        self.job_map = {}
+        self.next_id = 0
+        self.stopping = False
+        self.idle = threading.Condition()
+
+    def start(self):
+        """启动工作进程及结果收集线程"""
+        for index in range(self.processes):
+            self.workers.append(None)
+            self.worker_queues.append(None)
+            self.__start_worker(index)
+        self.collector = threading.Thread(target=self.__collect, name="process_transfer_collector", daemon=True)
+        self.collector.start()
+
+    def stop(self, timeout: float = 5):
+        """
+        停止工作进程，不等待未完成的任务（其临时文件由下次下载或续传清理）
+
+        :param timeout:等待每个工作进程退出的时间，单位（s），超时后强制结束
+        """
+        with self.idle:
+            self.stopping = True
+            self.backlog.clear()
+        for jobs in self.worker_queues:
+            jobs.put(None)
+        for worker in self.workers:
+            worker.join(timeout)
+            if worker.is_alive():
+                worker.terminate()
+        self.workers = []
+        self.worker_queues = []
+
+    def join(self):
+        """等待已提交的任务全部完成"""
+        with self.idle:
+            while self.job_map:
+                self.idle.wait()
+
+    def download(self, remote_file: str, local_file: str, size: int, callback: Callable[[bool], None] = None) -> int:
+        """
+        提交下载任务，大文件按range_size分段由多个进程并行下载
+
+        :param remote_file:远程需要下载文件的绝对路径
+        :param local_file:本地需要保存文件的绝对路径
+        :param size:远程文件大小，单位（B）
+        :param callback:任务结束后在结果收集线程中调用，参数为是否成功
+        :return:任务id
+        """
+        job_id, job = self.__new_job(local_file, remote_file, size, callback)
+        if size <= self.range_size:
+            self.__dispatch(job_id, [(0, size, True)])
+        else:
+            # 预先创建临时文件并分配空间，各段以读写方式打开写入各自的范围
+            with open(job.part_file, 'wb') as f:
+                f.truncate(size)
+            self.__dispatch(job_id, [(offset, min(self.range_size, size - offset), False)
+                                     for offset in range(0, size, self.range_size)])
+        return job_id
+
+    def __start_worker(self, index: int):
+        """启动（或替换）指定下标的工作进程，每个工作进程使用自己的任务队列"""
+        jobs = self.context.Queue()
+        worker = self.context.Process(target=_worker, args=(index, *self.connect_args, jobs, self.results),
+                                      name=f"process_transfer_{index}", daemon=True)
+        worker.start()
+        self.workers[index] = worker
+        self.worker_queues[index] = jobs
+
+    def __new_job(self, local_file: str, remote_file: str, size: int, callback) -> tuple:
+        """登记新任务"""
+        with self.idle:
+            job_id = self.next_id
+            self.next_id += 1
+            job = _Job(local_file, remote_file, size, callback)
+            self.job_map[job_id] = job
+        return job_id, job
+
+    def __dispatch(self, job_id: int, parts: list):
+        """将任务的各段放入共享队列，并下发给空闲的工作进程"""
+        with self.idle:
+            self.job_map[job_id].pending += len(parts)
+            self.backlog.extend((job_id, *part) for part in parts)
+            self.__feed()
+
+    def __feed(self):
+        """为每个空闲的工作进程下发一段（调用时需持有self.idle）"""
+        for index, jobs in enumerate(self.worker_queues):
+            if not self.backlog or self.stopping:
+                break
+            if index in self.running or not self.workers[index].is_alive():
+                continue
+            job_id, offset, length, create = self.backlog.popleft()
+            job = self.job_map[job_id]
+            seq = self.next_seq
+            self.next_seq += 1
+            self.running[index] = (seq, job_id)
+            jobs.put((seq, job_id, job.part_file, job.remote_file, offset, length, create))
+
+    def __collect(self):
+        """结果收集线程：转发工作进程的日志，汇总各段进度和结果，并定时检查工作进程是否意外退出"""
+        while True:
+            try:
+                kind, *payload = self.results.get(timeout=1)
+            except queue.Empty:
+                self.__check_workers()
+                continue
+            except (EOFError, OSError):
+                # 进程退出时结果队列已关闭
+                break
+            if kind == "log":
+                record = payload[0]
+                logging.getLogger(record.name).handle(record)
+                continue
+            index, seq, job_id = payload[:3]
+            if kind == "progress":
+                job = self.job_map.get(job_id)
+                if job is not None:
+                    job.transferred += payload[3]
+                continue
+            with self.idle:
+                # 已按进程退出处理过的分段，不再重复计数
+                if self.running.get(index) != (seq, job_id):
+                    continue
+                del self.running[index]
+                self.__feed()
+            self.__part_done(job_id, payload[3])
+            self.__check_workers()
+
+    def __check_workers(self):
+        """工作进程意外退出时，其正在传输的分段按失败处理，并启动新的工作进程替代"""
+        if self.stopping:
+            return
+        for index, worker in enumerate(self.workers):
+            if worker.is_alive():
+                continue
+            self.logger.error(f"工作进程 [ {worker.name} ] 意外退出(退出码: {worker.exitcode})，重新启动")
+            with self.idle:
+                running = self.running.pop(index, None)
+                self.__start_worker(index)
+                self.__feed()
+            if running is not None:
+                self.__part_done(running[1], f"工作进程意外退出(退出码: {worker.exitcode})")
+
+    def __part_done(self, job_id: int, error: Optional[str]):
+        """汇总一段的结果，全部分段结束后结束任务"""
+        job = self.job_map.get(job_id)
+        if job is None:
+            return
+        with self.idle:
+            job.pending -= 1
+            job.error = job.error or error
+            pending = job.pending
+        if error:
+            self.logger.error(f"传输失败: {error}\n本地:[ {job.local_file} ]\n远程:[ {job.remote_file} ]")
+        if not pending:
+            self.__finish(job_id, job)
+
+    def __finish(self, job_id: int, job: _Job):
+        """任务结束：成功时将临时文件重命名为目标文件，失败时删除临时文件，输出结果、调用回调并移除任务"""
+        try:
+            if job.error:
+                if os.path.exists(job.part_file):
+                    os.remove(job.part_file)
+            else:
+                os.replace(job.part_file, job.local_file)
+        except OSError as e:
+            job.error = job.error or repr(e)
+            self.logger.error(f"{repr(e)}\n本地:[ {job.local_file} ]")
+        duration = time.time() - job.time_start
+        if not job.error:
+            self.logger.info(
+                f"[ -END- ] 文件下载完成(多进程, 用时: {round(duration, 0)}秒): [ {job.remote_file} ]",
+                extra=transfer_extra(job.remote_file, job.size, duration))
+        if job.callback:
+            try:
+                job.callback(not job.error)
+            except Exception as e:
+                self.logger.error(f"{repr(e)}")
+        with self.idle:
+            del self.job_map[job_id]
+            self.idle.notify_all()
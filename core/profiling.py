@@ -0,0 +1,188 @@
+# -*- coding:utf-8 -*
+"""
+@File  : profiling.py
+@Author: DJW
+@Date  : 2023-12-04 10:10
+@Desc  : 轻量的分阶段耗时记录（可导出为Chrome/Perfetto的trace JSON）及按扫描轮次启停的cProfile性能分析
+"""
+import cProfile
+import functools
+import json
+import os
+import threading
+import time
+from collections import deque
+
+from logging_config import main as logger
+
+
+class _NullSpan:
+    """未启用时使用的空记录，进入和退出都不做任何事"""
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        return False
+
+
+_NULL_SPAN = _NullSpan()
+
+
+class _Span:
+    """一次阶段耗时记录，退出时写入Tracer的事件队列"""
+    __slots__ = ("tracer", "name", "args", "start")
+
+    def __init__(self, tracer: 'Tracer', name: str, args: dict):
+        self.tracer = tracer
+        self.name = name
+        self.args = args
+        self.start = 0
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        end = time.perf_counter()
+        if exc_type is not None:
+            self.args["error"] = exc_type.__name__
+        self.tracer.add(self.name, self.start, end - self.start, self.args)
+        return False
+
+
+class Tracer:
+    """
+    分阶段耗时记录器
+    span()返回的上下文记录一个阶段的开始时间和用时，以Chrome trace的完整事件（ph="X"）保存在有界队列中，
+    每轮扫描结束时调用end_cycle导出到trace文件，可直接拖入chrome://tracing或ui.perfetto.dev查看各线程的时间线。
+    未启用时span()只做一次属性判断并返回共享的空记录，可以一直保留在生产代码中。
+    设置profile_cycles后，从下一轮扫描开始在调用end_cycle的线程上运行cProfile，持续指定轮数后输出统计文件。
+    """
+
+    def __init__(self):
+        self.enabled = False
+        self.trace_path = ""
+        self.events = deque(maxlen=100000)
+        self.origin = time.perf_counter()
+        self.pid = os.getpid()
+        self.thread_names = {}
+        self.lock = threading.Lock()
+        self.profile_cycles = 0
+        self.profile_path = ""
+        self.profile_pending = 0
+        self.profile_remaining = 0
+        self.profiler = None
+
+    def configure(self, trace_path: str = "", max_events: int = 100000, profile_cycles: int = 0,
+                  profile_path: str = "profile.prof"):
+        """
+        设置记录参数，可在配置重新加载时重复调用
+
+        :param trace_path:trace文件导出路径，为空时不记录阶段耗时
+        :param max_events:最多保留的事件数，超出后丢弃最早的事件
+        :param profile_cycles:cProfile分析的扫描轮数，修改为大于0的值时开始一次新的分析
+        :param profile_path:cProfile统计文件的输出路径，可用pstats或snakeviz查看
+        """
+        with self.lock:
+            self.trace_path = trace_path
+            if self.events.maxlen != max_events:
+                self.events = deque(self.events, maxlen=max_events)
+            self.enabled = bool(trace_path)
+            self.profile_path = profile_path
+            if profile_cycles != self.profile_cycles:
+                self.profile_cycles = profile_cycles
+                self.profile_pending = profile_cycles
+
+    def span(self, name: str, **args):
+        """
+        记录一个阶段的耗时
+
+        :param name:阶段名称
+        :param args:附加信息（例如文件路径），显示在trace查看器的详情中
+        :return:上下文管理器
+        """
+        if not self.enabled:
+            return _NULL_SPAN
+        return _Span(self, name, args)
+
+    def add(self, name: str, start: float, duration: float, args: dict):
+        """
+        添加一个完整事件
+
+        :param name:阶段名称
+        :param start:开始时间（time.perf_counter）
+        :param duration:用时，单位（s）
+        :param args:附加信息
+        """
+        thread = threading.current_thread()
+        tid = thread.ident
+        if tid not in self.thread_names:
+            self.thread_names[tid] = thread.name
+        self.events.append({
+            "name": name, "ph": "X", "pid": self.pid, "tid": tid,
+            "ts": round((start - self.origin) * 1e6, 1), "dur": round(duration * 1e6, 1), "args": args,
+        })
+
+    def export(self, path: str):
+        """
+        将已记录的事件导出为Chrome/Perfetto可以打开的trace JSON
+
+        :param path:导出文件路径
+        """
+        metadata = [{"name": "thread_name", "ph": "M", "pid": self.pid, "tid": tid, "args": {"name": name}}
+                    for tid, name in list(self.thread_names.items())]
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump({"traceEvents": metadata + list(self.events), "displayTimeUnit": "ms"}, f, ensure_ascii=False)
+
+    def end_cycle(self):
+        """每轮扫描结束时调用：导出trace文件，按设置启动或结束cProfile分析"""
+        try:
+            if self.enabled:
+                self.export(self.trace_path)
+            if self.profiler is not None:
+                self.profile_remaining -= 1
+                if self.profile_remaining <= 0:
+                    self.profiler.disable()
+                    self.profiler.dump_stats(self.profile_path)
+                    self.profiler = None
+                    logger.info(f"性能分析结束，统计结果已输出至 [ {self.profile_path} ]")
+            elif self.profile_pending > 0:
+                self.profile_remaining, self.profile_pending = self.profile_pending, 0
+                self.profiler = cProfile.Profile()
+                self.profiler.enable()
+                logger.info(f"开始性能分析，持续{self.profile_remaining}轮扫描")
+        except Exception as e:
+            logger.error(f"{repr(e)}")
+
+
+# 进程内共享的记录器，由各入口脚本根据配置调用configure启用
+TRACER = Tracer()
+
+
+def span(name: str, **args):
+    """使用共享记录器记录一个阶段的耗时，参数同Tracer.span"""
+    return TRACER.span(name, **args)
+
+
+def traced(name: str, path_arg: int = None):
+    """
+    记录函数每次调用耗时的装饰器，未启用时直接调用原函数
+
+    :param name:阶段名称
+    :param path_arg:作为附加信息记录的位置参数下标（例如方法的文件路径参数为1）
+    """
+
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if not TRACER.enabled:
+                return func(*args, **kwargs)
+            info = {"path": args[path_arg]} if path_arg is not None and path_arg < len(args) else {}
+            with _Span(TRACER, name, info):
+                return func(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
@@ -9,13 +9,34 @@ import os
 import sys
 import time
 import stat
-from typing import List
+import shlex
+import socket
+import hashlib
+from typing import Callable, List, Optional
 from tqdm import tqdm
 
 import paramiko
+from paramiko.sftp import CMD_EXTENDED
 from paramiko.ssh_exception import SSHException
 
-from logging_config import sftp_client as logger, log_download as download_logger, log_upload as upload_logger
+from core.adaptive import AdaptiveController
+from core.disk_writer import DiskWriter, FSYNC_NEVER, PART_SUFFIX
+from core.file_tree import FileTree
+from core.filters import FileFilter
+from core.profiling import traced
+from logging_config import sftp_client as logger, log_download as download_logger, log_upload as upload_logger, \
+    transfer_extra
+
+# 远端不支持check-file扩展时，通过exec通道在远端执行的分块摘要计算脚本
+_REMOTE_BLOCK_HASH_SCRIPT = (
+    "import sys,hashlib\n"
+    "f=open(sys.argv[1],'rb')\n"
+    "for c in iter(lambda:f.read(int(sys.argv[2])),b''):print(hashlib.md5(c).hexdigest())"
+)
+# exec通道的超时时间，单位（s）：打开通道、等待退出码及两次收到输出之间的最长等待时间
+EXEC_TIMEOUT = 60
+# 估算远端复制文件耗时所用的磁盘速度，单位（B/s）
+EXEC_COPY_SPEED = 20 * 1024 * 1024
 
 
 class SFTPClient:
@@ -110,6 +131,16 @@ class SFTPClient:
             self.transport = None
         logger.info("已断开与SFTP服务器连接.")
 
+    def open_sftp_channel(self) -> paramiko.SFTPClient:
+        """
+        在当前SSH连接上新开一个SFTP通道
+        paramiko的SFTPClient不能在多个线程间共享，其它线程需要使用各自的通道
+
+        :return:新的SFTP通道
+        """
+        return paramiko.SFTPClient.from_transport(self.transport)
+
+    @traced("upload", 1)
     def upload_file(self, local_file: str, remote_file: str) -> bool:
         """
         上传单个文件（windows路径用"\"分隔，linux用"/"分隔）
@@ -127,7 +158,220 @@ class SFTPClient:
                 self.sftp.put(local_file, remote_file, callback=self.__print_upload_process)
             # self.sftp.put(local_file, remote_file, callback=self.__print_upload_process)
             time_end = time.time()
-            upload_logger.info(f"[ -END- ] 文件上传完成(用时: {round(time_end - time_start, 0)}秒): [ {local_file} ] ")
+            upload_logger.info(f"[ -END- ] 文件上传完成(用时: {round(time_end - time_start, 0)}秒): [ {local_file} ] ",
+                               extra=transfer_extra(local_file, local_file_size, time_end - time_start))
+            self.upload_now = None
+            return True
+        except FileNotFoundError:
+            logger.error(f"文件未找到\n本地:[ {local_file} ]\n远程:[ {remote_file} ]")
+            return False
+        except SSHException as e:
+            logger.error(f"{repr(e)}")
+            self.reconnect()
+        except Exception as e:
+            logger.error(f"{repr(e)}")
+            return False
+
+    @traced("upload_delta", 1)
+    def upload_file_delta(self, local_file: str, remote_file: str, block_size: int = 1024 * 1024) -> bool:
+        """
+        块级增量上传单个文件（适用于远程已存在、本地被原地修改或追加写入的文件）
+        按块比较本地与远程文件的md5摘要，只发送发生变化或新增的块，并将远程文件截断到本地文件大小
+        无法获取远程分块摘要时退化为完整上传
+
+        :param local_file:本地需要上传文件的绝对路径（例如：/path/file.txt）
+        :param remote_file:远程存储文件的绝对路径（例如：/path/file.txt）
+        :param block_size:分块大小，单位（B）
+        :return:是否成功
+        """
+        try:
+            remote_hashes = self.get_remote_block_hashes(remote_file, block_size)
+            if remote_hashes is None:
+                upload_logger.info(f"无法获取远程文件分块摘要，改为完整上传: [ {remote_file} ]")
+                return self.upload_file(local_file, remote_file)
+            upload_logger.info(f"[ -START- ] 当前增量上传的文件是: [ {local_file} ]")
+            self.upload_now = local_file
+            time_start = time.time()
+            local_file_size = os.path.getsize(local_file)
+            sent_size = 0
+            with open(local_file, 'rb') as local_f, self.sftp.open(remote_file, 'r+') as remote_f, \
+                    tqdm(total=local_file_size, unit='B', unit_scale=True) as self.pbar:
+                remote_f.set_pipelined(True)
+                index = 0
+                while True:
+                    data = local_f.read(block_size)
+                    if not data:
+                        break
+                    # 远程没有该块或该块内容不同时才发送
+                    if index >= len(remote_hashes) or hashlib.md5(data).digest() != remote_hashes[index]:
+                        remote_f.seek(index * block_size)
+                        remote_f.write(data)
+                        sent_size += len(data)
+                    self.pbar.update(len(data))
+                    index += 1
+                remote_f.truncate(local_file_size)
+            time_end = time.time()
+            upload_logger.info(
+                f"[ -END- ] 文件增量上传完成(用时: {round(time_end - time_start, 0)}秒, "
+                f"发送: {sent_size}/{local_file_size}B): [ {local_file} ] ",
+                extra=transfer_extra(local_file, sent_size, time_end - time_start))
+            self.upload_now = None
+            return True
+        except FileNotFoundError:
+            logger.error(f"文件未找到\n本地:[ {local_file} ]\n远程:[ {remote_file} ]")
+            return False
+        except SSHException as e:
+            logger.error(f"{repr(e)}")
+            self.reconnect()
+        except Exception as e:
+            logger.error(f"{repr(e)}")
+            return False
+
+    @traced("remote_block_hashes", 1)
+    def get_remote_block_hashes(self, remote_file: str, block_size: int) -> Optional[List[bytes]]:
+        """
+        获取远程文件按块计算的md5摘要列表
+        优先使用SFTP的check-file扩展，服务器不支持时尝试通过exec通道在远端执行python计算
+
+        :param remote_file:远程文件的绝对路径（例如：/path/file.txt）
+        :param block_size:分块大小，单位（B）
+        :return:按文件偏移排列的各块md5摘要，均不可用时为None
+        """
+        try:
+            with self.sftp.open(remote_file, 'r') as f:
+                data = f.check('md5', 0, 0, block_size)
+            return [data[i:i + 16] for i in range(0, len(data), 16)]
+        except SSHException as e:
+            logger.error(f"{repr(e)}")
+            self.reconnect()
+            return None
+        except IOError as e:
+            logger.info(f"服务器不支持check-file扩展({e})，尝试通过exec通道计算分块摘要")
+        try:
+            remote_file_size = self.sftp.stat(remote_file).st_size
+        except SSHException as e:
+            logger.error(f"{repr(e)}")
+            self.reconnect()
+            return None
+        except IOError:
+            return None
+        output = self.exec_remote_command(
+            f"python3 -c {shlex.quote(_REMOTE_BLOCK_HASH_SCRIPT)} {shlex.quote(remote_file)} {block_size}")
+        if output is None:
+            return None
+        try:
+            hashes = [bytes.fromhex(line) for line in output.decode().split()]
+        except ValueError:
+            return None
+        # 仅限SFTP的账户会忽略命令并正常退出，输出的块数与文件大小不符时视为不可用
+        if len(hashes) != -(-remote_file_size // block_size):
+            logger.info(f"exec通道输出的分块摘要数与远程文件大小不符，视为不可用: [ {remote_file} ]")
+            return None
+        return hashes
+
+    def exec_remote_command(self, command: str, timeout: float = EXEC_TIMEOUT) -> Optional[bytes]:
+        """
+        通过exec通道在远端执行命令
+        仅限SFTP的账户（ForceCommand internal-sftp）会忽略命令而启动等待标准输入的sftp-server，
+        因此执行后立即关闭通道的写入端，并为读取输出和等待退出码设置超时，超时视为exec通道不可用
+
+        :param command:在远端执行的命令
+        :param timeout:超时时间，单位（s），为两次收到输出之间及等待退出码的最长时间
+        :return:命令退出码为0时为标准输出，命令失败、超时或exec通道不可用时为None
+        """
+        try:
+            channel = self.transport.open_session(timeout=timeout)
+            try:
+                channel.settimeout(timeout)
+                channel.exec_command(command)
+                channel.shutdown_write()
+                output = channel.makefile('rb').read()
+                if not channel.status_event.wait(timeout) or channel.recv_exit_status() != 0:
+                    return None
+                return output
+            finally:
+                channel.close()
+        except socket.timeout:
+            logger.info(f"exec通道执行超时({timeout}秒)，视为不可用: {command}")
+            return None
+        except Exception as e:
+            logger.info(f"exec通道不可用: {repr(e)}")
+            return None
+
+    @traced("link_remote", 2)
+    def link_remote_file(self, source_file: str, remote_file: str, mode: str = "copy") -> bool:
+        """
+        在远程服务器上由已有文件生成目标文件，不经过网络传输文件内容
+        hardlink模式优先使用OpenSSH的hardlink@openssh.com扩展创建硬链接（仅限SFTP的账户也可使用），
+        服务器不支持或目标文件已存在时与copy模式相同，通过exec通道在远端复制文件；
+        复制先写入临时文件再重命名为目标文件，已存在的目标文件即使是其它文件的硬链接，其共用的数据也不会被改写
+
+        :param source_file:远程已有文件的绝对路径
+        :param remote_file:远程目标文件的绝对路径
+        :param mode:copy：只在远端复制  hardlink：硬链接，不支持时复制（链接的文件共用存储，不应再原地改写）
+        :return:是否成功
+        """
+        if mode == "hardlink":
+            try:
+                self.sftp._request(CMD_EXTENDED, "hardlink@openssh.com", source_file, remote_file)
+                return True
+            except SSHException as e:
+                logger.error(f"{repr(e)}")
+                self.reconnect()
+                return False
+            except IOError as e:
+                logger.info(f"服务器不支持hardlink扩展或创建硬链接失败({e})，尝试通过exec通道在远端复制")
+        try:
+            source_size = self.sftp.stat(source_file).st_size
+            # cp完成前没有输出，超时时间按文件大小估算
+            timeout = EXEC_TIMEOUT + source_size / EXEC_COPY_SPEED
+            part_file = shlex.quote(remote_file + ".part")
+            command = (f"cp -- {shlex.quote(source_file)} {part_file} && mv -f -- {part_file} "
+                       f"{shlex.quote(remote_file)} || rm -f -- {part_file}")
+            if self.exec_remote_command(command, timeout) is None:
+                return False
+            # 仅限SFTP的账户会忽略命令并正常退出，以目标文件的大小确认复制成功
+            return self.sftp.stat(remote_file).st_size == source_size
+        except SSHException as e:
+            logger.error(f"{repr(e)}")
+            self.reconnect()
+            return False
+        except IOError as e:
+            logger.info(f"远端复制文件失败({e}): [ {source_file} ] -> [ {remote_file} ]")
+            return False
+
+    @traced("resume_upload", 1)
+    def resume_upload_file(self, local_file: str, remote_file: str) -> bool:
+        """
+        断点续传上传单个文件：以远程文件已有的大小作为已确认上传的偏移，从该处继续上传本地文件剩余的部分
+
+        :param local_file:本地需要上传文件的绝对路径（例如：/path/file.txt）
+        :param remote_file:远程存储文件的绝对路径（例如：/path/file.txt）
+        :return:是否成功
+        """
+        try:
+            local_file_size = os.path.getsize(local_file)
+            offset = self.get_remote_file_size(remote_file) or 0
+            # 远程文件比本地大说明不是同一个文件，从头上传
+            if offset > local_file_size:
+                offset = 0
+            upload_logger.info(f"[ -START- ] 当前续传的文件是(从 {offset}B 处开始): [ {local_file} ]")
+            self.upload_now = local_file
+            time_start = time.time()
+            with open(local_file, 'rb') as local_f, self.sftp.open(remote_file, 'r+' if offset else 'w') as remote_f, \
+                    tqdm(total=local_file_size, initial=offset, unit='B', unit_scale=True) as self.pbar:
+                remote_f.set_pipelined(True)
+                local_f.seek(offset)
+                remote_f.seek(offset)
+                while True:
+                    data = local_f.read(1024 * 1024)
+                    if not data:
+                        break
+                    remote_f.write(data)
+                    self.pbar.update(len(data))
+            time_end = time.time()
+            upload_logger.info(f"[ -END- ] 文件续传完成(用时: {round(time_end - time_start, 0)}秒): [ {local_file} ] ",
+                               extra=transfer_extra(local_file, local_file_size - offset, time_end - time_start))
             self.upload_now = None
             return True
         except FileNotFoundError:
@@ -180,25 +424,159 @@ class SFTPClient:
         # if transferred % (1024 * 1024 * self.process_print_frequency) == 0:
         #     upload_logger.info(f"上传进度: {transferred} / {total}")
 
-    def download_file(self, remote_file: str, local_file: str) -> bool:
+    @traced("download", 1)
+    def download_file(
+            self,
+            remote_file: str,
+            local_file: str,
+            sftp: paramiko.SFTPClient = None,
+            controller: AdaptiveController = None
+    ) -> bool:
         """
         下载单个文件（windows路径用"\"分隔，linux用"/"分隔）
 
         :param remote_file:远程需要下载文件的绝对路径（例如：/path/file.txt）
         :param local_file:本地需要保存文件的绝对路径（例如：/path/file.txt）
+        :param sftp:使用的SFTP通道，为空时使用客户端自身的通道；多线程下载时各线程传入open_sftp_channel打开的通道
+        :param controller:自适应控制器，传入时按其给出的预读请求数下载，并上报本次下载的吞吐量和往返时延
         :return:是否成功
         """
+        sftp = sftp or self.sftp
         try:
             download_logger.info(f"[ -START- ] 当前下载的文件是: [ {remote_file} ]")
             self.download_now = remote_file
+            # 获取文件大小的stat请求同时用于测量往返时延
+            rtt_start = time.time()
+            remote_file_size = sftp.stat(remote_file).st_size
+            rtt = time.time() - rtt_start
             time_start = time.time()
-            remote_file_size = self.get_remote_file_size(remote_file)
-            with tqdm(total=remote_file_size, unit='B', unit_scale=True) as self.pbar:
-                self.sftp.get(remote_file, local_file, callback=self.__print_download_process)
+            with tqdm(total=remote_file_size, unit='B', unit_scale=True) as pbar:
+                sftp.get(remote_file, local_file, callback=lambda transferred, total: pbar.update(transferred - pbar.n),
+                         max_concurrent_prefetch_requests=controller.requests if controller else None)
             # self.sftp.get(remote_file, local_file, callback=self.__print_download_process)
             time_end = time.time()
             download_logger.info(
-                f"[ -END- ] 文件下载完成(用时: {round(time_end - time_start, 0)}秒): [ {remote_file} ]")
+                f"[ -END- ] 文件下载完成(用时: {round(time_end - time_start, 0)}秒): [ {remote_file} ]",
+                extra=transfer_extra(remote_file, remote_file_size, time_end - time_start))
+            if controller:
+                controller.record(remote_file_size, time_end - time_start, rtt)
+            self.download_now = None
+            return True
+        except FileNotFoundError:
+            logger.error(f"文件未找到\n本地:[ {local_file} ]\n远程:[ {remote_file} ]")
+            return False
+        except SSHException as e:
+            logger.error(f"{repr(e)}")
+            # 其它线程的通道出错时只返回失败，由主线程负责重连
+            if sftp is not self.sftp:
+                return False
+            self.reconnect()
+        except Exception as e:
+            logger.error(f"{repr(e)}")
+            return False
+
+    @traced("download_buffered", 1)
+    def download_file_buffered(
+            self,
+            remote_file: str,
+            local_file: str,
+            sftp: paramiko.SFTPClient = None,
+            controller: AdaptiveController = None,
+            buffers: int = 4,
+            buffer_size: int = 1024 * 1024,
+            preallocate: bool = False,
+            fsync_every: int = FSYNC_NEVER
+    ) -> bool:
+        """
+        下载单个文件，网络读取与磁盘写入分离：当前线程只负责从SFTP预读队列中取出数据块，由独立的写盘线程写入本地文件，
+        本地磁盘较慢（SD卡、网络挂载盘等）时不再阻塞SFTP的预读流水线
+
+        :param remote_file:远程需要下载文件的绝对路径（例如：/path/file.txt）
+        :param local_file:本地需要保存文件的绝对路径（例如：/path/file.txt）
+        :param sftp:使用的SFTP通道，为空时使用客户端自身的通道；多线程下载时各线程传入open_sftp_channel打开的通道
+        :param controller:自适应控制器，传入时按其给出的预读请求数下载，并上报本次下载的吞吐量和往返时延
+        :param buffers:写盘缓冲环大小（数据块个数），为2时即双缓冲
+        :param buffer_size:每个数据块的大小，单位（B）
+        :param preallocate:是否预先分配本地文件空间
+        :param fsync_every:同步策略，FSYNC_NEVER：从不、FSYNC_FILE：文件写完后、大于0：每写入该字节数
+        :return:是否成功
+        """
+        sftp = sftp or self.sftp
+        try:
+            download_logger.info(f"[ -START- ] 当前下载的文件是: [ {remote_file} ]")
+            self.download_now = remote_file
+            # 获取文件大小的stat请求同时用于测量往返时延
+            rtt_start = time.time()
+            remote_file_size = sftp.stat(remote_file).st_size
+            rtt = time.time() - rtt_start
+            time_start = time.time()
+            with sftp.open(remote_file, 'r') as remote_f, \
+                    DiskWriter(local_file, remote_file_size, buffers, preallocate, fsync_every) as writer, \
+                    tqdm(total=remote_file_size, unit='B', unit_scale=True) as pbar:
+                remote_f.prefetch(remote_file_size,
+                                  max_concurrent_requests=controller.requests if controller else None)
+                while True:
+                    data = remote_f.read(buffer_size)
+                    if not data:
+                        break
+                    writer.write(data)
+                    pbar.update(len(data))
+            time_end = time.time()
+            download_logger.info(
+                f"[ -END- ] 文件下载完成(用时: {round(time_end - time_start, 0)}秒): [ {remote_file} ]",
+                extra=transfer_extra(remote_file, remote_file_size, time_end - time_start))
+            if controller:
+                controller.record(remote_file_size, time_end - time_start, rtt)
+            self.download_now = None
+            return True
+        except FileNotFoundError:
+            logger.error(f"文件未找到\n本地:[ {local_file} ]\n远程:[ {remote_file} ]")
+            return False
+        except SSHException as e:
+            logger.error(f"{repr(e)}")
+            # 其它线程的通道出错时只返回失败，由主线程负责重连
+            if sftp is not self.sftp:
+                return False
+            self.reconnect()
+        except Exception as e:
+            logger.error(f"{repr(e)}")
+            return False
+
+    @traced("resume_download", 1)
+    def resume_download_file(self, remote_file: str, local_file: str) -> bool:
+        """
+        断点续传下载单个文件：以本地文件已有的大小作为已确认下载的偏移，从该处继续下载远程文件剩余的部分
+
+        :param remote_file:远程需要下载文件的绝对路径（例如：/path/file.txt）
+        :param local_file:本地需要保存文件的绝对路径（例如：/path/file.txt）
+        :return:是否成功
+        """
+        try:
+            remote_file_size = self.sftp.stat(remote_file).st_size
+            offset = os.path.getsize(local_file) if os.path.exists(local_file) else 0
+            # 本地文件比远程大说明不是同一个文件，从头下载
+            if offset > remote_file_size:
+                offset = 0
+            # 预分配空间的下载中断后留下的临时文件大小不代表已下载的字节数，不能用于续传
+            if os.path.exists(local_file + PART_SUFFIX):
+                os.remove(local_file + PART_SUFFIX)
+            download_logger.info(f"[ -START- ] 当前续传的文件是(从 {offset}B 处开始): [ {remote_file} ]")
+            self.download_now = remote_file
+            time_start = time.time()
+            with self.sftp.open(remote_file, 'r') as remote_f, open(local_file, 'ab' if offset else 'wb') as local_f, \
+                    tqdm(total=remote_file_size, initial=offset, unit='B', unit_scale=True) as self.pbar:
+                remote_f.seek(offset)
+                remote_f.prefetch(remote_file_size)
+                while True:
+                    data = remote_f.read(1024 * 1024)
+                    if not data:
+                        break
+                    local_f.write(data)
+                    self.pbar.update(len(data))
+            time_end = time.time()
+            download_logger.info(
+                f"[ -END- ] 文件续传完成(用时: {round(time_end - time_start, 0)}秒): [ {remote_file} ]",
+                extra=transfer_extra(remote_file, remote_file_size - offset, time_end - time_start))
             self.download_now = None
             return True
         except FileNotFoundError:
@@ -248,6 +626,7 @@ class SFTPClient:
         # if transferred % (1024 * 1024 * self.process_print_frequency) == 0:
         #     download_logger.info(f"下载进度: {transferred} / {total}")
 
+    @traced("compare", 1)
     def compare_files(self, local_file: str, remote_file: str) -> str:
         """
         比较本地文件和远程文件是否一样
@@ -281,6 +660,7 @@ class SFTPClient:
             logger.error(f"{repr(e)}")
             return ""
 
+    @traced("delete_local", 1)
     def delete_local_file(self, local_file: str) -> bool:
         """
         删除本地文件
@@ -298,6 +678,7 @@ class SFTPClient:
             logger.error(f"{repr(e)}")
             return False
 
+    @traced("delete_remote", 1)
     def delete_remote_file(self, remote_file: str) -> bool:
         """
         删除远程文件
@@ -315,6 +696,7 @@ class SFTPClient:
             logger.error(f"{e} [ {remote_file} ]")
             return False
 
+    @traced("stat_local", 1)
     def check_local_file_exists(self, local_file: str) -> bool:
         """
         判断本地是否存在想要找的文件
@@ -331,6 +713,7 @@ class SFTPClient:
         except IOError:
             return False
 
+    @traced("stat_remote", 1)
     def check_remote_file_exists(self, remote_file: str) -> bool:
         """
         判断远程SFTP服务器是否存在想要找的文件
@@ -347,6 +730,7 @@ class SFTPClient:
         except IOError:
             return False
 
+    @traced("stat_remote", 1)
     def check_remote_path_exists(self, remote_path: str) -> bool:
         """
         判断远程SFTP服务器下的目标路径是否存在
@@ -364,6 +748,7 @@ class SFTPClient:
         except IOError:
             return False
 
+    @traced("mkdir_remote", 1)
     def make_remote_dir(self, remote_path) -> bool:
         """
         创建远程文件夹
@@ -381,6 +766,7 @@ class SFTPClient:
             self.sftp.mkdir(remote_path)
             return True
 
+    @traced("stat_remote", 1)
     def get_remote_file_size(self, remote_path) -> int:
         """
         获取远程文件的文件大小
@@ -471,21 +857,81 @@ class SFTPClient:
             file_dict = {}
             # 检查本地目标路径是否存在
             if os.path.exists(local_path):
-                file_list_sorted = sorted(os.listdir(local_path))
+                with os.scandir(local_path) as it:
+                    file_list_sorted = sorted(it, key=lambda x: x.name)
                 for item in file_list_sorted:
-                    item_path = os.path.join(local_path, item)
-                    if os.path.isdir(item_path):
+                    # scandir条目自带d_type，判断是否为目录无需额外的stat调用
+                    if item.is_dir():
                         # 如果是子目录，则递归调用扫描子目录下的文件，加入列表
-                        files = self.get_local_all_file(item_path)
-                        file_dict[item] = {"type": "dir", "files": files}
+                        files = self.get_local_all_file(item.path)
+                        file_dict[item.name] = {"type": "dir", "files": files}
                     else:
                         # 如果是文件，则加入列表
-                        file_dict[item] = {"type": "file"}
+                        file_dict[item.name] = {"type": "file"}
             return file_dict
         except Exception as e:
             logger.error(f"{repr(e)}")
             return {}
 
+    @traced("list_remote", 1)
+    def get_remote_tree(self, remote_path, file_filter: FileFilter = None,
+                        dir_filter: Callable[[str], bool] = None) -> FileTree:
+        """
+        递归获取远程SFTP服务器目标路径下的所有文件夹和文件，以紧凑目录树形式返回
+        与get_remote_all_file相比不为每个条目创建字典，适用于百万级条目的目录
+
+        :param remote_path: 远程目标绝对路径
+        :param file_filter: 文件过滤器，命中剪枝规则的子目录不再列出，不符合规则的文件不加入目录树
+        :param dir_filter: 目录筛选函数，参数为以"/"分隔的相对路径，返回False的子目录不再列出（例如上传时只列出本地存在的目录）
+        :return:该路径下的所有文件夹及文件组成的目录树，路径不存在时为空树；无法列出的子目录跳过并记录在目录树的incomplete中
+        :raise:连接出错或根目录无法列出时抛出异常，调用方应结束本轮，不能按空的远程目录生成计划
+        """
+        tree = FileTree(remote_path, "/")
+        try:
+            # 检查远程目标路径是否存在
+            self.sftp.stat(remote_path)
+        except FileNotFoundError:
+            return tree
+        except SSHException as e:
+            logger.error(f"{repr(e)}")
+            self.reconnect()
+            raise
+        try:
+            self.__fill_remote_tree(tree, 0, remote_path, "", file_filter, dir_filter)
+        except SSHException as e:
+            logger.error(f"{repr(e)}")
+            self.reconnect()
+            raise
+        return tree
+
+    def __fill_remote_tree(self, tree: FileTree, dir_id: int, remote_path: str, rel_path: str,
+                           file_filter: FileFilter = None, dir_filter: Callable[[str], bool] = None):
+        """按文件名排序递归将远程目录下的条目加入目录树，rel_path为以"/"分隔的相对路径"""
+        try:
+            file_list = self.sftp.listdir_attr(remote_path)
+        except IOError as e:
+            # 连接已断开或根目录无法列出时整个目录树不可用；单个子目录（例如没有权限）只跳过该子目录
+            if not rel_path or self.transport is None or not self.transport.is_active():
+                raise
+            logger.error(f"{repr(e)} [ {remote_path} ]")
+            tree.incomplete.append(rel_path)
+            return
+        file_list_sorted = sorted(file_list, key=lambda x: x.filename)
+        for item in file_list_sorted:
+            item_rel = f"{rel_path}/{item.filename}" if rel_path else item.filename
+            if stat.S_ISDIR(item.st_mode):
+                if file_filter is not None and not file_filter.match_dir(item_rel, item.filename):
+                    continue
+                if dir_filter is not None and not dir_filter(item_rel):
+                    continue
+                path = os.path.join(remote_path, item.filename)
+                path = self.format_remote_path(path)
+                sub_id = tree.add(dir_id, item.filename, item.st_size, item.st_mtime, item.st_mode, path)
+                # 如果是子目录，则递归扫描子目录下的文件
+                self.__fill_remote_tree(tree, sub_id, path, item_rel, file_filter, dir_filter)
+            elif file_filter is None or file_filter.match_file(item_rel, item.filename, item.st_size, item.st_mtime):
+                tree.add(dir_id, item.filename, item.st_size, item.st_mtime, item.st_mode)
+
     def format_remote_path(self, path) -> str:
         """
         根据传入的远程路径判断是否需要修改路径以契合远程服务器使用的系统
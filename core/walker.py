@@ -0,0 +1,130 @@
+# -*- coding:utf-8 -*
+"""
+@File  : walker.py
+@Author: DJW
+@Date  : 2023-11-20 09:30
+@Desc  : 基于os.scandir的本地目录树遍历，流式产出文件条目
+"""
+import os
+import queue
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Iterator, NamedTuple, List, Optional
+
+from core.filters import FileFilter
+from logging_config import sftp_client as logger
+
+
+class FileEntry(NamedTuple):
+    """遍历产出的文件条目"""
+    path: str  # 文件绝对路径
+    size: int  # 文件大小，单位（B）
+    mtime: float  # 文件修改时间戳
+
+
+# 并行遍历时，标记某个子目录已遍历完成
+_DONE = object()
+
+
+def _scan_dir(dir_path: str, rel_path: str = "", file_filter: Optional[FileFilter] = None) -> Iterator[FileEntry]:
+    """
+    按文件名排序递归遍历目录，复用scandir返回的d_type及stat缓存，不再对每个条目额外调用isdir
+
+    :param dir_path:目录绝对路径
+    :param rel_path:目录相对于遍历根目录的相对路径，以"/"分隔，根目录为空字符串
+    :param file_filter:文件过滤器，命中剪枝规则的子目录不再遍历，不符合规则的文件不产出
+    :return:文件条目生成器
+    """
+    try:
+        with os.scandir(dir_path) as it:
+            entries = sorted(it, key=lambda x: x.name)
+    except OSError as e:
+        logger.error(f"{repr(e)}")
+        return
+    for entry in entries:
+        entry_rel = f"{rel_path}/{entry.name}" if rel_path else entry.name
+        try:
+            if entry.is_dir():
+                if file_filter is None or file_filter.match_dir(entry_rel, entry.name):
+                    yield from _scan_dir(entry.path, entry_rel, file_filter)
+            elif file_filter is None:
+                st = entry.stat()
+                yield FileEntry(entry.path, st.st_size, st.st_mtime)
+            elif file_filter.match_name(entry_rel, entry.name):
+                # 文件名不符合规则时不获取文件属性
+                st = entry.stat()
+                if file_filter.match_stat(st.st_size, st.st_mtime):
+                    yield FileEntry(entry.path, st.st_size, st.st_mtime)
+        except OSError as e:
+            # 遍历期间文件被删除等情况，跳过该条目
+            logger.error(f"{repr(e)}")
+
+
+def scan_local_tree(local_path: str, workers: int = 1, max_pending: int = 10000,
+                    file_filter: Optional[FileFilter] = None) -> Iterator[FileEntry]:
+    """
+    流式遍历本地目标路径下的所有文件，调用方可以边遍历边处理（例如边扫描边上传）
+
+    :param local_path:本地目标绝对路径
+    :param workers:遍历线程数，为1时在当前线程按文件名顺序遍历；大于1时各一级子目录分配到线程池并行遍历，产出顺序不固定
+    :param max_pending:并行遍历时已扫描但尚未被消费的条目上限，防止遍历远快于消费时占用过多内存
+    :param file_filter:文件过滤器，命中剪枝规则的子目录不再遍历，不符合规则的文件不产出
+    :return:文件条目生成器，路径不存在时不产出任何条目
+    """
+    if not os.path.isdir(local_path):
+        return
+    if workers <= 1:
+        yield from _scan_dir(local_path, "", file_filter)
+        return
+
+    try:
+        with os.scandir(local_path) as it:
+            entries = sorted(it, key=lambda x: x.name)
+    except OSError as e:
+        logger.error(f"{repr(e)}")
+        return
+    sub_dirs: List[os.DirEntry] = []
+    for entry in entries:
+        try:
+            if entry.is_dir():
+                if file_filter is None or file_filter.match_dir(entry.name, entry.name):
+                    sub_dirs.append(entry)
+            elif file_filter is None or file_filter.match_name(entry.name, entry.name):
+                st = entry.stat()
+                if file_filter is None or file_filter.match_stat(st.st_size, st.st_mtime):
+                    yield FileEntry(entry.path, st.st_size, st.st_mtime)
+        except OSError as e:
+            logger.error(f"{repr(e)}")
+    if not sub_dirs:
+        return
+
+    results = queue.Queue(maxsize=max_pending)
+    stop = threading.Event()
+
+    def walk(sub_dir: os.DirEntry):
+        try:
+            for item in _scan_dir(sub_dir.path, sub_dir.name, file_filter):
+                if stop.is_set():
+                    break
+                results.put(item)
+        finally:
+            results.put(_DONE)
+
+    pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="scan_local_tree")
+    remaining = len(sub_dirs)
+    for sub_dir in sub_dirs:
+        pool.submit(walk, sub_dir)
+    try:
+        while remaining:
+            item = results.get()
+            if item is _DONE:
+                remaining -= 1
+            else:
+                yield item
+    finally:
+        # 调用方提前停止消费时，通知遍历线程退出并清空队列避免线程阻塞在put上
+        stop.set()
+        while remaining:
+            if results.get() is _DONE:
+                remaining -= 1
+        pool.shutdown(wait=True)
@@ -5,34 +5,120 @@
 @Date  : 2023-11-06 14:16
 @Desc  : 将本地目录下的所有文件，以设定上传时间间隔进行单个文件依次上传至远程SFTP服务器中的目标目录
 """
+import atexit
 import os
 import time
-import logging.config
+from typing import Iterator
 
+from core import journal as jn, planner
+from core.dedup import DedupIndex
 from core.Enum import *
+from core.filters import FileFilter
 from core.sftp_client import SFTPClient
-from logging_config import local_upload_to_sftp as logger, create_log_folder, LOGGING_CONFIG
+from core.pipeline import PostTransferStage
+from core.profiling import TRACER, span
+from core.planner import SyncPlan, iter_sync
+from core.walker import scan_local_tree
+from logging_config import local_upload_to_sftp as logger, setup_logging
 
 
-def upload_file(sftp_c: SFTPClient, local_f: str, remote_f: str) -> bool:
+def dedup_link_mode() -> str:
     """
-    上传、检查、删除文件
+    远端生成文件的方式：增量上传原地改写远端文件，硬链接的文件会被一同改动，启用增量上传时只在远端复制
+
+    :return:hardlink/copy
+    """
+    if CONFIG.upload_dedup_link == "hardlink" and CONFIG.upload_delta:
+        return "copy"
+    return CONFIG.upload_dedup_link
+
+
+def unlink_remote_target(sftp_c: SFTPClient, remote_f: str):
+    """
+    删除远端已有的目标文件：硬链接模式下该文件可能与其它文件共用存储，完整上传以'wb'打开会截断并改写共用的数据，
+    先删除目录项再上传，其它链接保持原内容
+
+    :param sftp_c:sftp客户端类
+    :param remote_f:远端文件绝对路径
+    """
+    try:
+        sftp_c.sftp.remove(remote_f)
+    except FileNotFoundError:
+        pass
+
+
+def link_duplicate(sftp_c: SFTPClient, dedup: DedupIndex, digest: str, local_f: str, remote_f: str) -> bool:
+    """
+    远程已有相同内容的文件时，在远端由该文件生成目标文件代替上传
 
     :param sftp_c:sftp客户端类
+    :param dedup:内容寻址去重索引
+    :param digest:本地文件的内容摘要
     :param local_f:本地文件绝对路径
     :param remote_f:远端文件绝对路径
+    :return: 已在远端生成：True、需要上传：False
+    """
+    found = dedup.find_remote(digest)
+    if found is None or found.remote_file == remote_f:
+        return False
+    size = os.path.getsize(local_f)
+    if not size:
+        return False
+    # 确认远程文件仍然存在且大小未变化，否则索引记录失效
+    if found.size != size or sftp_c.get_remote_file_size(found.remote_file) != size:
+        dedup.forget_remote(digest)
+        return False
+    if not sftp_c.link_remote_file(found.remote_file, remote_f, dedup_link_mode()):
+        return False
+    logger.info(f"[ {local_f} ] 与远端 [ {found.remote_file} ] 内容相同，已在远端生成，不再上传")
+    return True
+
+
+def upload_file(sftp_c: SFTPClient, stage: PostTransferStage, local_f: str, remote_f: str,
+                delta: bool = False, journal: jn.TransferJournal = None, resume: bool = False,
+                dedup: DedupIndex = None) -> bool:
+    """
+    上传文件，并将检查、删除提交到传输后处理流水线
+
+    :param sftp_c:sftp客户端类
+    :param stage:传输后处理流水线阶段，负责比较本地文件和远端文件并删除本地文件
+    :param local_f:本地文件绝对路径
+    :param remote_f:远端文件绝对路径
+    :param delta:是否使用块级增量上传（远端已存在该文件时使用）
+    :param journal:传输日志，传入时记录传输状态
+    :param resume:是否从远端文件已有的大小处续传
+    :param dedup:内容寻址去重索引，传入时远端已有相同内容的文件不再上传，完整上传成功的文件登记到索引中
     :return: 成功：True、失败：False
     """
     try:
+        st = os.stat(local_f)
+        if journal is not None:
+            journal.record(jn.UPLOAD, local_f, remote_f, jn.IN_PROGRESS, st.st_size, st.st_mtime,
+                           mode=jn.DELTA if delta and not resume else jn.FULL)
+        # 续传和增量上传不会由已有文件生成，只在完整上传时计算摘要，避免额外读取一遍文件
+        digest = None
+        if dedup is not None and not resume and not delta:
+            digest = dedup.file_digest(local_f, st.st_size, st.st_mtime)
         # 上传文件
-        upload_r = sftp_c.upload_file(local_f, remote_f)
-        # 比较本地文件和远端文件
-        compare_r = sftp_c.compare_files(local_f, remote_f)
-        if upload_r and compare_r == "=":
+        if resume:
+            upload_r = sftp_c.resume_upload_file(local_f, remote_f)
+        elif delta:
+            upload_r = sftp_c.upload_file_delta(local_f, remote_f, CONFIG.upload_delta_block_size)
+        else:
+            if dedup_link_mode() == "hardlink":
+                unlink_remote_target(sftp_c, remote_f)
+            if digest is not None and link_duplicate(sftp_c, dedup, digest, local_f, remote_f):
+                upload_r = True
+            else:
+                upload_r = sftp_c.upload_file(local_f, remote_f)
+        if upload_r:
             logger.info(f"[ {local_f} ] 上传成功!")
-            # 若成功上传并且本地文件和远程文件一样则删除本地文件
-            sftp_c.delete_local_file(local_f)
-            logger.info(f"删除本地文件 [ {local_f} ]")
+            if journal is not None:
+                journal.record(jn.UPLOAD, local_f, remote_f, jn.TRANSFERRED, offset=st.st_size)
+            if digest is not None:
+                dedup.add_remote(digest, remote_f, st.st_size)
+            # 后台比较本地文件和远端文件，一样则删除本地文件，不阻塞下一个文件的上传
+            stage.submit(local_f, remote_f, delete="local")
             return True
         else:
             logger.error(f"[ {local_f} ] 上传失败")
@@ -42,98 +128,224 @@ def upload_file(sftp_c: SFTPClient, local_f: str, remote_f: str) -> bool:
         return False
 
 
-def traversal_file(sftp_c: SFTPClient, local_p: str, remote_p: str, local_path_files: dict) -> bool:
+def ensure_remote_dirs(sftp_c: SFTPClient, remote_p: str, rel_dir: str, checked_dirs: set) -> str:
     """
-        递归遍历上传文件及文件夹内的文件
+    逐级检查并创建本地相对目录对应的远程目录
+
+    :param sftp_c:sftp客户端类
+    :param remote_p:远程文件目录的绝对路径
+    :param rel_dir:文件所在目录相对于本地上传根目录的相对路径
+    :param checked_dirs:已确认存在的远程目录集合，避免重复检查
+    :return: 对应的远程目录绝对路径
+    """
+    remote_p_dir = remote_p
+    if rel_dir == os.curdir:
+        return remote_p_dir
+    for part in rel_dir.split(os.sep):
+        # 组合路径，并根据传入的远程路径判断是否需要修改路径以契合远程服务器使用的系统
+        remote_p_dir = sftp_c.format_remote_path(os.path.join(remote_p_dir, part))
+        if remote_p_dir in checked_dirs:
+            continue
+        # 若没有则创建远程文件夹
+        if not sftp_c.check_remote_path_exists(remote_p_dir):
+            sftp_c.make_remote_dir(remote_p_dir)
+            logger.info(f"新生成远程存储目录：{remote_p_dir}")
+        checked_dirs.add(remote_p_dir)
+    return remote_p_dir
+
 
-        :param sftp_c:sftp客户端类
-        :param local_p:本地文件目录的绝对路径
-        :param remote_p:远程文件目录的绝对路径
-        :param local_path_files:通过get_local_all_file方法获取的路径下所有文件夹及文件字典
-        :return: 成功：True、失败：False
+def recover_from_journal(sftp_c: SFTPClient, stage: PostTransferStage, journal: jn.TransferJournal):
+    """
+    按传输日志继续上次进程退出时未完成的上传：传输中的文件续传，已传输、已校验的文件直接提交校验删除
+
+    :param sftp_c:sftp客户端类
+    :param stage:传输后处理流水线阶段
+    :param journal:传输日志
     """
     try:
-        for filename, info in local_path_files.items():
-            # 若当前为目录且目录下有文件，则递归上传该文件夹内的文件
-            if info["type"] == "dir" and info["files"]:
-                # 组合路径
-                local_p_dir = os.path.join(local_p, filename)
-                remote_p_dir = os.path.join(remote_p, filename)
-                # 根据传入的远程路径判断是否需要修改路径以契合远程服务器使用的系统
-                remote_p_dir = sftp_c.format_remote_path(remote_p_dir)
-                # 若没有则创建远程文件夹
-                if not sftp_c.check_remote_path_exists(remote_p_dir):
-                    sftp_c.make_remote_dir(remote_p_dir)
-                    logger.info(f"新生成远程存储目录：{remote_p_dir}")
-                # 遍历子目录
-                logger.info(f"开始上传 [ {local_p_dir} ]目录下的文件")
-                traversal_file(sftp_c, local_p_dir, remote_p_dir, info["files"])
-            # 若为空文件夹则跳过
-            elif info["type"] == "dir" and not info["files"]:
+        for row in journal.pending(jn.UPLOAD):
+            try:
+                st = os.stat(row.source)
+            except FileNotFoundError:
+                # 本地文件已被删除（删除后的状态尚未落盘进程就退出了）
+                journal.forget(jn.UPLOAD, row.source)
                 continue
-            # 不是文件夹则开始检查文件并上传
+            if not row.matches(st.st_size, st.st_mtime):
+                # 文件已被替换，按新文件处理
+                journal.forget(jn.UPLOAD, row.source)
+                continue
+            logger.info(f"按传输日志恢复 [ {row.source} ]({row.state})")
+            if row.state in (jn.TRANSFERRED, jn.VERIFIED):
+                stage.submit(row.source, row.target, delete="local", verify=row.state == jn.TRANSFERRED)
+            elif row.state == jn.IN_PROGRESS and row.mode == jn.DELTA:
+                # 增量上传中断，远端文件大小不代表进度，重新比较全部分块（已关闭增量上传时从头上传）
+                upload_file(sftp_c, stage, row.source, row.target, delta=bool(CONFIG.upload_delta), journal=journal)
             else:
-                # 检查文件格式
-                if not filename.endswith(UPLOAD_FILE_LAYOUT):
-                    logger.error(f"[ {filename} ]文件格式有误，格式应为[ {UPLOAD_FILE_LAYOUT} ]")
-                    continue
-                local_file = os.path.join(local_p, filename)
-                remote_file = os.path.join(remote_p, filename)
-                # 根据传入的远程路径判断是否需要修改路径以契合远程服务器使用的系统
-                remote_file = sftp_c.format_remote_path(remote_file)
-                # 检查远端是否存在该文件
-                if sftp_c.check_remote_file_exists(remote_file):
-                    # 若远端存在该文件，则比较两个文件的大小
-                    compare_res = sftp_c.compare_files(local_file, remote_file)
-                    # 若本地文件大于远端文件，则删除远端文件进行重传，否则就删除本地文件
-                    if compare_res == ">":
-                        logger.info(f"开始重传 [ {local_file} ]")
-                        upload_file(sftp_c, local_file, remote_file)
-                    else:
-                        logger.info(f"[ {UPLOAD_REMOTE_PATH} ] 中已存在 [ {filename} ] 文件")
-                        sftp_c.delete_local_file(local_file)
-                        logger.info(f"删除本地文件 [ {local_file} ]")
-                        continue
-                else:
-                    upload_file(sftp_c, local_file, remote_file)
-                logger.info(
-                    f"--------------------------{UPLOAD_TIME_INTERVAL}秒后上传下一个文件--------------------------")
-                time.sleep(UPLOAD_TIME_INTERVAL)
-        return True
+                upload_file(sftp_c, stage, row.source, row.target, journal=journal,
+                            resume=row.state == jn.IN_PROGRESS)
+    except Exception as e:
+        # 未恢复的记录保留在传输日志中，由之后的扫描按记录的状态继续处理
+        logger.error(f"{repr(e)}")
+        sftp_c.reconnect()
+    stage.join()
+
+
+def iter_upload_items(sftp_c: SFTPClient, journal: jn.TransferJournal = None,
+                      file_filter: FileFilter = None) -> Iterator[planner.PlanItem]:
+    """
+    流式生成本轮上传操作：本地目录边扫描边与远程目录列表线性归并，不再逐个文件查询远端
+    远程目录只列出本地同样存在的子目录，远端归档中本地已没有的目录不会被遍历
+
+    :param sftp_c:sftp客户端类
+    :param journal:传输日志，传入时按已记录的状态续传或直接校验删除
+    :param file_filter:文件过滤器，在遍历本地目录时使用
+    :return:上传操作生成器
+    :raise:远程目录列表获取失败（连接出错）时抛出异常，本轮不上传
+    """
+    local_root = CONFIG.upload_local_path
+    local_files = scan_local_tree(local_root, CONFIG.upload_scan_workers, file_filter=file_filter)
+    remote_tree = sftp_c.get_remote_tree(
+        CONFIG.upload_remote_path, dir_filter=lambda rel: os.path.isdir(os.path.join(local_root, *rel.split("/"))))
+    if remote_tree.incomplete:
+        # 无法列出的远程子目录中已有哪些文件未知，本轮跳过本地对应目录下的文件，避免全部重新上传
+        incomplete = tuple(os.path.join(local_root, *rel.split("/")) + os.sep for rel in remote_tree.incomplete)
+        local_files = (entry for entry in local_files if not entry.path.startswith(incomplete))
+    return iter_sync(jn.UPLOAD, local_files, local_root, os.sep,
+                     remote_tree.iter_files(), CONFIG.upload_remote_path, "/", CONFIG.upload_file_layout,
+                     journal, sources_sorted=CONFIG.upload_scan_workers <= 1)
+
+
+def build_plan(sftp_c: SFTPClient, journal: jn.TransferJournal = None,
+               file_filter: FileFilter = None) -> SyncPlan:
+    """
+    生成本轮完整的上传计划（用于预览），参数同iter_upload_items
+
+    :return:上传计划
+    """
+    plan = SyncPlan(jn.UPLOAD, CONFIG.upload_local_path, CONFIG.upload_remote_path)
+    for item in iter_upload_items(sftp_c, journal, file_filter):
+        plan.add(item)
+    return plan
+
+
+def sync_files(sftp_c: SFTPClient, stage: PostTransferStage, journal: jn.TransferJournal = None,
+               file_filter: FileFilter = None, dedup: DedupIndex = None) -> SyncPlan:
+    """
+    边归并边执行本轮上传：无需传输的文件提交校验删除，需要传输的文件依次上传，不保存每个文件的操作
+
+    :param sftp_c:sftp客户端类
+    :param stage:传输后处理流水线阶段
+    :param journal:传输日志，传入时记录传输状态
+    :param file_filter:文件过滤器，在遍历本地目录时使用
+    :param dedup:内容寻址去重索引，传入时远端已有相同内容的文件不再上传
+    :return: 本轮各操作的统计（不含操作列表），出错时为已执行部分的统计
+    """
+    stats = SyncPlan(jn.UPLOAD, CONFIG.upload_local_path, CONFIG.upload_remote_path, keep_items=False)
+    try:
+        checked_dirs = set()
+        current_dir = None
+        for item in iter_upload_items(sftp_c, journal, file_filter):
+            stats.add(item)
+            if item.action == planner.SKIP:
+                logger.error(
+                    f"[ {os.path.basename(item.source.path)} ]文件格式有误，格式应为[ {CONFIG.upload_file_layout} ]")
+                continue
+            if item.action in (planner.FINISH, planner.DELETE):
+                if item.action == planner.DELETE:
+                    logger.info(f"[ {stats.target_root} ] 中已存在 [ {os.path.basename(item.source.path)} ] 文件")
+                stage.submit(item.source.path, item.target, delete="local", verify=item.verify)
+                continue
+            local_file = item.source.path
+            local_p_dir = os.path.dirname(local_file)
+            ensure_remote_dirs(sftp_c, stats.target_root, os.path.relpath(local_p_dir, stats.source_root),
+                               checked_dirs)
+            if local_p_dir != current_dir:
+                current_dir = local_p_dir
+                logger.info(f"开始上传 [ {local_p_dir} ]目录下的文件")
+            # 根据传入的远程路径判断是否需要修改路径以契合远程服务器使用的系统
+            remote_file = sftp_c.format_remote_path(item.target)
+            if item.action == planner.RESUME:
+                # 传输日志中记录上传中断，从远端已有的大小处续传
+                logger.info(f"开始续传 [ {local_file} ]")
+                upload_file(sftp_c, stage, local_file, remote_file, journal=journal, resume=True, dedup=dedup)
+            elif item.action == planner.RETRANSFER:
+                # 本地文件大于远端文件，重传（启用增量上传时只发送变化的块）
+                logger.info(f"开始重传 [ {local_file} ]")
+                upload_file(sftp_c, stage, local_file, remote_file, delta=bool(CONFIG.upload_delta),
+                            journal=journal, dedup=dedup)
+            else:
+                upload_file(sftp_c, stage, local_file, remote_file, journal=journal, dedup=dedup)
+            logger.info(
+                f"--------------------------{CONFIG.upload_time_interval}秒后上传下一个文件--------------------------")
+            with span("sleep"):
+                CONFIG.sleep(CONFIG.upload_time_interval)
     except Exception as error:
         logger.error(error)
-        return False
+    return stats
 
 
 def main():
     sftp_client = SFTPClient(HOSTNAME, USERNAME, PASSWORD)
     sftp_client.connect()
+    # 传输日志：记录每个文件的传输状态，进程重启后从中断处继续
+    journal = jn.TransferJournal(CONFIG.journal_path) if CONFIG.journal_path else None
+    stage = PostTransferStage(sftp_client, logger, journal=journal)
+    stage.start()
+    if journal is not None:
+        atexit.register(journal.close)
+        recover_from_journal(sftp_client, stage, journal)
+    # 内容寻址去重：远端已有相同内容的文件在远端生成，不再重复上传
+    dedup = DedupIndex(CONFIG.upload_dedup_index) if CONFIG.upload_dedup else None
+    if dedup is not None:
+        atexit.register(dedup.close)
+        if dedup_link_mode() != CONFIG.upload_dedup_link:
+            logger.warning("已启用增量上传，硬链接的文件会被增量上传一同改动，去重时改为在远端复制")
+    # 按配置记录各阶段耗时及进行性能分析，未启用时几乎没有开销
+    TRACER.configure(**CONFIG.profile)
+    CONFIG.on_reload(lambda changed: TRACER.configure(**CONFIG.profile))
+    # 文件过滤规则编译一次，配置变化时重新编译
+    file_filter = FileFilter(CONFIG.upload_file_layout, **CONFIG.upload_filter)
+    CONFIG.on_reload(lambda changed: file_filter.set_rules(CONFIG.upload_file_layout, **CONFIG.upload_filter))
+    # 监听配置文件变化，修改后的配置无需重启进程即可生效
+    CONFIG.start_watching()
     while True:
         try:
-            # 查询本地已有的压缩包
-            all_files = sftp_client.get_local_all_file(UPLOAD_LOCAL_PATH)
             # 检查远程目录是否存在
-            path_res = sftp_client.check_remote_path_exists(UPLOAD_REMOTE_PATH)
-            if len(all_files) != 0 and path_res:
-                traversal_file(sftp_client, UPLOAD_LOCAL_PATH, UPLOAD_REMOTE_PATH, all_files)
-                logger.warning(f"本次上传完成, {UPLOAD_TIME_INTERVAL / 2}秒后再次扫描上传......")
+            path_res = sftp_client.check_remote_path_exists(CONFIG.upload_remote_path)
+            # 本地目录边扫描边与远程目录列表归并，每得到一个文件的操作就立即执行
+            if path_res:
+                with span("sync"):
+                    stats = sync_files(sftp_client, stage, journal, file_filter, dedup)
+            if path_res and len(stats):
+                logger.info(stats.summary())
+                # 等待后台校验删除完成，避免下一轮扫描重复处理尚未删除的文件
+                with span("post_transfer"):
+                    stage.join()
+                if journal is not None:
+                    journal.purge()
+                if dedup is not None:
+                    dedup.prune_local()
+                logger.warning(f"本次上传完成, {CONFIG.upload_time_interval / 2}秒后再次扫描上传......")
             elif not path_res:
                 try:
                     # 创建远程文件夹
-                    mkdir_res = sftp_client.make_remote_dir(UPLOAD_REMOTE_PATH)
+                    mkdir_res = sftp_client.make_remote_dir(CONFIG.upload_remote_path)
                     if mkdir_res:
-                        logger.info(f'[ {UPLOAD_REMOTE_PATH} ] 远程文件夹创建成功！')
+                        logger.info(f'[ {CONFIG.upload_remote_path} ] 远程文件夹创建成功！')
                     else:
-                        logger.info(f'[ {UPLOAD_REMOTE_PATH} ] 远程文件夹已存在')
+                        logger.info(f'[ {CONFIG.upload_remote_path} ] 远程文件夹已存在')
                     continue
                 except FileNotFoundError:
                     logger.error(
-                        f"远程目标路径[ {UPLOAD_REMOTE_PATH} ]的父级文件夹不存在，请创建父级目录或重新确认目标路径是否有误")
+                        f"远程目标路径[ {CONFIG.upload_remote_path} ]的父级文件夹不存在，请创建父级目录或重新确认目标路径是否有误")
                     break
             else:
-                logger.warning(f"本地无文件, {UPLOAD_TIME_INTERVAL / 2}秒后再次扫描上传......")
+                logger.warning(f"本地无文件, {CONFIG.upload_time_interval / 2}秒后再次扫描上传......")
             logger.info("===================================================================")
-            time.sleep(UPLOAD_TIME_INTERVAL / 2)
+            with span("sleep"):
+                CONFIG.sleep(CONFIG.upload_time_interval / 2)
+            # 导出本轮的阶段耗时，按配置启停性能分析
+            TRACER.end_cycle()
         except Exception as e:
             logger.error(f"{repr(e)}")
             logger.info(f"将在5秒后重连服务器...")
@@ -142,8 +354,7 @@ def main():
 
 
 if __name__ == '__main__':
-    # 创建日志目录
-    create_log_folder()
-    logging.config.dictConfig(LOGGING_CONFIG)  # logging config使能输出
+    # 创建日志目录并使能日志输出
+    setup_logging(bool(LOG_JSON_FORMAT))
     # 运行主程序
     main()
@@ -5,13 +5,114 @@
 @Date  : 2022/7/13/0013 11:08:55
 @Desc  :
 """
+import atexit
+import json
 import logging
+import logging.config
 import os
+import queue
 import sys
+import threading
+import time
+from logging.handlers import QueueHandler, QueueListener
+
+
+class JsonFormatter(logging.Formatter):
+    """结构化JSON日志格式化器，传输日志通过extra附带的单次传输字段会一并输出"""
+    TRANSFER_FIELDS = ("path", "bytes", "duration", "throughput")
+
+    def format(self, record):
+        data = {
+            "time": self.formatTime(record, self.datefmt),
+            "level": record.levelname,
+            "logger": record.name,
+            "file": record.filename,
+            "line": record.lineno,
+            "message": record.getMessage(),
+        }
+        for field in self.TRANSFER_FIELDS:
+            if hasattr(record, field):
+                data[field] = getattr(record, field)
+        if record.exc_info:
+            data["exc_info"] = self.formatException(record.exc_info)
+        return json.dumps(data, ensure_ascii=False)
+
+
+class RateLimitFilter(logging.Filter):
+    """
+    重复日志限流过滤器，同一条日志在interval秒内只输出一次，
+    之后再次输出时附带期间被省略的次数（例如reconnect()循环中反复出现的连接错误）
+
+    :param interval:限流时间窗口，单位（s）
+    :param max_keys:最多记录的不同日志条数，超出后清理过期记录
+    """
+
+    def __init__(self, interval: float = 60, max_keys: int = 1000):
+        super().__init__()
+        self.interval = interval
+        self.max_keys = max_keys
+        self._records = {}  # (logger, level, message) -> [窗口开始时间, 被省略次数]
+        self._lock = threading.Lock()
+
+    def filter(self, record):
+        message = record.getMessage()
+        key = (record.name, record.levelno, message)
+        now = time.monotonic()
+        with self._lock:
+            state = self._records.get(key)
+            if state is not None and now - state[0] < self.interval:
+                state[1] += 1
+                return False
+            suppressed = state[1] if state is not None else 0
+            self._records[key] = [now, 0]
+            if len(self._records) > self.max_keys:
+                self._records = {k: v for k, v in self._records.items() if now - v[0] < self.interval}
+        if suppressed:
+            record.msg = f"{message} (前{self.interval}秒内重复{suppressed}次已省略)"
+            record.args = None
+        return True
+
+
+class _RouteHandler(logging.Handler):
+    """QueueListener后台线程中按日志对象名称将日志分发给原有的handler"""
+
+    def __init__(self, routes: dict):
+        super().__init__()
+        self.routes = routes
+
+    def handle(self, record):
+        for handler in self.routes.get(record.name, ()):
+            if record.levelno >= handler.level:
+                handler.handle(record)
+        return True
+
+
+def transfer_extra(path: str, size: int, duration: float) -> dict:
+    """
+    生成单次传输日志的结构化字段，通过logger的extra参数传入
+
+    :param path:传输的文件路径
+    :param size:传输的字节数
+    :param duration:传输用时，单位（s）
+    :return:extra字典
+    """
+    return {
+        "path": path,
+        "bytes": size,
+        "duration": round(duration, 3),
+        "throughput": round(size / duration, 1) if duration > 0 else None,
+    }
+
 
 LOGGING_CONFIG = dict(
     version=1,
     disable_existing_loggers=False,
+    filters={
+        "rate_limit": {
+            "()": RateLimitFilter,
+            "interval": 60,
+        },
+    },
     loggers={
         "main": {
             "level": "INFO",
@@ -34,6 +135,7 @@ LOGGING_CONFIG = dict(
         "sftp_client": {
             "level": "INFO",
             "handlers": ["console", "sftp_client"],
+            "filters": ["rate_limit"],
             "propagate": True,
             "qualname": "sftp_client.debug",
         },
@@ -142,3 +244,40 @@ def create_log_folder():
                 if not os.path.exists(dirname):
                     os.makedirs(dirname)
                     print(f"新生成日志目录：{dirname}")
+
+
+_listener = None
+
+
+def setup_logging(json_format: bool = False):
+    """
+    创建日志目录并使能日志配置
+    所有handler移到QueueListener后台线程中执行，业务线程写日志只需入队，不再阻塞在磁盘写入和日志轮转上
+
+    :param json_format:日志文件是否使用结构化JSON格式输出（控制台输出不变）
+    """
+    global _listener
+    create_log_folder()
+    logging.config.dictConfig(LOGGING_CONFIG)
+    stop_logging()
+    log_queue = queue.SimpleQueue()
+    routes = {}
+    for name in LOGGING_CONFIG['loggers']:
+        log = logging.getLogger(name)
+        routes[name] = log.handlers[:]
+        for handler in routes[name]:
+            if json_format and isinstance(handler, logging.FileHandler):
+                handler.setFormatter(JsonFormatter(datefmt=LOGGING_CONFIG['formatters']['generic']['datefmt']))
+            log.removeHandler(handler)
+        log.addHandler(QueueHandler(log_queue))
+    _listener = QueueListener(log_queue, _RouteHandler(routes))
+    _listener.start()
+
+
+@atexit.register
+def stop_logging():
+    """停止日志后台线程，并输出队列中剩余的日志"""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
@@ -4,18 +4,16 @@
 @Date  : 2023-11-16 10:33
 @Desc  : 主进程
 """
-import logging.config
 import time
 
-from core.Enum import RUN_MODE
-from logging_config import create_log_folder, LOGGING_CONFIG, main as logger
+from core.Enum import RUN_MODE, LOG_JSON_FORMAT
+from logging_config import setup_logging, main as logger
 from local_upload_to_sftp import main as main_local_upload_to_sftp
 from sftp_download_to_local import main as main_sftp_download_to_local
 
 if __name__ == '__main__':
-    # 创建日志目录
-    create_log_folder()
-    logging.config.dictConfig(LOGGING_CONFIG)  # logging config使能输出
+    # 创建日志目录并使能日志输出
+    setup_logging(bool(LOG_JSON_FORMAT))
 
     # 验证运行模式
     if RUN_MODE == 1:
@@ -24,6 +22,11 @@ if __name__ == '__main__':
     elif RUN_MODE == 2:
         logger.info("运行模式：下载")
         main_sftp_download_to_local()
+    elif RUN_MODE == 3:
+        logger.info("运行模式：常驻传输服务")
+        # 常驻传输服务依赖Unix域套接字，仅在该模式下导入
+        from sftp_job_daemon import main as main_sftp_job_daemon
+        main_sftp_job_daemon()
     else:
         logger.info("没有启用任何进程，请在配置文件中设置运行模式")
         time.sleep(3)
@@ -5,34 +5,62 @@
 @Date  : 2023-11-13 10:13
 @Desc  : 下载SFTP服务器远程目录及子目录下的所有规定格式文件，并将所有文件按照远程目录下的分类进行子目录划分
 """
+import atexit
 import os
 import time
-import logging.config
+from typing import Callable
 
+import paramiko
+
+from core import journal as jn, planner
 from core.Enum import *
+from core.adaptive import AdaptiveController
+from core.filters import FileFilter
 from core.sftp_client import SFTPClient
-from logging_config import sftp_download_to_local as logger, create_log_folder, LOGGING_CONFIG
+from core.pipeline import PostTransferStage, TransferPool
+from core.planner import SyncPlan, plan_sync
+from core.profiling import TRACER, span
+from core.process_pool import ProcessTransferPool
+from core.walker import FileEntry, scan_local_tree
+from logging_config import sftp_download_to_local as logger, setup_logging
 
 
-def download_file(sftp_c: SFTPClient, local_f: str, remote_f: str) -> bool:
+def download_file(sftp_c: SFTPClient, stage: PostTransferStage, local_f: str, remote_f: str,
+                  sftp: paramiko.SFTPClient = None, controller: AdaptiveController = None,
+                  journal: jn.TransferJournal = None, resume: bool = False) -> bool:
     """
-    下载、检查、删除文件
+    下载文件，并将检查、删除提交到传输后处理流水线
 
     :param sftp_c:sftp客户端类
+    :param stage:传输后处理流水线阶段，负责比较本地文件和远端文件并删除远程文件
     :param local_f:本地文件绝对路径
     :param remote_f:远端文件绝对路径
+    :param sftp:传输线程池工作线程的SFTP通道
+    :param controller:自适应控制器
+    :param journal:传输日志，传入时记录传输状态（文件大小和修改时间沿用排队时的记录）
+    :param resume:是否从本地文件已有的大小处续传
     :return: 成功：True、失败：False
     """
     try:
+        if journal is not None:
+            journal.record(jn.DOWNLOAD, remote_f, local_f, jn.IN_PROGRESS)
         # 下载文件
-        download_r = sftp_c.download_file(remote_f, local_f)
-        # 比较本地文件和远端文件
-        compare_r = sftp_c.compare_files(local_f, remote_f)
-        if download_r and compare_r == "=":
+        if resume:
+            download_r = sftp_c.resume_download_file(remote_f, local_f)
+        elif CONFIG.download_write_buffers > 0:
+            # 网络读取和磁盘写入由不同线程完成
+            download_r = sftp_c.download_file_buffered(
+                remote_f, local_f, sftp=sftp, controller=controller, buffers=CONFIG.download_write_buffers,
+                buffer_size=CONFIG.download_write_buffer_size, preallocate=bool(CONFIG.download_preallocate),
+                fsync_every=CONFIG.download_fsync)
+        else:
+            download_r = sftp_c.download_file(remote_f, local_f, sftp=sftp, controller=controller)
+        if download_r:
             logger.info(f"[ {remote_f} ] 下载成功!")
-            # 若成功下载并且本地文件和远程文件一样则删除远程文件
-            sftp_c.delete_remote_file(remote_f)
-            logger.info(f"删除远程文件 [ {remote_f} ]")
+            if journal is not None:
+                journal.record(jn.DOWNLOAD, remote_f, local_f, jn.TRANSFERRED, offset=os.path.getsize(local_f))
+            # 后台比较本地文件和远端文件，一样则删除远程文件，不阻塞下一个文件的下载
+            stage.submit(local_f, remote_f, delete="remote")
             return True
         else:
             logger.error(f"[ {remote_f} ] 下载失败")
@@ -42,60 +70,101 @@ def download_file(sftp_c: SFTPClient, local_f: str, remote_f: str) -> bool:
         return False
 
 
-def traversal_file(sftp_c: SFTPClient, local_p: str, remote_p: str, remote_path_files: dict) -> bool:
+def recover_from_journal(sftp_c: SFTPClient, stage: PostTransferStage, journal: jn.TransferJournal):
+    """
+    按传输日志继续上次进程退出时未完成的下载：传输中的文件续传，排队中的文件重新下载，已传输、已校验的文件直接提交校验删除
+
+    :param sftp_c:sftp客户端类
+    :param stage:传输后处理流水线阶段
+    :param journal:传输日志
+    """
+    try:
+        for row in journal.pending(jn.DOWNLOAD):
+            try:
+                attr = sftp_c.sftp.stat(row.source)
+            except FileNotFoundError:
+                # 远程文件已被删除（删除后的状态尚未落盘进程就退出了）
+                journal.forget(jn.DOWNLOAD, row.source)
+                continue
+            if not row.matches(attr.st_size, attr.st_mtime):
+                # 文件已被替换，按新文件处理
+                journal.forget(jn.DOWNLOAD, row.source)
+                continue
+            logger.info(f"按传输日志恢复 [ {row.source} ]({row.state})")
+            if row.state in (jn.TRANSFERRED, jn.VERIFIED):
+                stage.submit(row.target, row.source, delete="remote", verify=row.state == jn.TRANSFERRED)
+            else:
+                os.makedirs(os.path.dirname(row.target), exist_ok=True)
+                download_file(sftp_c, stage, row.target, row.source, journal=journal,
+                              resume=row.state == jn.IN_PROGRESS)
+    except Exception as e:
+        # 连接断开等错误不能结束进程，未恢复的记录保留在传输日志中，由之后的扫描按记录的状态继续处理
+        logger.error(f"{repr(e)}")
+        sftp_c.reconnect()
+    stage.join()
+
+
+def build_plan(sftp_c: SFTPClient, journal: jn.TransferJournal = None,
+               file_filter: FileFilter = None) -> SyncPlan:
+    """
+    生成本轮下载计划：获取远程目录列表，与本地目录列表线性归并，不再逐个文件检查本地
+
+    :param sftp_c:sftp客户端类
+    :param journal:传输日志，传入时按已记录的状态续传或直接校验删除
+    :param file_filter:文件过滤器，在遍历远程目录时使用
+    :return:下载计划
     """
-    递归遍历下载文件及文件夹内的文件
+    remote_tree = sftp_c.get_remote_tree(CONFIG.download_remote_path, file_filter)
+    # 归并要求两端列表均按文件名排序，本地目录使用单线程遍历
+    local_files = scan_local_tree(CONFIG.download_local_path)
+    return plan_sync(jn.DOWNLOAD, remote_tree.iter_files(), CONFIG.download_remote_path, "/",
+                     local_files, CONFIG.download_local_path, os.sep, CONFIG.download_file_layout, journal)
+
+
+def execute_plan(sftp_c: SFTPClient, stage: PostTransferStage, transfer: Callable[[FileEntry, str], None],
+                 plan: SyncPlan, journal: jn.TransferJournal = None) -> bool:
+    """
+    执行下载计划：无需传输的文件先批量提交校验删除，需要下载的文件提交给传输函数并行下载
 
     :param sftp_c:sftp客户端类
-    :param local_p:本地存储目录的绝对路径
-    :param remote_p:远程文件目录的绝对路径
-    :param remote_path_files:通过get_remote_all_file方法获取的路径下所有文件夹及文件字典
+    :param stage:传输后处理流水线阶段
+    :param transfer:传输函数，参数为远程文件条目和本地文件绝对路径，提交到传输线程池或多进程传输引擎
+    :param plan:通过build_plan生成的下载计划
+    :param journal:传输日志，传入时记录传输状态
     :return: 成功：True、失败：False
     """
     try:
-        for filename, info in remote_path_files.items():
-            # 若当前为目录且目录下有文件，则递归下载该文件夹内的文件
-            if info["type"] == "dir" and info["files"]:
-                # 组合路径
-                local_p_dir = os.path.join(local_p, filename)
-                remote_p_dir = os.path.join(remote_p, filename)
-                # 根据传入的远程路径判断是否需要修改路径以契合远程服务器使用的系统
-                remote_p_dir = sftp_c.format_remote_path(remote_p_dir)
-                # 若没有则创建本地文件夹
+        for item in plan.by_action(planner.SKIP):
+            logger.error(f"[ {item.source.path.rsplit('/', 1)[-1]} ]文件格式有误，格式应为[ {CONFIG.download_file_layout} ]")
+        for item in plan.by_action(planner.FINISH, planner.DELETE):
+            if item.action == planner.DELETE:
+                logger.info(f"[ {plan.target_root} ] 中已存在 [ {os.path.basename(item.target)} ] 文件")
+            stage.submit(item.target, item.source.path, delete="remote", verify=item.verify)
+        checked_dirs = set()
+        current_dir = None
+        for item in plan.by_action(planner.TRANSFER, planner.RETRANSFER, planner.RESUME):
+            remote_file = item.source.path
+            local_file = item.target
+            # 本地按照远程目录下的分类进行子目录划分，若没有则创建本地文件夹
+            local_p_dir = os.path.dirname(local_file)
+            if local_p_dir not in checked_dirs:
                 if not os.path.exists(local_p_dir):
                     os.makedirs(local_p_dir)
                     logger.info(f"新生成存储目录：{local_p_dir}")
-                # 遍历子目录
+                checked_dirs.add(local_p_dir)
+            remote_p_dir = remote_file.rsplit("/", 1)[0]
+            if remote_p_dir != current_dir:
+                current_dir = remote_p_dir
                 logger.info(f"开始下载 [ {remote_p_dir} ]目录下的文件")
-                traversal_file(sftp_c, local_p_dir, remote_p_dir, info["files"])
-            # 若为空文件夹则跳过
-            elif info["type"] == "dir" and not info["files"]:
+            if item.action == planner.RESUME:
+                # 传输日志中记录下载中断，从本地已有的大小处续传
+                logger.info(f"开始续传 [ {remote_file} ]")
+                download_file(sftp_c, stage, local_file, remote_file, journal=journal, resume=True)
                 continue
-            # 不是文件夹则开始检查文件并下载
-            else:
-                # 检查文件格式
-                if not filename.endswith(DOWNLOAD_FILE_LAYOUT):
-                    logger.error(f"[ {filename} ]文件格式有误，格式应为[ {DOWNLOAD_FILE_LAYOUT} ]")
-                    continue
-                local_file = os.path.join(local_p, filename)
-                remote_file = os.path.join(remote_p, filename)
-                # 根据传入的远程路径判断是否需要修改路径以契合远程服务器使用的系统
-                remote_file = sftp_c.format_remote_path(remote_file)
-                # 检查本地是否存在该文件
-                if sftp_c.check_local_file_exists(local_file):
-                    # 若本地存在该文件，则比较两个文件的大小
-                    compare_res = sftp_c.compare_files(local_file, remote_file)
-                    # 若本地文件小于远端文件，则删除本地文件进行重下，否则就删除远端文件
-                    if compare_res == "<":
-                        logger.info(f"开始重下 [ {remote_file} ]")
-                        download_file(sftp_c, local_file, remote_file)
-                    else:
-                        logger.info(f"[ {DOWNLOAD_LOCAL_PATH} ] 中已存在 [ {filename} ] 文件")
-                        sftp_c.delete_remote_file(remote_file)
-                        logger.info(f"删除远程文件 [ {remote_file} ]")
-                        continue
-                else:
-                    download_file(sftp_c, local_file, remote_file)
+            if item.action == planner.RETRANSFER:
+                # 本地文件小于远端文件，重新下载
+                logger.info(f"开始重下 [ {remote_file} ]")
+            transfer(item.source, local_file)
         return True
     except Exception as error:
         logger.error(error)
@@ -105,27 +174,97 @@ def traversal_file(sftp_c: SFTPClient, local_p: str, remote_p: str, remote_path_
 def main():
     sftp_client = SFTPClient(HOSTNAME, USERNAME, PASSWORD)
     sftp_client.connect()
+    # 传输日志：记录每个文件的传输状态，进程重启后从中断处继续
+    journal = jn.TransferJournal(CONFIG.journal_path) if CONFIG.journal_path else None
+    stage = PostTransferStage(sftp_client, logger, journal=journal)
+    stage.start()
+    if journal is not None:
+        atexit.register(journal.close)
+        recover_from_journal(sftp_client, stage, journal)
+    # 按配置记录各阶段耗时及进行性能分析，未启用时几乎没有开销
+    TRACER.configure(**CONFIG.profile)
+    CONFIG.on_reload(lambda changed: TRACER.configure(**CONFIG.profile))
+    # 文件过滤规则编译一次，配置变化时重新编译
+    file_filter = FileFilter(CONFIG.download_file_layout, **CONFIG.download_filter)
+    CONFIG.on_reload(lambda changed: file_filter.set_rules(CONFIG.download_file_layout, **CONFIG.download_filter))
+
+    def enqueue(entry: FileEntry, local_file: str):
+        """在传输日志中记录排队的文件"""
+        if journal is not None:
+            journal.record(jn.DOWNLOAD, entry.path, local_file, jn.QUEUED, entry.size, entry.mtime)
+
+    if CONFIG.download_processes > 1:
+        # 多进程传输：各工作进程持有独立的SSH连接，大文件按字节范围分段并行下载
+        engine = ProcessTransferPool(HOSTNAME, USERNAME, PASSWORD, processes=CONFIG.download_processes, logger=logger)
+        engine.start()
+        atexit.register(engine.stop)
+
+        def transfer(entry: FileEntry, local_file: str):
+            def done(ok: bool):
+                if ok:
+                    if journal is not None:
+                        journal.record(jn.DOWNLOAD, entry.path, local_file, jn.TRANSFERRED, offset=entry.size)
+                    stage.submit(local_file, entry.path, delete="remote")
+
+            enqueue(entry, local_file)
+            if journal is not None:
+                # 各段可能同时在传输，中断后按续传处理，不会因本地已有文件而直接删除远程文件
+                journal.record(jn.DOWNLOAD, entry.path, local_file, jn.IN_PROGRESS)
+            engine.download(entry.path, local_file, entry.size, done)
+
+        wait_transfer = engine.join
+    else:
+        # 根据实测吞吐量和往返时延自适应调整并行下载数和预读请求数
+        controller = AdaptiveController(CONFIG.download_min_workers, CONFIG.download_max_workers,
+                                        CONFIG.download_min_requests, CONFIG.download_max_requests, logger)
+        pool = TransferPool(sftp_client, controller, logger)
+        CONFIG.on_reload(lambda changed: controller.set_limits(
+            CONFIG.download_min_workers, CONFIG.download_max_workers,
+            CONFIG.download_min_requests, CONFIG.download_max_requests))
+
+        def transfer(entry: FileEntry, local_file: str):
+            enqueue(entry, local_file)
+            pool.submit(download_file, sftp_client, stage, local_file, entry.path, controller=controller,
+                        journal=journal)
+
+        def wait_transfer():
+            pool.join()
+            logger.info(f"本次下载完成, 自适应控制状态: {controller.snapshot()}")
+    # 监听配置文件变化，修改后的配置无需重启进程即可生效
+    CONFIG.start_watching()
     while True:
         try:
-            # 查询远程已有的压缩包
-            all_files = sftp_client.get_remote_all_file(DOWNLOAD_REMOTE_PATH)
-            file_list = sftp_client.get_remote_file_list(DOWNLOAD_REMOTE_PATH)
-            if file_list:
-                traversal_file(sftp_client, DOWNLOAD_LOCAL_PATH, DOWNLOAD_REMOTE_PATH, all_files)
+            # 查询远程已有的压缩包，与本地目录列表归并，一次生成本轮的下载计划
+            with span("scan"):
+                plan = build_plan(sftp_client, journal, file_filter)
+            if len(plan):
+                logger.info(plan.summary())
+                with span("execute", files=len(plan)):
+                    execute_plan(sftp_client, stage, transfer, plan, journal)
+                # 等待下载及后台校验删除完成，避免下一轮扫描重复处理尚未删除的文件
+                with span("wait_transfer"):
+                    wait_transfer()
+                with span("post_transfer"):
+                    stage.join()
+                if journal is not None:
+                    journal.purge()
                 logger.info("======================================================================================")
-                time.sleep(DOWNLOAD_TIME_INTERVAL)
+                with span("sleep"):
+                    CONFIG.sleep(CONFIG.download_time_interval)
             else:
                 logger.warning("远程目录及子目录下无文件，10秒后再次扫描下载......")
                 logger.info("======================================================================================")
-                time.sleep(10)
+                with span("sleep"):
+                    time.sleep(10)
+            # 导出本轮的阶段耗时，按配置启停性能分析
+            TRACER.end_cycle()
         except Exception as e:
             logger.error(f"{e}")
             sftp_client.reconnect()
 
 
 if __name__ == '__main__':
-    # 创建日志目录
-    create_log_folder()
-    logging.config.dictConfig(LOGGING_CONFIG)  # logging config使能输出
+    # 创建日志目录并使能日志输出
+    setup_logging(bool(LOG_JSON_FORMAT))
     # 运行主程序
     main()
@@ -0,0 +1,30 @@
+# -*- coding:utf-8 -*
+"""
+@File  : sftp_job_daemon.py
+@Author: DJW
+@Date  : 2023-11-27 14:02
+@Desc  : 常驻传输服务，持有SFTP连接池，供其它程序通过Unix域套接字提交临时传输任务（仅支持Linux）
+"""
+from core.Enum import *
+from core.job_daemon import JobServer
+from core.sftp_client import SFTPClient
+from logging_config import main as logger, setup_logging
+
+
+def main():
+    sftp_client = SFTPClient(HOSTNAME, USERNAME, PASSWORD)
+    sftp_client.connect()
+    server = JobServer(sftp_client, CONFIG.daemon_socket_path, CONFIG.daemon_channels)
+    logger.info(f"常驻传输服务已启动, 套接字: [ {CONFIG.daemon_socket_path} ]")
+    try:
+        server.serve_forever()
+    finally:
+        server.server_close()
+        sftp_client.disconnect()
+
+
+if __name__ == '__main__':
+    # 创建日志目录并使能日志输出
+    setup_logging(bool(LOG_JSON_FORMAT))
+    # 运行主程序
+    main()
@@ -0,0 +1,57 @@
+# -*- coding:utf-8 -*
+"""
+@File  : sftp_sync_plan.py
+@Author: DJW
+@Date  : 2023-11-30 11:05
+@Desc  : 预览同步计划（dry-run）：只列出两端目录并生成计划，不传输、不删除任何文件
+"""
+import argparse
+
+from core import journal as jn
+from core.Enum import *
+from core.filters import FileFilter
+from core.sftp_client import SFTPClient
+from local_upload_to_sftp import build_plan as build_upload_plan
+from logging_config import setup_logging
+from sftp_download_to_local import build_plan as build_download_plan
+
+
+def main():
+    parser = argparse.ArgumentParser(description="预览上传/下载的同步计划，不传输、不删除任何文件")
+    parser.add_argument("direction", choices=[jn.UPLOAD, jn.DOWNLOAD], help="传输方向")
+    parser.add_argument("-o", "--output", help="将计划导出为JSON文件")
+    parser.add_argument("-v", "--verbose", action="store_true", help="逐个输出计划中的操作")
+    args = parser.parse_args()
+
+    sftp_client = SFTPClient(HOSTNAME, USERNAME, PASSWORD)
+    sftp_client.connect()
+    # 传输日志只用于查询，按日志中的状态预览续传和直接校验删除的文件
+    journal = jn.TransferJournal(CONFIG.journal_path) if CONFIG.journal_path else None
+    try:
+        if args.direction == jn.UPLOAD:
+            file_filter = FileFilter(CONFIG.upload_file_layout, **CONFIG.upload_filter)
+            plan = build_upload_plan(sftp_client, journal, file_filter)
+        else:
+            file_filter = FileFilter(CONFIG.download_file_layout, **CONFIG.download_filter)
+            plan = build_download_plan(sftp_client, journal, file_filter)
+    finally:
+        if journal is not None:
+            journal.close()
+        sftp_client.disconnect()
+
+    if args.verbose:
+        for item in plan:
+            target_size = "-" if item.target_size is None else f"{item.target_size}B"
+            print(f"{item.action:<10} {item.source.size:>12}B -> {target_size:>12}  "
+                  f"[ {item.source.path} ] -> [ {item.target} ]")
+    print(plan.summary())
+    if args.output:
+        plan.export(args.output)
+        print(f"计划已导出至 [ {args.output} ]")
+
+
+if __name__ == '__main__':
+    # 创建日志目录并使能日志输出
+    setup_logging(bool(LOG_JSON_FORMAT))
+    # 运行主程序
+    main()
@@ -0,0 +1,168 @@
+# -*- coding:utf-8 -*
+"""
+@File  : sftp_server.py
+@Author: DJW
+@Date  : 2023-12-06 09:30
+@Desc  : 测试使用的本地SFTP服务器：监听127.0.0.1的随机端口，直接读写本机文件系统的绝对路径
+"""
+import os
+import socket
+import threading
+
+import paramiko
+from paramiko import SFTPAttributes, SFTPHandle, SFTPServer, SFTPServerInterface, ServerInterface
+from paramiko.sftp import SFTP_OK, SFTP_PERMISSION_DENIED
+
+USERNAME = "test"
+PASSWORD = "test"
+
+_HOST_KEY = None
+
+
+def _host_key() -> paramiko.RSAKey:
+    """生成一次主机密钥，所有测试共用"""
+    global _HOST_KEY
+    if _HOST_KEY is None:
+        _HOST_KEY = paramiko.RSAKey.generate(1024)
+    return _HOST_KEY
+
+
+class _Server(ServerInterface):
+    """只允许测试账户密码登录及打开会话通道"""
+
+    def __init__(self, owner: "LocalSFTPServer"):
+        self.owner = owner
+
+    def get_allowed_auths(self, username):
+        return "password"
+
+    def check_auth_password(self, username, password):
+        if username == USERNAME and password == PASSWORD:
+            return paramiko.AUTH_SUCCESSFUL
+        return paramiko.AUTH_FAILED
+
+    def check_channel_request(self, kind, chanid):
+        if kind == "session":
+            return paramiko.OPEN_SUCCEEDED
+        return paramiko.OPEN_FAILED_ADMINISTRATIVELY_PROHIBITED
+
+
+class _Handle(SFTPHandle):
+    """本地文件句柄"""
+
+    def stat(self):
+        try:
+            return SFTPAttributes.from_stat(os.fstat(self.readfile.fileno()))
+        except OSError as e:
+            return SFTPServer.convert_errno(e.errno)
+
+
+class _LocalSFTP(SFTPServerInterface):
+    """将SFTP请求映射到本机文件系统，路径即本机绝对路径"""
+
+    def __init__(self, server, *args, **kwargs):
+        super().__init__(server, *args, **kwargs)
+        self.server = server
+
+    def list_folder(self, path):
+        if path in self.server.owner.denied:
+            return SFTP_PERMISSION_DENIED
+        try:
+            return [SFTPAttributes.from_stat(os.lstat(os.path.join(path, name)), name) for name in os.listdir(path)]
+        except OSError as e:
+            return SFTPServer.convert_errno(e.errno)
+
+    def stat(self, path):
+        try:
+            return SFTPAttributes.from_stat(os.stat(path))
+        except OSError as e:
+            return SFTPServer.convert_errno(e.errno)
+
+    lstat = stat
+
+    def open(self, path, flags, attr):
+        try:
+            fd = os.open(path, flags, 0o644)
+            if flags & os.O_RDWR:
+                mode = "r+b"
+            elif flags & os.O_WRONLY:
+                mode = "ab" if flags & os.O_APPEND else "wb"
+            else:
+                mode = "rb"
+            f = os.fdopen(fd, mode)
+        except OSError as e:
+            return SFTPServer.convert_errno(e.errno)
+        handle = _Handle(flags)
+        handle.filename = path
+        handle.readfile = f
+        handle.writefile = f
+        return handle
+
+    def remove(self, path):
+        try:
+            os.remove(path)
+        except OSError as e:
+            return SFTPServer.convert_errno(e.errno)
+        self.server.owner.removed.append(path)
+        return SFTP_OK
+
+    def rename(self, oldpath, newpath):
+        try:
+            os.rename(oldpath, newpath)
+        except OSError as e:
+            return SFTPServer.convert_errno(e.errno)
+        return SFTP_OK
+
+    def mkdir(self, path, attr):
+        try:
+            os.mkdir(path)
+        except OSError as e:
+            return SFTPServer.convert_errno(e.errno)
+        return SFTP_OK
+
+
+class LocalSFTPServer:
+    """
+    本地SFTP服务器，可作为上下文管理器使用
+
+    :param port:监听端口，为0时由系统分配
+    """
+
+    def __init__(self, port: int = 0):
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.sock.bind(("127.0.0.1", port))
+        self.sock.listen(8)
+        self.port = self.sock.getsockname()[1]
+        # 经服务器删除的文件，供测试检查删除请求
+        self.removed = []
+        # 列出时返回没有权限的目录（测试以root运行时无法通过文件权限模拟）
+        self.denied = set()
+        self.transports = []
+        self.thread = threading.Thread(target=self.__accept, name="test_sftp_server", daemon=True)
+
+    def __enter__(self) -> "LocalSFTPServer":
+        self.thread.start()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def close(self):
+        """停止监听并关闭所有连接"""
+        self.sock.close()
+        for transport in self.transports:
+            transport.close()
+
+    def __accept(self):
+        """接受连接，每个连接由独立的服务端Transport处理"""
+        while True:
+            try:
+                conn, _ = self.sock.accept()
+            except OSError:
+                return
+            transport = paramiko.Transport(conn)
+            transport.add_server_key(_host_key())
+            transport.set_subsystem_handler("sftp", SFTPServer, _LocalSFTP)
+            transport.start_server(server=_Server(self))
+            self.transports.append(transport)
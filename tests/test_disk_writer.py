@@ -0,0 +1,58 @@
+# -*- coding:utf-8 -*
+"""
+@File  : test_disk_writer.py
+@Author: DJW
+@Date  : 2023-12-06 16:00
+@Desc  : 独立写盘线程的单元测试：预分配写入临时文件后重命名，出错时不留下临时文件
+"""
+import errno
+import os
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+
+from core.disk_writer import DiskWriter, PART_SUFFIX
+
+
+class DiskWriterTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmp)
+        self.local_file = os.path.join(self.tmp, "a.tar.gz")
+
+    def test_preallocate_and_rename(self):
+        with DiskWriter(self.local_file, 100, preallocate=True) as writer:
+            writer.write(b"x" * 10)
+            writer.write(b"y" * 5)
+        with open(self.local_file, "rb") as f:
+            self.assertEqual(f.read(), b"x" * 10 + b"y" * 5)
+        self.assertFalse(os.path.exists(self.local_file + PART_SUFFIX))
+
+    def test_preallocate_failure_removes_part(self):
+        with mock.patch.object(os, "posix_fallocate", side_effect=OSError(errno.ENOSPC, "No space left on device"),
+                               create=True):
+            with self.assertRaises(OSError):
+                DiskWriter(self.local_file, 100, preallocate=True)
+        self.assertEqual(os.listdir(self.tmp), [])
+
+    def test_late_write_error_removes_part(self):
+        """写盘线程在最后一次write之后出错，close抛出异常并删除临时文件"""
+        with self.assertRaises(OSError):
+            with DiskWriter(self.local_file, 100, preallocate=True) as writer:
+                writer.write(b"x" * 10)
+                writer.thread.join(0.1)
+                writer.error = OSError(errno.ENOSPC, "No space left on device")
+        self.assertEqual(os.listdir(self.tmp), [])
+
+    def test_abort_removes_part(self):
+        with self.assertRaises(RuntimeError):
+            with DiskWriter(self.local_file, 100, preallocate=True) as writer:
+                writer.write(b"x" * 10)
+                raise RuntimeError
+        self.assertEqual(os.listdir(self.tmp), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,97 @@
+# -*- coding:utf-8 -*
+"""
+@File  : test_job_daemon.py
+@Author: DJW
+@Date  : 2023-12-07 09:30
+@Desc  : 常驻传输服务的单元测试：套接字权限、任务执行及客户端中途断开
+"""
+import os
+import shutil
+import socket
+import socketserver
+import stat
+import tempfile
+import threading
+import unittest
+from unittest import mock
+
+from core.job_daemon import JobClient, JobServer
+from core.sftp_client import SFTPClient
+from tests.sftp_server import LocalSFTPServer, PASSWORD, USERNAME
+
+
+class JobServerTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmp)
+        self.server = LocalSFTPServer().__enter__()
+        self.addCleanup(self.server.close)
+        self.sftp_c = SFTPClient("127.0.0.1", USERNAME, PASSWORD, self.server.port)
+        self.sftp_c.connect()
+        self.addCleanup(self.sftp_c.disconnect)
+        self.socket_path = os.path.join(self.tmp, "daemon.sock")
+        # 每个连接处理结束（包括异常处理）后通知测试
+        self.finished = threading.Event()
+        shutdown_request = JobServer.shutdown_request
+
+        def notify(server, request):
+            shutdown_request(server, request)
+            self.finished.set()
+
+        patcher = mock.patch.object(JobServer, "shutdown_request", notify)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.handle_error = mock.patch.object(JobServer, "handle_error").start()
+        self.addCleanup(mock.patch.stopall)
+        old_umask = os.umask(0o022)
+        self.addCleanup(os.umask, old_umask)
+        self.job_server = JobServer(self.sftp_c, self.socket_path)
+        self.addCleanup(self.job_server.server_close)
+        threading.Thread(target=self.job_server.serve_forever, args=(0.05,), daemon=True).start()
+        self.addCleanup(self.job_server.shutdown)
+
+    def write(self, name: str, size: int) -> str:
+        path = os.path.join(self.tmp, name)
+        with open(path, "wb") as f:
+            f.write(os.urandom(size))
+        return path
+
+    def test_socket_is_private_from_creation(self):
+        """套接字文件在绑定完成时即只允许当前用户访问，不依赖绑定后的chmod"""
+        modes = []
+        server_bind = socketserver.UnixStreamServer.server_bind
+
+        def record(server):
+            server_bind(server)
+            modes.append(stat.S_IMODE(os.stat(server.server_address).st_mode))
+
+        with mock.patch.object(socketserver.UnixStreamServer, "server_bind", record):
+            JobServer(self.sftp_c, os.path.join(self.tmp, "other.sock")).server_close()
+        self.assertEqual(len(modes), 1)
+        self.assertEqual(modes[0] & 0o077, 0)
+        # 绑定后恢复进程原来的umask
+        self.assertEqual(os.umask(0o022), 0o022)
+
+    def test_upload(self):
+        local = self.write("a.tar.gz", 1024)
+        progress = []
+        client = JobClient(self.socket_path, timeout=10)
+        self.assertTrue(client.upload(local, local + ".remote", lambda done, total: progress.append(done)))
+        self.assertEqual(os.path.getsize(local + ".remote"), 1024)
+        self.assertEqual(progress[-1], 1024)
+
+    def test_client_disconnects_mid_transfer(self):
+        """客户端断开后回复失败不再抛出异常，任务继续执行完成"""
+        local = self.write("b.tar.gz", 8 * 1024 * 1024)
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+            sock.connect(self.socket_path)
+            sock.sendall(b'{"op": "upload", "local": "%s", "remote": "%s.remote"}\n' % (
+                local.encode(), local.encode()))
+        self.assertTrue(self.finished.wait(10))
+        self.handle_error.assert_not_called()
+        self.assertEqual(os.path.getsize(local + ".remote"), 8 * 1024 * 1024)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,84 @@
+# -*- coding:utf-8 -*
+"""
+@File  : test_journal.py
+@Author: DJW
+@Date  : 2023-12-06 10:00
+@Desc  : 传输日志的单元测试：状态变化、落盘、恢复查询及旧版本日志的迁移
+"""
+import os
+import shutil
+import sqlite3
+import tempfile
+import unittest
+
+from core import journal as jn
+
+
+class TransferJournalTest(unittest.TestCase):
+
+    def setUp(self):
+        tmp = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmp)
+        self.path = os.path.join(tmp, "journal.db")
+        # 后台线程的写入间隔设得很长，测试中由flush/close显式落盘
+        self.journal = jn.TransferJournal(self.path, flush_interval=3600)
+
+    def tearDown(self):
+        if not self.journal.closed:
+            self.journal.close()
+
+    def reopen(self) -> jn.TransferJournal:
+        self.journal.close()
+        self.journal = jn.TransferJournal(self.path, flush_interval=3600)
+        return self.journal
+
+    def test_state_transitions(self):
+        journal = self.journal
+        journal.record(jn.UPLOAD, "/l/a", "/r/a", jn.IN_PROGRESS, 10, 100, mode=jn.DELTA)
+        self.assertEqual(journal.get(jn.UPLOAD, "/l/a"), jn.JournalEntry(
+            jn.UPLOAD, "/l/a", "/r/a", jn.IN_PROGRESS, 0, 10, 100, jn.DELTA))
+        # 未传入大小和修改时间时沿用已有记录
+        journal.record(jn.UPLOAD, "/l/a", "/r/a", jn.TRANSFERRED, offset=10)
+        row = journal.get(jn.UPLOAD, "/l/a")
+        self.assertEqual((row.state, row.offset, row.size, row.mtime), (jn.TRANSFERRED, 10, 10, 100))
+        self.assertTrue(row.matches(10, 100))
+        self.assertFalse(row.matches(10, 101))
+        journal.record(jn.UPLOAD, "/l/a", "/r/a", jn.VERIFIED)
+        journal.record(jn.UPLOAD, "/l/a", "/r/a", jn.SOURCE_DELETED)
+        self.assertEqual(journal.pending(jn.UPLOAD), [])
+        journal.purge()
+        self.assertIsNone(journal.get(jn.UPLOAD, "/l/a"))
+
+    def test_survives_restart(self):
+        self.journal.record(jn.UPLOAD, "/l/b", "/r/b", jn.TRANSFERRED, 5, 1)
+        self.journal.record(jn.UPLOAD, "/l/a", "/r/a", jn.IN_PROGRESS, 5, 1, mode=jn.DELTA)
+        self.journal.record(jn.DOWNLOAD, "/r/c", "/l/c", jn.QUEUED, 5, 1)
+        journal = self.reopen()
+        self.assertEqual([(row.source, row.state, row.mode) for row in journal.pending(jn.UPLOAD)],
+                         [("/l/a", jn.IN_PROGRESS, jn.DELTA), ("/l/b", jn.TRANSFERRED, jn.FULL)])
+        self.assertEqual([row.source for row in journal.pending(jn.DOWNLOAD)], ["/r/c"])
+
+    def test_forget(self):
+        self.journal.record(jn.UPLOAD, "/l/a", "/r/a", jn.TRANSFERRED, 5, 1)
+        self.journal.flush()
+        self.journal.forget(jn.UPLOAD, "/l/a")
+        self.assertIsNone(self.journal.get(jn.UPLOAD, "/l/a"))
+        self.assertEqual(self.reopen().pending(jn.UPLOAD), [])
+
+    def test_migrate_old_schema(self):
+        self.journal.close()
+        os.remove(self.path)
+        conn = sqlite3.connect(self.path)
+        conn.execute(
+            "CREATE TABLE transfers (direction TEXT NOT NULL, source TEXT NOT NULL, target TEXT NOT NULL, "
+            "state TEXT NOT NULL, offset INTEGER NOT NULL DEFAULT 0, size INTEGER, mtime REAL, "
+            "updated REAL NOT NULL, PRIMARY KEY (direction, source))")
+        conn.execute("INSERT INTO transfers VALUES ('upload', '/l/a', '/r/a', 'in_progress', 0, 5, 1, 0)")
+        conn.commit()
+        conn.close()
+        self.journal = jn.TransferJournal(self.path, flush_interval=3600)
+        self.assertEqual(self.journal.get(jn.UPLOAD, "/l/a").mode, jn.FULL)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,98 @@
+# -*- coding:utf-8 -*
+"""
+@File  : test_pipeline.py
+@Author: DJW
+@Date  : 2023-12-06 10:30
+@Desc  : 传输后处理流水线的单元测试：在本地SFTP服务器上批量校验、删除，并按结果更新传输日志
+"""
+import logging
+import os
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+
+import paramiko
+
+from core import journal as jn, pipeline
+from core.pipeline import PostTransferStage
+from core.sftp_client import SFTPClient
+from tests.sftp_server import LocalSFTPServer, PASSWORD, USERNAME
+
+logger = logging.getLogger("test_pipeline")
+
+
+class PostTransferStageTest(unittest.TestCase):
+    # 是否批量发出请求（paramiko提供所需的内部接口时）
+    pipelined = True
+
+    def setUp(self):
+        patcher = mock.patch.object(pipeline, "PIPELINED", self.pipelined)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        # 记录逐个发出的请求
+        for name in ("stat", "remove"):
+            patcher = mock.patch.object(paramiko.SFTPClient, name, autospec=True,
+                                        side_effect=getattr(paramiko.SFTPClient, name))
+            setattr(self, name, patcher.start())
+            self.addCleanup(patcher.stop)
+        self.tmp = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmp)
+        self.server = LocalSFTPServer().__enter__()
+        self.addCleanup(self.server.close)
+        self.sftp_c = SFTPClient("127.0.0.1", USERNAME, PASSWORD, self.server.port)
+        self.sftp_c.connect()
+        self.addCleanup(self.sftp_c.disconnect)
+        self.journal = jn.TransferJournal(os.path.join(self.tmp, "journal.db"), flush_interval=3600)
+        self.addCleanup(self.journal.close)
+        self.stage = PostTransferStage(self.sftp_c, logger, journal=self.journal)
+        self.stage.start()
+
+    def make(self, name: str, size: int) -> str:
+        path = os.path.join(self.tmp, name)
+        with open(path, "wb") as f:
+            f.write(b"x" * size)
+        return path
+
+    def test_upload_verify_and_delete(self):
+        local_ok, remote_ok = self.make("a", 10), self.make("a.remote", 10)
+        local_bad, remote_bad = self.make("b", 10), self.make("b.remote", 4)
+        local_gone = self.make("c", 10)
+        for local, remote in ((local_ok, remote_ok), (local_bad, remote_bad), (local_gone, local_gone + ".remote")):
+            self.journal.record(jn.UPLOAD, local, remote, jn.TRANSFERRED, 10, 1)
+            self.stage.submit(local, remote, delete="local")
+        self.stage.join()
+        self.assertFalse(os.path.exists(local_ok))
+        self.assertEqual(self.journal.get(jn.UPLOAD, local_ok).state, jn.SOURCE_DELETED)
+        # 校验失败（大小不一致、远程文件不存在）时保留源文件并删除记录，由下一轮扫描重新判断
+        self.assertTrue(os.path.exists(local_bad))
+        self.assertTrue(os.path.exists(local_gone))
+        self.assertIsNone(self.journal.get(jn.UPLOAD, local_bad))
+        self.assertIsNone(self.journal.get(jn.UPLOAD, local_gone))
+
+    def test_download_verify_and_delete_remote(self):
+        remotes = [self.make(f"r{i}", 8) for i in range(5)]
+        for remote in remotes:
+            self.make(os.path.basename(remote) + ".local", 8)
+        # 本地文件已被其它程序取走
+        os.remove(remotes[4] + ".local")
+        for remote in remotes:
+            self.journal.record(jn.DOWNLOAD, remote, remote + ".local", jn.TRANSFERRED, 8, 1)
+            self.stage.submit(remote + ".local", remote, delete="remote")
+        self.stage.join()
+        self.assertEqual(sorted(self.server.removed), remotes[:4])
+        self.assertEqual([self.journal.get(jn.DOWNLOAD, remote).state for remote in remotes[:4]],
+                         [jn.SOURCE_DELETED] * 4)
+        self.assertTrue(os.path.exists(remotes[4]))
+        self.assertIsNone(self.journal.get(jn.DOWNLOAD, remotes[4]))
+        # 批量请求不经过逐个请求的stat、remove接口
+        self.assertEqual((self.stat.call_count, self.remove.call_count), (0, 0) if self.pipelined else (5, 4))
+
+
+class SequentialPostTransferStageTest(PostTransferStageTest):
+    """paramiko不提供内部接口时逐个请求，结果与批量请求一致"""
+    pipelined = False
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,160 @@
+# -*- coding:utf-8 -*
+"""
+@File  : test_planner.py
+@Author: DJW
+@Date  : 2023-12-04 10:10
+@Desc  : 同步计划的单元测试：排序键与遍历顺序一致、归并结果、按传输日志确定操作
+"""
+import os
+import shutil
+import stat
+import tempfile
+import unittest
+
+from core import journal as jn, planner
+from core.file_tree import FileTree
+from core.walker import FileEntry, scan_local_tree
+
+LAYOUT = ".tar.gz"
+
+
+def entry(root: str, sep: str, *parts: str, size: int = 10, mtime: float = 100) -> FileEntry:
+    """构造以sep分隔的文件条目"""
+    return FileEntry(root + sep + sep.join(parts), size, mtime)
+
+
+class SyncKeyTest(unittest.TestCase):
+
+    def test_split_relative_path(self):
+        self.assertEqual(planner.sync_key("/data/up/a/b.tar.gz", "/data/up", "/"), ("a", "b.tar.gz"))
+        self.assertEqual(planner.sync_key("/data/up/b.tar.gz", "/data/up/", "/"), ("b.tar.gz",))
+        self.assertEqual(planner.sync_key("C:\\up\\a\\b.tar.gz", "C:\\up", "\\"), ("a", "b.tar.gz"))
+
+    def test_walk_order_matches_key_order(self):
+        """按文件名排序的深度优先遍历顺序必须与排序键的元组顺序一致，否则线性归并会漏掉目标端文件"""
+        root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, root)
+        names = ["a/x.tar.gz", "a/b/y.tar.gz", "a-b.tar.gz", "a.tar.gz", "a0/z.tar.gz", "B.tar.gz", "b/a.tar.gz"]
+        for name in names:
+            path = os.path.join(root, *name.split("/"))
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            open(path, "wb").close()
+        keys = [planner.sync_key(e.path, root, os.sep) for e in scan_local_tree(root)]
+        self.assertEqual(len(keys), len(names))
+        self.assertEqual(keys, sorted(keys))
+
+        # 与SFTPClient.get_remote_tree相同：每层按文件名排序后递归加入目录树
+        tree = FileTree(root, os.sep)
+
+        def fill(dir_id, dir_path):
+            for name in sorted(os.listdir(dir_path)):
+                path = os.path.join(dir_path, name)
+                st = os.stat(path)
+                sub_id = tree.add(dir_id, name, st.st_size, st.st_mtime, st.st_mode)
+                if stat.S_ISDIR(st.st_mode):
+                    fill(sub_id, path)
+
+        fill(0, root)
+        self.assertEqual([planner.sync_key(e.path, root, os.sep) for e in tree.iter_files()], keys)
+
+
+class PlanSyncTest(unittest.TestCase):
+
+    def plan(self, sources, targets, journal=None, sources_sorted=True) -> planner.SyncPlan:
+        return planner.plan_sync(jn.UPLOAD, sources, "/l", "/", targets, "/r", "/", LAYOUT, journal, sources_sorted)
+
+    def test_actions(self):
+        sources = [entry("/l", "/", "a", "new.tar.gz"),
+                   entry("/l", "/", "a", "part.tar.gz", size=20),
+                   entry("/l", "/", "a", "same.tar.gz"),
+                   entry("/l", "/", "b.txt")]
+        targets = [entry("/r", "/", "a", "old.tar.gz"),
+                   entry("/r", "/", "a", "part.tar.gz", size=5),
+                   entry("/r", "/", "a", "same.tar.gz"),
+                   entry("/r", "/", "z.tar.gz")]
+        plan = self.plan(sources, targets)
+        self.assertEqual([item.action for item in plan],
+                         [planner.TRANSFER, planner.RETRANSFER, planner.DELETE, planner.SKIP])
+        self.assertEqual([item.target for item in plan],
+                         ["/r/a/new.tar.gz", "/r/a/part.tar.gz", "/r/a/same.tar.gz", "/r/b.txt"])
+        self.assertEqual(plan.items[1].target_size, 5)
+        self.assertEqual(len(plan), 4)
+        self.assertEqual(plan.transfer_bytes, 30)
+
+    def test_unsorted_sources(self):
+        sources = [entry("/l", "/", "b.tar.gz"), entry("/l", "/", "a", "c.tar.gz")]
+        targets = [entry("/r", "/", "a", "c.tar.gz"), entry("/r", "/", "b.tar.gz")]
+        plan = self.plan(sources, targets, sources_sorted=False)
+        self.assertEqual([item.action for item in plan], [planner.DELETE, planner.DELETE])
+        self.assertEqual([item.source.path for item in plan], ["/l/a/c.tar.gz", "/l/b.tar.gz"])
+
+    def test_iter_sync_is_lazy(self):
+        consumed = []
+
+        def sources():
+            for name in ("a.tar.gz", "b.tar.gz"):
+                consumed.append(name)
+                yield entry("/l", "/", name)
+
+        items = planner.iter_sync(jn.UPLOAD, sources(), "/l", "/", iter([]), "/r", "/", LAYOUT)
+        self.assertEqual(consumed, [])
+        self.assertEqual(next(items).action, planner.TRANSFER)
+        self.assertEqual(consumed, ["a.tar.gz"])
+
+    def test_stats_without_items(self):
+        stats = planner.SyncPlan(jn.UPLOAD, "/l", "/r", keep_items=False)
+        for item in planner.iter_sync(jn.UPLOAD, [entry("/l", "/", "a.tar.gz")], "/l", "/", [], "/r", "/", LAYOUT):
+            stats.add(item)
+        self.assertEqual(stats.items, [])
+        self.assertEqual(len(stats), 1)
+        self.assertEqual(stats.counts[planner.TRANSFER], 1)
+
+
+class DecideTest(unittest.TestCase):
+
+    def setUp(self):
+        tmp = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmp)
+        self.journal = jn.TransferJournal(os.path.join(tmp, "journal.db"))
+        self.addCleanup(self.journal.close)
+        self.source = entry("/l", "/", "a.tar.gz", size=10, mtime=100)
+
+    def decide(self, target=None) -> planner.PlanItem:
+        return planner._decide(jn.UPLOAD, self.source, "a.tar.gz", target, "/r/a.tar.gz", LAYOUT, self.journal)
+
+    def test_finish(self):
+        target = entry("/r", "/", "a.tar.gz", size=10)
+        self.journal.record(jn.UPLOAD, self.source.path, "/r/a.tar.gz", jn.TRANSFERRED, 10, 100)
+        self.assertEqual(self.decide(target)[::4], (planner.FINISH, True))
+        self.journal.record(jn.UPLOAD, self.source.path, "/r/a.tar.gz", jn.VERIFIED, 10, 100)
+        self.assertEqual(self.decide(target)[::4], (planner.FINISH, False))
+
+    def test_finish_with_missing_or_changed_target(self):
+        """目标端文件被取走或大小变化后不再按记录校验删除，否则每轮都会校验失败"""
+        for state in (jn.TRANSFERRED, jn.VERIFIED):
+            self.journal.record(jn.UPLOAD, self.source.path, "/r/a.tar.gz", state, 10, 100)
+            self.assertEqual(self.decide().action, planner.TRANSFER)
+            self.assertEqual(self.decide(entry("/r", "/", "a.tar.gz", size=4)).action, planner.RETRANSFER)
+
+    def test_resume(self):
+        self.journal.record(jn.UPLOAD, self.source.path, "/r/a.tar.gz", jn.IN_PROGRESS, 10, 100)
+        item = self.decide(entry("/r", "/", "a.tar.gz", size=4))
+        self.assertEqual(item.action, planner.RESUME)
+        self.assertEqual(item.transfer_size, 6)
+
+    def test_interrupted_delta_is_retransferred(self):
+        self.journal.record(jn.UPLOAD, self.source.path, "/r/a.tar.gz", jn.IN_PROGRESS, 10, 100, mode=jn.DELTA)
+        self.assertEqual(self.decide(entry("/r", "/", "a.tar.gz", size=4)).action, planner.RETRANSFER)
+
+    def test_replaced_source_ignores_journal(self):
+        self.journal.record(jn.UPLOAD, self.source.path, "/r/a.tar.gz", jn.TRANSFERRED, 10, 99)
+        self.assertEqual(self.decide().action, planner.TRANSFER)
+        self.assertEqual(self.decide(entry("/r", "/", "a.tar.gz")).action, planner.DELETE)
+
+    def test_skip_other_layout(self):
+        item = planner._decide(jn.UPLOAD, self.source, "a.txt", None, "/r/a.txt", LAYOUT, self.journal)
+        self.assertEqual(item.action, planner.SKIP)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,116 @@
+# -*- coding:utf-8 -*
+"""
+@File  : test_recovery.py
+@Author: DJW
+@Date  : 2023-12-06 11:00
+@Desc  : 按传输日志恢复上传、下载的单元测试
+"""
+import os
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+
+import local_upload_to_sftp as upload
+import sftp_download_to_local as download
+from core import journal as jn
+
+
+class _Stage:
+    """记录提交的校验删除任务"""
+
+    def __init__(self):
+        self.jobs = []
+
+    def submit(self, local_file, remote_file, delete, verify=True):
+        self.jobs.append((local_file, remote_file, delete, verify))
+
+    def join(self):
+        pass
+
+
+class RecoverUploadTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmp)
+        self.journal = jn.TransferJournal(os.path.join(self.tmp, "journal.db"), flush_interval=3600)
+        self.addCleanup(self.journal.close)
+        self.stage = _Stage()
+        self.sftp_c = mock.Mock()
+
+    def record(self, name: str, state: str, mode: str = jn.FULL, replaced: bool = False) -> str:
+        path = os.path.join(self.tmp, name)
+        with open(path, "wb") as f:
+            f.write(b"x" * 10)
+        st = os.stat(path)
+        self.journal.record(jn.UPLOAD, path, "/r/" + name, state, st.st_size, st.st_mtime + replaced, mode=mode)
+        return path
+
+    def test_recover(self):
+        transferred = self.record("a", jn.TRANSFERRED)
+        verified = self.record("b", jn.VERIFIED)
+        in_progress = self.record("c", jn.IN_PROGRESS)
+        delta = self.record("d", jn.IN_PROGRESS, mode=jn.DELTA)
+        replaced = self.record("e", jn.TRANSFERRED, replaced=True)
+        deleted = self.record("f", jn.TRANSFERRED)
+        os.remove(deleted)
+        with mock.patch.object(upload, "upload_file") as upload_file:
+            upload.recover_from_journal(self.sftp_c, self.stage, self.journal)
+        self.assertEqual(self.stage.jobs, [(transferred, "/r/a", "local", True), (verified, "/r/b", "local", False)])
+        self.assertEqual(upload_file.call_args_list, [
+            mock.call(self.sftp_c, self.stage, in_progress, "/r/c", journal=self.journal, resume=True),
+            mock.call(self.sftp_c, self.stage, delta, "/r/d", delta=bool(upload.CONFIG.upload_delta),
+                      journal=self.journal),
+        ])
+        self.assertIsNone(self.journal.get(jn.UPLOAD, replaced))
+        self.assertIsNone(self.journal.get(jn.UPLOAD, deleted))
+
+    def test_error_keeps_rows(self):
+        path = self.record("a", jn.IN_PROGRESS)
+        with mock.patch.object(upload, "upload_file", side_effect=EOFError):
+            upload.recover_from_journal(self.sftp_c, self.stage, self.journal)
+        self.sftp_c.reconnect.assert_called_once()
+        self.assertEqual(self.journal.get(jn.UPLOAD, path).state, jn.IN_PROGRESS)
+
+
+class RecoverDownloadTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmp)
+        self.journal = jn.TransferJournal(os.path.join(self.tmp, "journal.db"), flush_interval=3600)
+        self.addCleanup(self.journal.close)
+        self.stage = _Stage()
+        self.sftp_c = mock.Mock()
+        self.remote = {}
+        self.sftp_c.sftp.stat.side_effect = self.stat
+
+    def stat(self, path):
+        if path not in self.remote:
+            raise FileNotFoundError(path)
+        return mock.Mock(st_size=self.remote[path][0], st_mtime=self.remote[path][1])
+
+    def test_recover(self):
+        for name, state in (("a", jn.TRANSFERRED), ("b", jn.IN_PROGRESS), ("c", jn.QUEUED), ("d", jn.VERIFIED)):
+            self.remote["/r/" + name] = (10, 1)
+            self.journal.record(jn.DOWNLOAD, "/r/" + name, os.path.join(self.tmp, name), state, 10, 1)
+        self.remote["/r/e"] = (11, 1)
+        self.journal.record(jn.DOWNLOAD, "/r/e", os.path.join(self.tmp, "e"), jn.TRANSFERRED, 10, 1)
+        self.journal.record(jn.DOWNLOAD, "/r/f", os.path.join(self.tmp, "f"), jn.TRANSFERRED, 10, 1)
+        with mock.patch.object(download, "download_file") as download_file:
+            download.recover_from_journal(self.sftp_c, self.stage, self.journal)
+        self.assertEqual(self.stage.jobs, [(os.path.join(self.tmp, "a"), "/r/a", "remote", True),
+                                           (os.path.join(self.tmp, "d"), "/r/d", "remote", False)])
+        self.assertEqual(download_file.call_args_list, [
+            mock.call(self.sftp_c, self.stage, os.path.join(self.tmp, "b"), "/r/b", journal=self.journal,
+                      resume=True),
+            mock.call(self.sftp_c, self.stage, os.path.join(self.tmp, "c"), "/r/c", journal=self.journal,
+                      resume=False),
+        ])
+        self.assertIsNone(self.journal.get(jn.DOWNLOAD, "/r/e"))
+        self.assertIsNone(self.journal.get(jn.DOWNLOAD, "/r/f"))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,85 @@
+# -*- coding:utf-8 -*
+"""
+@File  : test_sftp_client.py
+@Author: DJW
+@Date  : 2023-12-06 15:00
+@Desc  : 获取远程目录树的单元测试：无法列出的子目录只跳过该子目录，连接出错时不返回空树
+"""
+import os
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+
+from paramiko.ssh_exception import SSHException
+
+import local_upload_to_sftp as upload
+from core import planner
+from core.sftp_client import SFTPClient
+from tests.sftp_server import LocalSFTPServer, PASSWORD, USERNAME
+
+
+class RemoteTreeTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmp)
+        self.server = LocalSFTPServer().__enter__()
+        self.addCleanup(self.server.close)
+        self.sftp_c = SFTPClient("127.0.0.1", USERNAME, PASSWORD, self.server.port)
+        self.sftp_c.connect()
+        self.addCleanup(self.sftp_c.disconnect)
+        self.local = os.path.join(self.tmp, "local")
+        self.remote = os.path.join(self.tmp, "remote")
+        for root in (self.local, self.remote):
+            for name in ("a/x.tar.gz", "b/y.tar.gz", "c.tar.gz"):
+                path = os.path.join(root, *name.split("/"))
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                with open(path, "wb") as f:
+                    f.write(b"x" * 10)
+
+    def files(self, tree) -> list:
+        return [os.path.relpath(entry.path, self.remote) for entry in tree.iter_files()]
+
+    def test_tree(self):
+        tree = self.sftp_c.get_remote_tree(self.remote)
+        self.assertEqual(self.files(tree), ["a/x.tar.gz", "b/y.tar.gz", "c.tar.gz"])
+        self.assertEqual(tree.incomplete, [])
+
+    def test_missing_root(self):
+        self.assertEqual(len(self.sftp_c.get_remote_tree(os.path.join(self.tmp, "missing"))), 1)
+
+    def test_unreadable_subdir_is_skipped(self):
+        self.server.denied.add(os.path.join(self.remote, "b"))
+        tree = self.sftp_c.get_remote_tree(self.remote)
+        self.assertEqual(self.files(tree), ["a/x.tar.gz", "c.tar.gz"])
+        self.assertEqual(tree.incomplete, ["b"])
+
+    def test_unreadable_root_raises(self):
+        self.server.denied.add(self.remote)
+        with self.assertRaises(PermissionError):
+            self.sftp_c.get_remote_tree(self.remote)
+
+    def test_connection_error_raises(self):
+        with mock.patch.object(self.sftp_c.sftp, "listdir_attr", side_effect=EOFError):
+            with self.assertRaises(EOFError):
+                self.sftp_c.get_remote_tree(self.remote)
+        with mock.patch.object(self.sftp_c.sftp, "listdir_attr", side_effect=SSHException), \
+                mock.patch.object(self.sftp_c, "reconnect") as reconnect:
+            with self.assertRaises(SSHException):
+                self.sftp_c.get_remote_tree(self.remote)
+        reconnect.assert_called_once()
+
+    def test_upload_skips_unreadable_remote_dir(self):
+        """远程子目录无法列出时，本地对应目录下的文件本轮不上传，而不是按远端不存在全部重传"""
+        self.server.denied.add(os.path.join(self.remote, "b"))
+        values = dict(upload_local_path=self.local, upload_remote_path=self.remote, upload_scan_workers=1,
+                      upload_file_layout=".tar.gz")
+        with mock.patch.dict(upload.CONFIG.values, values):
+            items = list(upload.iter_upload_items(self.sftp_c))
+        self.assertEqual([(os.path.relpath(item.source.path, self.local), item.action) for item in items],
+                         [("a/x.tar.gz", planner.DELETE), ("c.tar.gz", planner.DELETE)])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,61 @@
+# -*- coding:utf-8 -*
+"""
+@File  : test_upload.py
+@Author: DJW
+@Date  : 2023-12-06 14:00
+@Desc  : 上传单个文件的单元测试：硬链接去重模式下重传不改写共用存储的其它文件
+"""
+import os
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+
+import local_upload_to_sftp as upload
+from core.sftp_client import SFTPClient
+from tests.sftp_server import LocalSFTPServer, PASSWORD, USERNAME
+from tests.test_recovery import _Stage
+
+
+class UploadFileTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmp)
+        self.server = LocalSFTPServer().__enter__()
+        self.addCleanup(self.server.close)
+        self.sftp_c = SFTPClient("127.0.0.1", USERNAME, PASSWORD, self.server.port)
+        self.sftp_c.connect()
+        self.addCleanup(self.sftp_c.disconnect)
+        self.local = self.write("local.tar.gz", b"new content")
+        self.remote = self.write("remote.tar.gz", b"old")
+        # 远端文件与另一个文件共用存储（此前由硬链接去重生成）
+        self.linked = os.path.join(self.tmp, "linked.tar.gz")
+        os.link(self.remote, self.linked)
+
+    def write(self, name: str, data: bytes) -> str:
+        path = os.path.join(self.tmp, name)
+        with open(path, "wb") as f:
+            f.write(data)
+        return path
+
+    def read(self, path: str) -> bytes:
+        with open(path, "rb") as f:
+            return f.read()
+
+    def test_retransfer_keeps_other_links(self):
+        with mock.patch.dict(upload.CONFIG.values, upload_dedup_link="hardlink", upload_delta=0):
+            self.assertTrue(upload.upload_file(self.sftp_c, _Stage(), self.local, self.remote))
+        self.assertEqual(self.read(self.remote), b"new content")
+        self.assertEqual(self.read(self.linked), b"old")
+
+    def test_copy_mode_does_not_unlink(self):
+        """copy模式不生成硬链接，重传时不需要额外的删除请求"""
+        with mock.patch.dict(upload.CONFIG.values, upload_dedup_link="copy"):
+            self.assertTrue(upload.upload_file(self.sftp_c, _Stage(), self.local, self.remote))
+        self.assertEqual(self.read(self.remote), b"new content")
+        self.assertEqual(os.stat(self.remote).st_ino, os.stat(self.linked).st_ino)
+
+
+if __name__ == '__main__':
+    unittest.main()